@@ -1,8 +1,16 @@
 from flask import Flask, jsonify
 from flask_cors import CORS
-import subprocess
+import atexit
+import logging
+import logging.handlers
 import os
+import random
 import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
 
 
 app = Flask(__name__)
@@ -11,39 +19,299 @@ CORS(app)
 DAEMON_PATH = "/srv/http/calibre-nilla/irc_dcc_daemon.py"  # <--- Change this
 PID_FILE = "/tmp/irc_dcc_daemon.pid"
 
+# --- SUPERVISOR ---
+# The daemon runs as our child: a monitor thread restarts it when it exits or
+# stops answering /status, backing off exponentially while it keeps failing,
+# and its stdout/stderr go to a size-rotated log. Stopping the controller
+# stops the daemon (its output pipe would otherwise break under it).
+HEALTH_URL = "http://127.0.0.1:5001/status"
+HEALTH_INTERVAL = 10        # seconds between /status probes
+HEALTH_TIMEOUT = 5
+HEALTH_FAILURES = 3         # consecutive failed probes before a restart
+STARTUP_GRACE = 30          # seconds after a start before failed probes count
+RESTART_MIN = 1             # backoff after the first crash, doubling up to RESTART_MAX
+RESTART_MAX = 300
+STABLE_AFTER = 120          # a child that lived this long resets the backoff
+STOP_TIMEOUT = 10           # SIGTERM grace before SIGKILL
+OUTPUT_LOG = "/srv/http/calibre-nilla/ircLog/daemon_output.log"
+OUTPUT_LOG_BYTES = 5 * 1024 * 1024
+OUTPUT_LOG_BACKUPS = 3
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def proc_stats(pid):
+    """Memory, CPU time and thread/fd counts of `pid` from /proc, or None if it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # comm (field 2) may contain spaces; everything after its ")" is fixed-width
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        fds = len(os.listdir(f"/proc/{pid}/fd"))
+    except (OSError, IndexError, ValueError):
+        return None
+    return {
+        "cpu_seconds": (int(fields[11]) + int(fields[12])) / _CLK_TCK,  # utime + stime
+        "threads": int(fields[17]),
+        "rss_bytes": rss_pages * _PAGE_SIZE,
+        "open_fds": fds,
+    }
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Supervisor:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.want_running = False
+        self.proc = None
+        self.started_at = None
+        self.restarts = 0
+        self.crashes = 0            # consecutive, drives the backoff
+        self.next_start = 0.0
+        self.last_exit = None       # {"code", "at", "uptime", "reason"}
+        self.kill_reason = None
+        self.health = {"ok": False, "failures": 0, "last_ok": None, "latency_ms": None, "error": None}
+        self._cpu_sample = None     # (monotonic, cpu_seconds) for the CPU% between /status calls
+        self.output = logging.getLogger("dcc_control.output")
+        self.output.propagate = False
+        self.output.setLevel(logging.INFO)
+        if not self.output.handlers:
+            os.makedirs(os.path.dirname(OUTPUT_LOG), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                OUTPUT_LOG, maxBytes=OUTPUT_LOG_BYTES, backupCount=OUTPUT_LOG_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.output.addHandler(handler)
+        threading.Thread(target=self._monitor, name="supervisor", daemon=True).start()
+
+    def note(self, message):
+        self.output.info(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [supervisor] {message}")
+
+    # --- lifecycle (call with self.lock held) ---
+
+    def _spawn(self):
+        self.proc = subprocess.Popen(
+            ["python3", DAEMON_PATH],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            env={**os.environ, "PYTHONUNBUFFERED": "1"},
+        )
+        self.started_at = time.time()
+        self.kill_reason = None
+        self._cpu_sample = None
+        self.health.update(ok=False, failures=0, latency_ms=None, error=None)
+        with open(PID_FILE, "w") as f:
+            f.write(str(self.proc.pid))
+        threading.Thread(target=self._pump, args=(self.proc,), name="supervisor-output", daemon=True).start()
+        self.note(f"started pid {self.proc.pid}")
+
+    def _reap(self):
+        """Record the exit of a child that has died and schedule its restart."""
+        proc, self.proc = self.proc, None
+        uptime = time.time() - self.started_at
+        reason = self.kill_reason or ("stopped" if not self.want_running else "crashed")
+        self.last_exit = {"code": proc.returncode, "at": time.time(), "uptime": round(uptime, 1), "reason": reason}
+        self.health["ok"] = False
+        if os.path.exists(PID_FILE):
+            os.remove(PID_FILE)
+        if not self.want_running:
+            self.note(f"pid {proc.pid} exited with {proc.returncode}")
+            return
+        self.crashes = 1 if uptime >= STABLE_AFTER else self.crashes + 1
+        delay = min(RESTART_MAX, RESTART_MIN * 2 ** (self.crashes - 1)) * random.uniform(0.8, 1.2)
+        self.next_start = time.monotonic() + delay
+        self.note(f"pid {proc.pid} {reason} (exit {proc.returncode}) after {uptime:.0f}s; restarting in {delay:.1f}s")
+
+    def _terminate(self, proc):
+        try:
+            proc.terminate()
+            proc.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        except ProcessLookupError:
+            pass
+
+    # --- threads ---
+
+    def _pump(self, proc):
+        """Copy the child's output into the rotating log; EOF means it exited, so wake the monitor."""
+        for raw in proc.stdout:
+            self.output.info(raw.decode("utf-8", "replace").rstrip("\n"))
+        proc.stdout.close()
+        proc.wait()
+        self.wake.set()
+
+    def _probe(self):
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(HEALTH_URL, timeout=HEALTH_TIMEOUT) as resp:
+                resp.read()
+            return True, (time.perf_counter() - t0) * 1000, None
+        except Exception as e:
+            return False, None, str(e)
+
+    def _monitor(self):
+        while True:
+            timeout = HEALTH_INTERVAL
+            if self.want_running and self.proc is None:
+                timeout = min(timeout, max(0.0, self.next_start - time.monotonic()))
+            self.wake.wait(timeout)
+            self.wake.clear()
+            with self.lock:
+                if self.proc is not None and self.proc.poll() is not None:
+                    self._reap()
+                if not self.want_running:
+                    continue
+                if self.proc is None:
+                    if time.monotonic() >= self.next_start:
+                        self.restarts += 1
+                        self._spawn()
+                    continue
+                proc, started_at = self.proc, self.started_at
+            ok, latency, error = self._probe()
+            with self.lock:
+                if proc is not self.proc:
+                    continue
+                if ok:
+                    self.health.update(ok=True, failures=0, last_ok=time.time(), latency_ms=round(latency, 1), error=None)
+                    continue
+                self.health.update(ok=False, error=error)
+                if time.time() - started_at < STARTUP_GRACE:
+                    continue
+                self.health["failures"] += 1
+                if self.health["failures"] < HEALTH_FAILURES:
+                    continue
+                self.kill_reason = "unhealthy"
+                self.note(f"pid {proc.pid} failed {HEALTH_FAILURES} health checks ({error}); killing it")
+            # Outside the lock so /status keeps answering while it dies
+            self._terminate(proc)
+            self.wake.set()
+
+    # --- API ---
+
+    def start(self):
+        with self.lock:
+            if self.proc is not None:
+                if self.proc.poll() is None:
+                    return False, "Already running"
+                self._reap()    # died since the monitor last looked: keep its exit in last_exit
+            if os.path.exists(PID_FILE):
+                with open(PID_FILE) as f:
+                    pid = int(f.read() or 0)
+                if pid and pid_alive(pid):
+                    return False, f"Already running (pid {pid}, not started by this controller)"
+                os.remove(PID_FILE)
+                self.note(f"removed stale PID file for pid {pid}")
+            self.want_running = True
+            self.crashes = 0
+            self._spawn()
+        self.wake.set()
+        return True, "Started"
+
+    def stop(self):
+        with self.lock:
+            self.want_running = False
+            proc = self.proc
+        if proc is None:
+            # A daemon left behind by an earlier controller can still be stopped by PID
+            if not os.path.exists(PID_FILE):
+                return False, "Not running"
+            with open(PID_FILE) as f:
+                pid = int(f.read() or 0)
+            os.remove(PID_FILE)
+            if not pid or not pid_alive(pid):
+                return False, "Not running"
+            os.kill(pid, signal.SIGTERM)
+            return True, "Stopped"
+        self._terminate(proc)
+        with self.lock:
+            if self.proc is proc:
+                self._reap()
+        return True, "Stopped"
+
+    def status(self):
+        with self.lock:
+            proc = self.proc
+            running = proc is not None and proc.poll() is None
+            if running:
+                in_grace = time.time() - self.started_at < STARTUP_GRACE
+                state = "running" if self.health["ok"] else "starting" if in_grace else "unhealthy"
+            else:
+                state = "backoff" if self.want_running else "stopped"
+            body = {
+                "running": running,
+                "state": state,
+                "pid": proc.pid if running else None,
+                "uptime": round(time.time() - self.started_at, 1) if running else None,
+                "restarts": self.restarts,
+                "last_exit": self.last_exit,
+                "health": dict(self.health),
+                "output_log": OUTPUT_LOG,
+            }
+            if state == "backoff":
+                body["restart_in"] = round(max(0.0, self.next_start - time.monotonic()), 1)
+        if running:
+            stats = proc_stats(proc.pid)
+            if stats:
+                now = time.monotonic()
+                prev, self._cpu_sample = self._cpu_sample, (now, stats["cpu_seconds"])
+                if prev and now > prev[0]:
+                    stats["cpu_percent"] = round(100 * (stats["cpu_seconds"] - prev[1]) / (now - prev[0]), 1)
+                else:
+                    # First sample: average over the whole lifetime
+                    stats["cpu_percent"] = round(100 * stats["cpu_seconds"] / max(body["uptime"], 1e-3), 1)
+                stats["cpu_seconds"] = round(stats["cpu_seconds"], 2)
+            body["process"] = stats
+        return body
+
+    def shutdown(self):
+        with self.lock:
+            running = self.proc is not None
+        if running:
+            self.stop()
+
+
+supervisor = Supervisor()
+atexit.register(supervisor.shutdown)
+
+
 @app.route("/start", methods=["POST"])
 def start_daemon():
-    if os.path.exists(PID_FILE):
-        return jsonify({"status": "Already running"}), 200
-
-    proc = subprocess.Popen(
-        ["python3", DAEMON_PATH],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
-    with open(PID_FILE, "w") as f:
-        f.write(str(proc.pid))
-    return jsonify({"status": "Started"}), 200
+    started, message = supervisor.start()
+    return jsonify({"status": message}), 200
 
 @app.route("/stop", methods=["POST"])
 def stop_daemon():
-    if not os.path.exists(PID_FILE):
-        return jsonify({"status": "Not running"}), 200
-
-    with open(PID_FILE) as f:
-        pid = int(f.read())
     try:
-        os.kill(pid, signal.SIGTERM)
-        os.remove(PID_FILE)
-        return jsonify({"status": "Stopped"}), 200
+        stopped, message = supervisor.stop()
+        return jsonify({"status": message}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/restart", methods=["POST"])
+def restart_daemon():
+    supervisor.stop()
+    started, message = supervisor.start()
+    return jsonify({"status": "Restarted" if started else message}), 200
+
 @app.route("/status", methods=["GET"])
 def status():
-    running = os.path.exists(PID_FILE)
-    return jsonify({"running": running})
+    return jsonify(supervisor.status())
 
 if __name__ == "__main__":
+    # SIGTERM from the service manager should stop the daemon too, via atexit
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run(port=5050)
-
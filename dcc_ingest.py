@@ -0,0 +1,400 @@
+"""
+Post-download ingest stages for irc_dcc_daemon.py.
+
+Runs in the daemon's ingest process pool, one call to ingest_file() per
+finished download: checksum, format detection (looking inside zip archives),
+title/author extraction from EPUB or PDF metadata (falling back to the
+"Author - Title.ext" filename), indexing of search-bot result archives into
+the dcc_search cache (or unpacking them, without one) and, when a Calibre
+library is configured, insertion into its metadata.db.
+
+Everything here is plain functions on paths so it can be pickled to a
+worker process; nothing is imported from the daemon.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import time
+import unicodedata
+import uuid
+import zipfile
+import xml.etree.ElementTree as ET
+
+import dcc_search
+
+HASH_CHUNK = 1024 * 1024
+PDF_SCAN_BYTES = 1024 * 1024          # PDF Info dicts live near the start or the end
+EBOOK_EXTS = ("epub", "mobi", "azw3", "pdf", "txt")   # same set as extractArchiveBook() in lib/book_ingest.php
+
+NS = {
+    "c": "urn:oasis:names:tc:opendocument:xmlns:container",
+    "opf": "http://www.idpf.org/2007/opf",
+    "dc": "http://purl.org/dc/elements/1.1/",
+}
+
+
+def ingest_file(path, calibre_library=None, search_db=None, search_ttl=None):
+    """
+    Run every stage on a finished download and return a JSON-ready summary.
+
+    Stage failures are recorded under "error" rather than raised, so one bad
+    file never takes the pool down.
+    """
+    t0 = time.monotonic()
+    result = {"path": path, "name": os.path.basename(path), "size": None, "sha256": None,
+              "kind": "unknown", "format": None, "member": None, "title": None, "authors": [],
+              "language": None, "isbn": None, "series": None, "results_path": None, "search": None,
+              "book_id": None, "duplicate_of": None, "library_path": None, "error": None}
+    try:
+        result["size"] = os.path.getsize(path)
+        result["sha256"] = sha256_file(path)
+        result.update(detect_format(path))
+
+        if result["kind"] == "search_results" and search_db:
+            search_id, query, count = dcc_search.index_results(search_db, path, result["member"], search_ttl)
+            result["search"] = {"id": search_id, "query": query, "results": count}
+        elif result["kind"] == "search_results":
+            result["results_path"] = extract_search_results(path, result["member"])
+        elif result["kind"] == "book":
+            result.update(book_metadata(path, result["format"], result["member"]))
+            if calibre_library and result["title"] and result["authors"]:
+                result.update(add_to_calibre(calibre_library, path, result))
+    except Exception as e:
+        result["error"] = repr(e)
+    result["seconds"] = round(time.monotonic() - t0, 3)
+    return result
+
+
+# --- CHECKSUM AND FORMAT ---
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    buf = bytearray(HASH_CHUNK)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def detect_format(path):
+    """Sniff the file's real format; zip archives are opened to see what they hold."""
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    with open(path, "rb") as f:
+        head = f.read(68)
+
+    if head.startswith(b"%PDF-"):
+        return {"kind": "book", "format": "pdf"}
+    if head[60:68] == b"BOOKMOBI":
+        return {"kind": "book", "format": "azw3" if ext == "azw3" else "mobi"}
+    if head.startswith(b"Rar!\x1a\x07"):
+        return {"kind": "archive", "format": "rar"}
+    if head.startswith(b"PK\x03\x04"):
+        return inspect_zip(path)
+    if ext == "txt":
+        return {"kind": "book", "format": ext}
+    # An .epub/.pdf/.mobi without its signature is truncated or mislabelled
+    return {"kind": "unknown", "format": ext or None}
+
+
+def inspect_zip(path):
+    with zipfile.ZipFile(path) as zf:
+        names = zf.namelist()
+        if "mimetype" in names and zf.read("mimetype").strip() == b"application/epub+zip":
+            return {"kind": "book", "format": "epub"}
+        files = [n for n in names if not n.endswith("/")]
+    for name in files:
+        member_ext = os.path.splitext(name)[1].lower().lstrip(".")
+        if member_ext in EBOOK_EXTS and member_ext != "txt":
+            return {"kind": "book", "format": member_ext, "member": name}
+    # Search bots answer "@search ..." with a zip holding one results .txt
+    texts = [n for n in files if n.lower().endswith(".txt")]
+    if texts:
+        return {"kind": "search_results", "format": "txt", "member": texts[0]}
+    return {"kind": "archive", "format": "zip"}
+
+
+def extract_search_results(path, member):
+    """Unpack a search-results archive's .txt next to it and return its path."""
+    out_path = os.path.join(os.path.dirname(path), os.path.basename(member))
+    tmp_path = out_path + ".incomplete"
+    with zipfile.ZipFile(path) as zf, zf.open(member) as src, open(tmp_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, HASH_CHUNK)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+# --- METADATA ---
+
+def book_metadata(path, fmt, member=None):
+    meta = {}
+    try:
+        if fmt == "epub" and member is None:
+            meta = epub_metadata(path)
+        elif fmt == "pdf" and member is None:
+            meta = pdf_metadata(path)
+    except (KeyError, AttributeError, ET.ParseError, zipfile.BadZipFile, ValueError):
+        meta = {}   # broken metadata is common; the filename still names the book
+    fallback = filename_metadata(os.path.basename(member or path))
+    if member and not fallback["authors"]:
+        fallback = filename_metadata(os.path.basename(path))   # "Author - Title.zip" around a bare "Title.mobi"
+    if not meta.get("title"):
+        meta["title"] = fallback["title"]
+    if not meta.get("authors"):
+        meta["authors"] = fallback["authors"]
+    if not meta.get("series") and fallback["series"]:
+        meta["series"] = fallback["series"]
+    return meta
+
+
+def epub_metadata(path):
+    with zipfile.ZipFile(path) as zf:
+        container = ET.fromstring(zf.read("META-INF/container.xml"))
+        rootfile = container.find(".//c:rootfile", NS)
+        opf = ET.fromstring(zf.read(rootfile.get("full-path")))
+    md = opf.find("opf:metadata", NS)
+    if md is None:
+        return {}
+
+    def texts(tag):
+        return [e.text.strip() for e in md.findall(f"dc:{tag}", NS) if e.text and e.text.strip()]
+
+    isbn = None
+    for ident in md.findall("dc:identifier", NS):
+        value = (ident.text or "").strip()
+        scheme = (ident.get(f"{{{NS['opf']}}}scheme") or "").lower()
+        if value.lower().startswith("urn:isbn:"):
+            value, scheme = value[9:], "isbn"
+        digits = value.replace("-", "").replace(" ", "")
+        if scheme == "isbn" or re.fullmatch(r"\d{9}[\dXx]|\d{13}", digits):
+            isbn = digits
+            break
+    series = None
+    for m in md.findall("opf:meta", NS):
+        if m.get("name") == "calibre:series":
+            series = m.get("content")
+    titles = texts("title")
+    languages = texts("language")
+    return {
+        "title": titles[0] if titles else None,
+        "authors": [_unflip(a) for a in texts("creator")],
+        "language": languages[0] if languages else None,
+        "isbn": isbn,
+        "series": series,
+    }
+
+
+_PDF_FIELD = re.compile(rb"/(Title|Author)\s*(\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>)")
+
+
+def pdf_metadata(path):
+    """Title/Author from the PDF Info dictionary, scanning the head and tail of the file."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        blob = f.read(PDF_SCAN_BYTES)
+        if size > PDF_SCAN_BYTES:
+            f.seek(max(size - PDF_SCAN_BYTES, PDF_SCAN_BYTES))
+            blob += f.read()
+    found = {}
+    for key, raw in _PDF_FIELD.findall(blob):
+        value = _pdf_string(raw).strip()
+        if value:
+            found[key.decode()] = value   # last wins: incremental updates append newer Info dicts
+    authors = [_unflip(a) for a in re.split(r"\s*(?:;|&| and )\s*", found.get("Author", "")) if a.strip()]
+    return {"title": found.get("Title"), "authors": authors}
+
+
+def _pdf_string(raw):
+    if raw.startswith(b"<"):
+        hex_digits = re.sub(rb"\s", b"", raw[1:-1]).decode()
+        data = bytes.fromhex(hex_digits + "0" * (len(hex_digits) % 2))
+    else:
+        data = re.sub(rb"\\([nrtbf()\\]|[0-7]{1,3})", _pdf_unescape, raw[1:-1])
+    if data.startswith(b"\xfe\xff"):
+        return data[2:].decode("utf-16-be", errors="replace")
+    return data.decode("latin-1")
+
+
+def _pdf_unescape(m):
+    esc = m.group(1)
+    if esc[:1].isdigit():
+        return bytes([int(esc, 8) & 0xFF])
+    return {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}.get(esc, esc)
+
+
+def filename_metadata(name):
+    """
+    "Author - [Series -] Title (tags).ext" -> title/authors/series, the same
+    split parseIngestFilename() in json_endpoints/auto_ingest_stream.php does.
+    """
+    base = os.path.splitext(name)[0]
+    base = re.sub(r"(\s*\([^)]*\))+$", "", base).strip()
+    parts = base.split(" - ")
+    if len(parts) < 2:
+        return {"title": base, "authors": [], "series": None}
+    title = re.sub(r"^\[[^\]]*\]\s*-\s*", "", parts[-1].strip())
+    return {
+        "title": title,
+        "authors": [_unflip(parts[0].strip())],
+        "series": " - ".join(parts[1:-1]).strip() or None,
+    }
+
+
+def _unflip(author):
+    """"Surname, Firstname" -> "Firstname Surname"."""
+    last, sep, first = author.partition(",")
+    return f"{first.strip()} {last.strip()}" if sep and first.strip() else author.strip()
+
+
+# --- CALIBRE ---
+
+_PARTICLES = {"da", "de", "del", "della", "di", "du", "la", "le", "van", "von", "der", "den", "ter", "ten", "el"}
+_SUFFIXES = {"jr", "jr.", "sr", "sr.", "ii", "iii", "iv"}
+
+
+def _title_sort_fn(title):
+    """Python equivalent of Calibre's title_sort() SQLite function."""
+    if not title:
+        return title
+    for article in ("the ", "a ", "an "):
+        if title.lower().startswith(article):
+            return title[len(article):].strip() + ", " + title[:len(article)].strip()
+    return title
+
+
+def _author_sort_fn(author):
+    """Python equivalent of AuthorSort('invert') in AuthorSortClass.php."""
+    author = (author or "").strip()
+    if not author or "," in author:
+        return author
+    parts = author.split()
+    suffix = ""
+    if len(parts) > 1 and parts[-1].lower() in _SUFFIXES:
+        suffix = " " + parts.pop()
+    if len(parts) <= 1:
+        return " ".join(parts) + suffix
+    last = parts.pop()
+    while len(parts) > 1 and parts[-1].lower() in _PARTICLES:
+        last = parts.pop() + " " + last
+    return f"{last}, {' '.join(parts)}{suffix}".strip()
+
+
+def safe_filename(name, max_length=150):
+    """Same folding as safe_filename() in lib/book_ingest.php."""
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    name = re.sub(r"[^A-Za-z0-9 _.-]", "", name).strip()[:max_length]
+    return name or "untitled"
+
+
+def _open_db(db_path):
+    con = sqlite3.connect(db_path, timeout=30)
+    con.create_function("title_sort", 1, _title_sort_fn)
+    con.create_function("author_sort", 1, _author_sort_fn)
+    con.create_function("uuid4", 0, lambda: str(uuid.uuid4()))
+    con.execute("PRAGMA foreign_keys = ON")
+    return con
+
+
+def add_to_calibre(library, path, meta):
+    """
+    Add a downloaded book to the Calibre library at `library`, moving the file
+    into place the way processBookFromPath() in lib/book_ingest.php does.
+
+    Books whose title and an author already match an existing row are left
+    where they are and reported as duplicates.
+    """
+    title = meta["title"].strip()
+    authors = list(dict.fromkeys(a for a in meta["authors"] if a))
+    first = authors[0]
+    fmt = meta["format"]
+    con = _open_db(os.path.join(library, "metadata.db"))
+    src, tmp_dir, folder, dest = path, None, None, None
+    try:
+        for book_id, names in con.execute(
+                "SELECT b.id, GROUP_CONCAT(a.name, '|') FROM books b "
+                "LEFT JOIN books_authors_link bal ON bal.book = b.id "
+                "LEFT JOIN authors a ON a.id = bal.author "
+                "WHERE lower(b.title) = lower(?) GROUP BY b.id", (title,)):
+            if _authors_match(first, names or ""):
+                return {"duplicate_of": book_id}
+
+        if meta.get("member"):
+            tmp_dir = path + ".extract"
+            with zipfile.ZipFile(path) as zf:
+                src = zf.extract(meta["member"], tmp_dir)
+
+        with con:
+            for author in authors:
+                con.execute("INSERT OR IGNORE INTO authors (name, sort) VALUES (?, author_sort(?))", (author, author))
+            cur = con.execute(
+                "INSERT INTO books (title, sort, author_sort, timestamp, pubdate, series_index, last_modified, path, uuid)"
+                " VALUES (?, title_sort(?), author_sort(?), CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 1.0,"
+                " CURRENT_TIMESTAMP, ?, uuid4())", (title, title, first, safe_filename(title)))
+            book_id = cur.lastrowid
+            for author in authors:
+                con.execute("INSERT OR IGNORE INTO books_authors_link (book, author)"
+                            " SELECT ?, id FROM authors WHERE name = ?", (book_id, author))
+            if meta.get("series"):
+                con.execute("INSERT OR IGNORE INTO series (name, sort) VALUES (?, ?)", (meta["series"], meta["series"]))
+                con.execute("INSERT INTO books_series_link (book, series) SELECT ?, id FROM series WHERE name = ?",
+                            (book_id, meta["series"]))
+            con.execute("INSERT OR IGNORE INTO identifiers (book, type, val) VALUES (?, 'auto_ingest', '1')", (book_id,))
+            if meta.get("isbn"):
+                con.execute("INSERT OR IGNORE INTO identifiers (book, type, val) VALUES (?, 'isbn', ?)",
+                            (book_id, meta["isbn"]))
+
+            author_dir = safe_filename(first + (" et al." if len(authors) > 1 else ""))
+            book_path = f"{author_dir}/{safe_filename(title)} ({book_id})"
+            folder = os.path.join(library, book_path)
+            os.makedirs(folder, exist_ok=True)
+            base_name = f"{safe_filename(title, 110)} - {safe_filename(first, 110)}"
+            dest = os.path.join(folder, f"{base_name}.{fmt}")
+            shutil.move(src, dest)
+
+            con.execute("UPDATE books SET path = ? WHERE id = ?", (book_path, book_id))
+            con.execute("INSERT INTO data (book, format, uncompressed_size, name) VALUES (?, ?, ?, ?)",
+                        (book_id, fmt.upper(), os.path.getsize(dest), base_name))
+            if _extract_cover(dest, os.path.join(folder, "cover.jpg")):
+                con.execute("UPDATE books SET has_cover = 1 WHERE id = ?", (book_id,))
+            con.execute("INSERT OR IGNORE INTO metadata_dirtied (book) VALUES (?)", (book_id,))
+            con.execute("UPDATE books SET last_modified = CURRENT_TIMESTAMP WHERE id = ?", (book_id,))
+        if meta.get("member") and os.path.exists(path):
+            os.remove(path)
+        return {"book_id": book_id, "library_path": book_path}
+    except Exception:
+        # Put the download back for the next attempt and leave no orphan folder behind
+        if dest and os.path.exists(dest) and not meta.get("member"):
+            shutil.move(dest, path)
+        if folder and os.path.isdir(folder):
+            shutil.rmtree(folder, ignore_errors=True)
+        raise
+    finally:
+        con.close()
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _authors_match(a, names):
+    """Share at least one word of 4+ letters, like authorsMatch() in auto_ingest_stream.php."""
+    words = {w for w in re.split(r"[\s,.]+", a.lower()) if len(w) >= 4}
+    return any(w in words for w in re.split(r"[\s,.|]+", names.lower()) if len(w) >= 4)
+
+
+def _extract_cover(book, cover):
+    """Pull the cover out with Calibre's ebook-meta when it is installed."""
+    if not shutil.which("ebook-meta"):
+        return False
+    subprocess.run(["ebook-meta", f"--get-cover={cover}", book], env=dict(os.environ, LANG="C"),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120, check=False)
+    if os.path.exists(cover) and os.path.getsize(cover) > 0:
+        return True
+    if os.path.exists(cover):
+        os.remove(cover)
+    return False
@@ -0,0 +1,177 @@
+"""
+SQLite FTS5 cache of IRC search-bot results.
+
+A search bot answers "@search <terms>" with a zipped text file, one offer per
+line ("!Bot Author - Title.epub ::INFO:: 1.2MB").  index_results() parses
+such a file into (bot, filename, size, format) rows and stores them as one
+search batch; search() answers later queries from every batch younger than
+the TTL, so a repeat search is a local lookup instead of a channel round trip.
+
+The ingest workers write batches and the daemon's HTTP threads read them,
+each through its own connection; WAL mode keeps readers from blocking.
+"""
+
+import os
+import re
+import sqlite3
+import time
+import zipfile
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    id INTEGER PRIMARY KEY,
+    query TEXT NOT NULL,
+    norm TEXT NOT NULL,
+    fetched REAL NOT NULL,
+    source TEXT,
+    results INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS searches_norm ON searches (norm, fetched);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    search INTEGER NOT NULL REFERENCES searches (id) ON DELETE CASCADE,
+    bot TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER,
+    size_text TEXT,
+    format TEXT,
+    cmd TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_search ON results (search);
+CREATE VIRTUAL TABLE IF NOT EXISTS results_fts USING fts5 (
+    filename, content='results', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS results_ad AFTER DELETE ON results BEGIN
+    INSERT INTO results_fts (results_fts, rowid, filename) VALUES ('delete', old.id, old.filename);
+END;
+"""
+
+# "!Bot Author - Title.epub  ::INFO:: 1.2MB  ::HASH:: 0123abcd"
+_LINE = re.compile(r"^!(\S+)\s+(.+?)(?:\s+::INFO::\s*([\d.,]+\s*[KMGT]?i?B)\b.*|\s+::HASH::.*)?\s*$", re.I)
+_SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+# "SearchBot_results_for_ dune messiah.txt.zip" -> "dune messiah"
+_QUERY_FROM_NAME = re.compile(r"results_for[_\s]+(.+?)(?:\.txt)?(?:\.zip)?$", re.I)
+
+
+def open_cache(db_path):
+    con = sqlite3.connect(db_path, timeout=30)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA foreign_keys = ON")
+    con.executescript(SCHEMA)
+    return con
+
+
+def normalise_query(query):
+    return " ".join(re.findall(r"\w+", query.lower()))
+
+
+def parse_size(text):
+    m = re.match(r"([\d.,]+)\s*([KMGT]?)i?B", text or "", re.I)
+    if not m:
+        return None
+    return int(float(m.group(1).replace(",", "")) * _SIZE_UNITS[(m.group(2) + "B").upper()])
+
+
+def parse_results_line(line):
+    """One results-file line -> (bot, filename, size, size_text, format), or None for headers and chatter."""
+    m = _LINE.match(line.strip())
+    if not m:
+        return None
+    bot, filename, size_text = m.group(1), m.group(2).strip(), m.group(3)
+    ext = os.path.splitext(filename)[1].lower().lstrip(".")
+    return bot, filename, parse_size(size_text), size_text, ext or None
+
+
+def query_from_filename(name):
+    m = _QUERY_FROM_NAME.search(os.path.basename(name))
+    return m.group(1).replace("_", " ").strip() if m else ""
+
+
+def read_results(path, member=None):
+    """Lines of a results file, read straight from its zip when given one."""
+    if member:
+        with zipfile.ZipFile(path) as zf:
+            raw = zf.read(member)
+    else:
+        with open(path, "rb") as f:
+            raw = f.read()
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        text = raw.decode("latin-1")
+    return text.splitlines()
+
+
+def index_results(db_path, path, member=None, ttl=None):
+    """
+    Store a results file as a new search batch, replacing older batches for
+    the same query and purging any older than `ttl` seconds. Returns
+    (search id, query, rows stored).
+    """
+    query = query_from_filename(member or path) or query_from_filename(path)
+    rows = [r for r in map(parse_results_line, read_results(path, member)) if r]
+    now = time.time()
+    con = open_cache(db_path)
+    try:
+        with con:
+            norm = normalise_query(query)
+            if norm:
+                con.execute("DELETE FROM searches WHERE norm = ?", (norm,))
+            if ttl:
+                con.execute("DELETE FROM searches WHERE fetched < ?", (now - ttl,))
+            search_id = con.execute(
+                "INSERT INTO searches (query, norm, fetched, source, results) VALUES (?, ?, ?, ?, ?)",
+                (query, norm, now, os.path.basename(path), len(rows))).lastrowid
+            con.executemany(
+                "INSERT INTO results (search, bot, filename, size, size_text, format, cmd)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((search_id, bot, name, size, size_text, fmt, f"!{bot} {name}") for bot, name, size, size_text, fmt in rows))
+            # One bulk insert per batch; a per-row trigger is ~5x slower on big result lists
+            con.execute("INSERT INTO results_fts (rowid, filename) SELECT id, filename FROM results WHERE search = ?",
+                        (search_id,))
+    finally:
+        con.close()
+    return search_id, query, len(rows)
+
+
+def _fts_query(q):
+    """User text -> FTS5 query: every word must match as a prefix."""
+    words = re.findall(r"\w+", q.lower())
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def search(db_path, q, ttl, limit=100, fmt=None):
+    """
+    Cached results for `q` from batches younger than `ttl` seconds.
+
+    Returns {"results": [...], "batch": {...} or None}; "batch" describes the
+    fresh search for this exact query, if there is one.
+    """
+    match = _fts_query(q)
+    if not match or not os.path.exists(db_path):
+        return {"results": [], "batch": None}
+    cutoff = time.time() - ttl
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5)
+    con.row_factory = sqlite3.Row
+    try:
+        batch = con.execute(
+            "SELECT query, fetched, results FROM searches WHERE norm = ? AND fetched >= ? ORDER BY fetched DESC LIMIT 1",
+            (normalise_query(q), cutoff)).fetchone()
+        # bm25() is only allowed in the MATCH query itself, so rank there and
+        # collapse the same offer seen in several batches outside it
+        sql = ("SELECT r.bot, r.filename, r.size, r.size_text, r.format, r.cmd, s.fetched, results_fts.rank AS rank"
+               " FROM results_fts JOIN results r ON r.id = results_fts.rowid JOIN searches s ON s.id = r.search"
+               " WHERE results_fts MATCH ? AND s.fetched >= ?")
+        params = [match, cutoff]
+        if fmt:
+            sql += " AND r.format = ?"
+            params.append(fmt.lower())
+        sql = ("SELECT bot, filename, size, size_text, format, cmd, MAX(fetched) AS fetched, MIN(rank) AS rank"
+               f" FROM ({sql}) GROUP BY bot, filename ORDER BY rank LIMIT ?")
+        params.append(limit)
+        results = [dict(row) for row in con.execute(sql, params)]
+    finally:
+        con.close()
+    for row in results:
+        del row["rank"]
+    return {"results": results, "batch": dict(batch) if batch else None}
@@ -1,23 +1,43 @@
+import asyncio
+import atexit
+import concurrent.futures
+import contextlib
+import ctypes
+import ctypes.util
+import difflib
+import errno
+import itertools
+import json
+import multiprocessing
+import random
 import socket
+import sqlite3
 import struct
+import sys
 import threading
 import time
 import os
 import re
+import stat
+import zlib
 import logging
-from flask import Flask, request, jsonify
+import mmap
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from collections import deque
+from collections import deque, namedtuple
+
+import dcc_ingest
+import dcc_search
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all endpoints
 
 # Suppress Werkzeug access-log noise for frequent polling endpoints
-_SILENT_PATHS = {'/status', '/logs', '/downloaded-files'}
+_SILENT_PATHS = {'/status', '/logs', '/downloaded-files', '/events', '/requests', '/metrics', '/search'}
 class _PollFilter(logging.Filter):
     def filter(self, record):
         msg = record.getMessage()
-        return not any(f'"GET {p} HTTP' in msg for p in _SILENT_PATHS)
+        return not any(f'"GET {p}{sep}' in msg for p in _SILENT_PATHS for sep in (' ', '?', '/'))
 
 logging.getLogger('werkzeug').addFilter(_PollFilter())
 
@@ -33,146 +53,1717 @@ CONFIG = {
     "DOWNLOAD_DIR": "/srv/http/calibre-nilla/downloads",
     "SIMILAR_DOWNLOAD_DIR": "/mnt/library/autobooks",
     "LOG_FILE": "/srv/http/calibre-nilla/ircLog/dcc_log",
-    "DEBUG_LOG_SIZE": 20
+    "DEBUG_LOG_SIZE": 20,
+    "LOG_LEVEL": "debug",               # debug (raw IRC lines) | info | warning | error
+    "LOG_FORMAT": "text",               # text ("[ts] message") or json (one object per line)
+    "LOG_STDOUT": True,
+    "LOG_IRC_SAMPLE": 1.0,              # fraction of raw IRC lines to keep (1.0 = all, 0 = none)
+    "LOG_MAX_BYTES": 10 * 1024 * 1024,  # rotate LOG_FILE at this size...
+    "LOG_BACKUPS": 5,                   # ...keeping LOG_FILE.1 .. LOG_FILE.5
+    "LOG_QUEUE_MAX": 10000,             # pending records before debug records are dropped
+    "LOG_BATCH_SIZE": 200,
+    "LOG_FLUSH_INTERVAL": 0.5,          # seconds between batched writes
+    "LOG_RING_SIZE": 2000,              # recent records /logs serves from memory
+    "LOG_TAIL_MAX_BYTES": 4 * 1024 * 1024,  # most /logs will read from disk per request
+    "DCC_RECV_BUFFER": 1024 * 1024,     # reusable receive buffer, flushed to disk when full
+    "DCC_PREALLOCATE": True,            # reserve each file's full size on disk before receiving
+    "DCC_FSYNC": True,                  # fsync a finished file once before renaming it into place
+    "DCC_MIN_FREE": 256 * 1024 * 1024,  # refuse offers that would leave less than this free
+    "DCC_SOCKET_RCVBUF": 4 * 1024 * 1024,
+    "MAX_TRANSFERS": 8,                 # concurrent DCC transfers; further offers wait their turn
+    "MAX_TRANSFERS_PER_BOT": 2,         # concurrent transfers from any one sender
+    "DCC_RATE_LIMIT": None,             # bytes/sec across all transfers (None = unlimited)
+    "DCC_RATE_LIMIT_PER_BOT": None,     # bytes/sec from any one sender
+    "DCC_RATE_LIMIT_BULK": None,        # bytes/sec across bulk-priority transfers, leaving the rest for interactive ones
+    "DCC_RATE_BURST": 1.0,              # seconds of rate a limiter lets through at once
+    "DCC_CONNECT_TIMEOUT": 30,
+    "DCC_IDLE_TIMEOUT": 120,            # give up on a transfer after this long without data
+    "DCC_RESUME_TIMEOUT": 30,           # wait this long for DCC ACCEPT before restarting from byte zero
+    "REQUEST_TTL": 3600,                # a queued /request-file expires if no offer arrives in this time
+    "REQUEST_HISTORY": 500,             # finished requests kept for /requests/<id>
+    "EVENT_HISTORY": 2000,              # transfer events kept for /events cursors to resume from
+    "PROGRESS_EVENT_INTERVAL": 1.0,     # seconds between progress events per transfer
+    "IRC_CONNECT_TIMEOUT": 30,
+    "IRC_PING_INTERVAL": 120,           # PING the server after this long without any traffic
+    "IRC_PING_TIMEOUT": 60,             # and drop the link if nothing comes back within this
+    "IRC_RECONNECT_MIN": 2,             # first reconnect delay; doubles per failed attempt
+    "IRC_RECONNECT_MAX": 300,
+    "INGEST_WORKERS": 2,                # processes running post-download ingest; 0 turns ingest off
+    "CALIBRE_LIBRARY": None,            # Calibre library dir; if set, finished books are added to its metadata.db
+    "CALIBRE_DESTS": ("default",),      # request destinations whose books go into CALIBRE_LIBRARY
+    "SEARCH_DB": "/srv/http/calibre-nilla/ircLog/search_cache.db",  # FTS cache of search-bot results
+    "SEARCH_TTL": 12 * 3600,            # cached search results older than this are ignored and purged
+    "SEARCH_RESEND_AFTER": 120,         # don't repeat the same @search on the channel within this many seconds
 }
 # ======================
 
-IRC_SOCKET = None
 irc_connected = False
 irc_last_messages = deque(maxlen=CONFIG["DEBUG_LOG_SIZE"])
 
-_next_dest = "default"
-_dest_lock = threading.Lock()
 
 
 # --- LOGGING ---
-def log_event(message):
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    log_line = f"[{timestamp}] {message}"
-    print(log_line)
-    with open(CONFIG["LOG_FILE"], "a", encoding="utf-8") as log_file:
-        log_file.write(log_line + "\n")
+# log_event() only appends a record to an in-memory queue; a single writer
+# thread formats records, writes them in batches to a persistently open
+# LOG_FILE (rotating it by size) and echoes them to stdout.  Debug records
+# (raw IRC lines) can be sampled with LOG_IRC_SAMPLE and are the only ones
+# dropped if the queue backs up; transfer records and warnings/errors are
+# always kept.
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+
+class LogWriter:
+    """Queue-backed, batching, size-rotating writer for the daemon log."""
+
+    def __init__(self):
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closing = False
+        self._fh = None
+        self._size = 0
+        # (start offset, end offset, level, kind, line) of the newest records
+        # in the current LOG_FILE; guarded by ring_lock together with _size
+        self.ring = deque(maxlen=CONFIG["LOG_RING_SIZE"])
+        self.ring_lock = threading.Lock()
+        self.stats = {"queued": 0, "written": 0, "dropped": 0, "sampled_out": 0,
+                      "filtered": 0, "batches": 0, "rotations": 0, "errors": 0}
+
+    def submit(self, record):
+        """Queue (time, level, kind, message); never blocks on I/O."""
+        with self._cond:
+            if len(self._pending) >= CONFIG["LOG_QUEUE_MAX"] and record[1] == "debug" and record[2] != "transfer":
+                self.stats["dropped"] += 1
+                return
+            self._pending.append(record)
+            self.stats["queued"] = len(self._pending)
+            if len(self._pending) >= CONFIG["LOG_BATCH_SIZE"]:
+                self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def close(self, timeout=5):
+        """Flush everything queued and stop the writer thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+            thread = self._thread
+        if thread:
+            thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._pending) < CONFIG["LOG_BATCH_SIZE"] and not self._closing:
+                    self._cond.wait(CONFIG["LOG_FLUSH_INTERVAL"])
+                batch = list(self._pending)
+                self._pending.clear()
+                self.stats["queued"] = 0
+                closing = self._closing
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    print(f"Log writer error: {e!r}")
+            if closing:
+                if self._fh:
+                    self._fh.close()
+                return
+
+    @staticmethod
+    def format(record):
+        ts, level, kind, message = record
+        if CONFIG["LOG_FORMAT"] == "json":
+            stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(ts)) + f".{int(ts % 1 * 1000):03d}"
+            return json.dumps({"ts": stamp, "level": level, "kind": kind, "msg": message}, ensure_ascii=False)
+        return f"[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))}] {message}"
+
+    def _write(self, batch):
+        lines = [self.format(record) + "\n" for record in batch]
+        if CONFIG["LOG_STDOUT"]:
+            sys.stdout.write("".join(lines))
+            sys.stdout.flush()
+        encoded = [line.encode("utf-8") for line in lines]
+        data = b"".join(encoded)
+        if self._fh is None:
+            self._open()
+        if self._size and self._size + len(data) > CONFIG["LOG_MAX_BYTES"]:
+            self._rotate()
+        self._fh.write(data)
+        self._fh.flush()
+        with self.ring_lock:
+            offset = self._size
+            for record, line, raw in zip(batch, lines, encoded):
+                self.ring.append((offset, offset + len(raw), record[1], record[2], line))
+                offset += len(raw)
+            self._size = offset
+        self.stats["written"] += len(batch)
+        self.stats["batches"] += 1
+
+    def _open(self):
+        os.makedirs(os.path.dirname(CONFIG["LOG_FILE"]) or ".", exist_ok=True)
+        self._fh = open(CONFIG["LOG_FILE"], "ab")
+        with self.ring_lock:
+            self._size = self._fh.tell()
+
+    def snapshot(self):
+        """
+        (ring records, bytes in the current LOG_FILE) taken together, so the
+        size never counts a record the copy of the ring is missing.
+        """
+        with self.ring_lock:
+            ring = list(self.ring)
+            if self._fh is not None:
+                return ring, self._size
+        try:
+            return ring, os.path.getsize(CONFIG["LOG_FILE"])
+        except OSError:
+            return ring, 0
+
+    def _rotate(self):
+        self._fh.close()
+        path = CONFIG["LOG_FILE"]
+        for i in range(CONFIG["LOG_BACKUPS"] - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        if CONFIG["LOG_BACKUPS"] > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.truncate(path, 0)
+        self.stats["rotations"] += 1
+        with self.ring_lock:
+            self.ring.clear()
+        self._open()
+
+
+_log = LogWriter()
+atexit.register(_log.close)
+
+
+def log_event(message, level="info", kind="daemon"):
+    """Log a message. `kind` is "irc" for raw traffic, "transfer" for DCC transfers, else "daemon"."""
+    if LOG_LEVELS[level] < LOG_LEVELS[CONFIG["LOG_LEVEL"]]:
+        _log.stats["filtered"] += 1
+        return
+    if kind == "irc" and CONFIG["LOG_IRC_SAMPLE"] < 1.0 and random.random() >= CONFIG["LOG_IRC_SAMPLE"]:
+        _log.stats["sampled_out"] += 1
+        return
+    _log.submit((time.time(), level, kind, message))
+
+
+# --- LOG READING ---
+# /logs is answered from the writer's ring of recent records when it covers
+# the request, and otherwise by reading LOG_FILE in blocks from the end (or
+# forward from a cursor), never more than LOG_TAIL_MAX_BYTES per request, so
+# its cost does not depend on how large the log has grown.
+LOG_FILTERS = {
+    "all": lambda level, kind: True,
+    "transfer": lambda level, kind: kind == "transfer",
+    "error": lambda level, kind: LOG_LEVELS.get(level, 20) >= LOG_LEVELS["warning"],
+}
+_LOG_BLOCK = 64 * 1024
+
+
+def _log_line_kind(line):
+    """Best-effort (level, kind) of a line read back from LOG_FILE."""
+    if line.startswith("{"):
+        try:
+            rec = json.loads(line)
+            return rec.get("level", "info"), rec.get("kind", "daemon")
+        except ValueError:
+            pass
+    if "] IRC >> " in line:
+        return "debug", "irc"
+    level = "error" if ("❌" in line or "Error" in line) else "warning" if "⚠️" in line else "info"
+    kind = "transfer" if any(m in line for m in ("DCC SEND", " to receive ", "✅", "⚠️ Incomplete", "❌ Error receiving")) \
+        else "daemon"
+    return level, kind
+
+
+def _tail_file(n, match, size):
+    """Last `n` matching lines of LOG_FILE, reading backwards from `size` in blocks."""
+    found = []
+    carry = b""
+    pos = size
+    budget = CONFIG["LOG_TAIL_MAX_BYTES"]
+    with open(CONFIG["LOG_FILE"], "rb") as f:
+        while pos > 0 and len(found) < n and budget > 0:
+            step = min(_LOG_BLOCK, pos, budget)
+            pos -= step
+            budget -= step
+            f.seek(pos)
+            chunk = f.read(step) + carry
+            parts = chunk.split(b"\n")
+            carry = parts.pop(0) if pos > 0 else b""
+            for raw in reversed(parts):
+                if raw:
+                    line = raw.decode("utf-8", errors="replace") + "\n"
+                    if match(*_log_line_kind(line)):
+                        found.append(line)
+                        if len(found) == n:
+                            break
+        if carry and len(found) < n and pos == 0:
+            line = carry.decode("utf-8", errors="replace") + "\n"
+            if match(*_log_line_kind(line)):
+                found.append(line)
+    found.reverse()
+    return found
+
+
+def _read_file_from(after, n, match, size):
+    """Up to `n` matching lines starting at byte `after`; returns (lines, next cursor)."""
+    found = []
+    with open(CONFIG["LOG_FILE"], "rb") as f:
+        f.seek(after)
+        data = f.read(min(size - after, CONFIG["LOG_TAIL_MAX_BYTES"]))
+    cursor = after
+    for raw in data.split(b"\n")[:-1]:      # the last piece is an unterminated remainder
+        cursor += len(raw) + 1
+        line = raw.decode("utf-8", errors="replace") + "\n"
+        if raw and match(*_log_line_kind(line)):
+            found.append(line)
+            if len(found) == n:
+                break
+    return found, cursor
+
+
+def read_log(n, after=None, match=LOG_FILTERS["all"]):
+    """
+    Read the daemon log.  Returns (lines, cursor).
+
+    Without `after`: the last `n` matching lines.  With `after` (a byte
+    offset returned as a previous cursor): up to `n` matching lines written
+    since, oldest first.  `cursor` is the offset to pass as `after` next
+    time; an `after` beyond the end of the file (it was rotated) restarts
+    from the top of the new file.
+    """
+    ring, size = _log.snapshot()
+    if after is not None:
+        after = 0 if after > size else max(after, 0)
+        if ring and ring[0][0] <= after:
+            lines, cursor = [], size
+            for start, end, level, kind, line in ring:
+                if start >= after and match(level, kind):
+                    lines.append(line)
+                    if len(lines) == n:
+                        cursor = end
+                        break
+            return lines, cursor
+        if not os.path.exists(CONFIG["LOG_FILE"]):
+            return [], 0
+        return _read_file_from(after, n, match, size)
+
+    lines = [line for _, _, level, kind, line in ring if match(level, kind)]
+    if len(lines) >= n or (ring and ring[0][0] == 0):
+        return lines[-n:], size
+    if not os.path.exists(CONFIG["LOG_FILE"]):
+        return lines, size
+    return _tail_file(n, match, size), size
+
+
+# --- EVENT LOOP ---
+# IRC and every DCC transfer run as tasks on one asyncio loop in a background
+# thread; Flask handlers talk to it only through irc_send() and
+# LOOP.call_soon_threadsafe().
+LOOP = None
+_irc_out = None          # asyncio.Queue of outgoing IRC lines, drained by irc_writer()
+_tasks = set()           # strong references to running transfer tasks
+
+
+def spawn(coro):
+    """Schedule a coroutine on the event loop, keeping a reference until it finishes."""
+    task = asyncio.ensure_future(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+def irc_send(line):
+    """Queue a raw IRC line for the single writer task. Safe to call from any thread."""
+    if LOOP is None or _irc_out is None:
+        raise ConnectionError("IRC loop is not running")
+    LOOP.call_soon_threadsafe(_irc_out.put_nowait, line)
+
+
+# --- DOWNLOAD REQUESTS ---
+# Every /request-file call gets a request record; incoming DCC offers are
+# matched back to the queued request they answer (by bot nick, then by how
+# closely the offered filename matches the requested one) so each file lands
+# in its request's destination and callers can follow their own request.
+_requests = {}           # request id -> record dict, oldest first
+_requests_lock = threading.Lock()
+_request_seq = itertools.count(1)
+
+
+def _normalise_filename(name):
+    """Lowercase alphanumerics only, without XDCC '::INFO::' or '[1.2 MB]' suffixes."""
+    name = name.split(" ::")[0]
+    name = re.sub(r"\s+\[\d[\d.,]*\s*\w*\]$", "", name)
+    return re.sub(r"[\W_]+", "", name.lower())
+
+
+def parse_request_cmd(cmd):
+    """Split an XDCC request like '!Bot Author - Title.epub' into (bot, filename)."""
+    if cmd.startswith("!"):
+        bot, _, wanted = cmd[1:].partition(" ")
+        return bot, wanted.strip()
+    return None, ""
+
+
+def _prune_requests(now):
+    """Expire stale queued requests and drop the oldest finished ones. Lock must be held."""
+    for req in _requests.values():
+        if req["state"] == "queued" and now - req["created"] > CONFIG["REQUEST_TTL"]:
+            req["state"] = "expired"
+            req["finished"] = now
+    finished = [rid for rid, req in _requests.items() if req["state"] not in ("queued", "transferring")]
+    for rid in finished[:max(0, len(finished) - CONFIG["REQUEST_HISTORY"])]:
+        del _requests[rid]
+
+
+PRIORITIES = ("interactive", "bulk")
+
+
+def _new_request(cmd, bot, wanted, dest, now, priority="interactive"):
+    """Create and register a queued request record. Lock must be held."""
+    req = {
+        "id": f"r{next(_request_seq)}-{int(now)}",
+        "cmd": cmd,
+        "bot": bot,
+        "wanted": wanted,
+        "dest": dest,
+        "priority": priority,
+        "state": "queued",
+        "created": now,
+        "started": None,
+        "finished": None,
+        "filename": None,
+        "size": None,
+        "sent": None,
+        "bytes": 0,
+        "offset": 0,
+        "waited": None,
+        "error": None,
+        "ingest": None,
+    }
+    _requests[req["id"]] = req
+    return req
+
+
+def add_request(cmd, dest="default", priority="interactive"):
+    """Record a /request-file command and return its new request record."""
+    bot, wanted = parse_request_cmd(cmd)
+    now = time.time()
+    with _requests_lock:
+        _prune_requests(now)
+        return _new_request(cmd, bot, wanted, dest, now, priority)
+
+
+def match_offer(nick, filename, size):
+    """
+    Claim the queued request that a DCC offer from `nick` most likely answers.
+
+    Requests to the same bot win, ranked by filename similarity (oldest first
+    on ties); with no request to that bot, a near-identical filename from any
+    request is accepted.  An offer nobody asked for (usually a search bot's
+    results list) gets a fresh interactive record with the default
+    destination so it can still be tracked.
+    """
+    target = _normalise_filename(filename)
+    nick = (nick or "").lower()
+    now = time.time()
+    with _requests_lock:
+        _prune_requests(now)
+        queued = [req for req in _requests.values() if req["state"] == "queued"]
+        best, best_score = None, 0.0
+        for req in queued:
+            score = difflib.SequenceMatcher(None, target, _normalise_filename(req["wanted"])).ratio()
+            if (req["bot"] or "").lower() == nick:
+                score += 1.0
+            if score > best_score:
+                best, best_score = req, score
+        if best is not None and best_score < 0.8:
+            best = None
+        if best is None:
+            best = _new_request(None, nick or None, filename, "default", now)
+        best.update(state="transferring", started=now, finished=None, filename=filename, size=size)
+        return best
+
+
+def finish_request(req, state, error=None):
+    with _requests_lock:
+        req["state"] = state
+        req["finished"] = time.time()
+        req["error"] = error
+
+
+def request_snapshot(req):
+    """JSON-ready copy of a request record with elapsed time and throughput."""
+    with _requests_lock:
+        snap = dict(req)
+    if snap["started"]:
+        elapsed = (snap["finished"] or time.time()) - snap["started"]
+        snap["elapsed"] = round(elapsed, 3)
+        moved = snap["bytes"] - snap["offset"]
+        snap["bytes_per_sec"] = round(moved / elapsed) if elapsed > 0 else None
+    return snap
+
+
+# --- TRANSFER EVENTS ---
+# Transfer lifecycle events (started, progress, completed, failed) go into a
+# numbered ring buffer.  /events streams them as Server-Sent Events and
+# /events/poll long-polls them; both resume from an event id cursor.
+_events = deque(maxlen=CONFIG["EVENT_HISTORY"])
+_event_seq = 0
+_events_cond = threading.Condition()
+
+
+def emit_event(kind, req, **extra):
+    """Append a transfer event for request `req` and wake any waiting readers."""
+    global _event_seq
+    ev = {
+        "event": kind,
+        "time": time.time(),
+        "request_id": req["id"],
+        "filename": req["filename"],
+        "dest": req["dest"],
+        "size": req["size"],
+        "bytes": req["bytes"],
+    }
+    ev.update(extra)
+    with _events_cond:
+        _event_seq += 1
+        ev["id"] = _event_seq
+        _events.append(ev)
+        _events_cond.notify_all()
+
+
+def events_after(cursor, timeout=0, request_id=None):
+    """
+    Return (events newer than `cursor`, new cursor, missed).
+
+    Blocks up to `timeout` seconds for the first matching event.  `missed` is
+    True when the cursor is older than the ring buffer, i.e. some events were
+    dropped before the caller came back for them, or newer than any event
+    (a cursor from before a daemon restart), in which case everything still
+    buffered is replayed.
+    """
+    deadline = time.monotonic() + timeout
+    with _events_cond:
+        restarted = cursor > _event_seq
+        if restarted:
+            cursor = 0
+        while True:
+            missed = restarted or (bool(_events) and cursor < _events[0]["id"] - 1)
+            found = [ev for ev in _events if ev["id"] > cursor
+                     and (request_id is None or ev["request_id"] == request_id)]
+            remaining = deadline - time.monotonic()
+            if found or remaining <= 0:
+                return found, _event_seq, missed
+            _events_cond.wait(remaining)
+
+
+def current_event_cursor():
+    with _events_cond:
+        return _event_seq
+
+
+# --- METRICS ---
+# Counters and gauges for /metrics and /status.  Everything here is written
+# only from the IRC loop thread; HTTP threads read copies.
+_metrics = {
+    "transfers_started": 0,
+    "transfers_completed": 0,
+    "transfers_failed": 0,
+    "transfers_retried": 0,     # offers for a file an earlier attempt left as .incomplete
+    "transfers_resumed": 0,     # ... of which the sender accepted DCC RESUME
+    "transfers_refused": 0,     # offers too big for the free space left in their destination
+    "bytes_received": 0,
+    "irc_connects": 0,
+    "irc_disconnects": 0,
+    "irc_resent": 0,            # request commands held while offline and sent after rejoining
+    "irc_ready_seconds": None,  # last time from losing (or first opening) the link to rejoining the channel
+    "loop_lag": 0.0,
+    "loop_lag_max": 0.0,
+    "ingest_pending": 0,
+    "ingest_done": 0,
+    "ingest_failed": 0,
+}
+_active_transfers = {}                  # request id -> (sender, monotonic start of data, request record)
+_ttfb_samples = deque(maxlen=500)       # seconds from connect to first byte, recent transfers
+_rate_samples = deque(maxlen=500)       # bytes/sec of recent completed transfers
+_bot_stats = {}                         # sender nick -> {"completed", "failed", "bytes", "seconds"}
+LOOP_LAG_INTERVAL = 0.5
+
+
+def record_transfer(sender, ok, moved, seconds):
+    """Fold one finished transfer into the aggregate and per-bot counters."""
+    _metrics["transfers_completed" if ok else "transfers_failed"] += 1
+    bot = _bot_stats.setdefault(sender or "?", {"completed": 0, "failed": 0, "bytes": 0, "seconds": 0.0})
+    bot["completed" if ok else "failed"] += 1
+    bot["bytes"] += moved
+    bot["seconds"] += seconds
+    if ok and seconds > 0:
+        _rate_samples.append(moved / seconds)
+
+
+async def monitor_loop_lag():
+    """Measure how late the event loop wakes from a fixed sleep; a busy loop delays every transfer."""
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(loop.time() - t0 - LOOP_LAG_INTERVAL, 0.0)
+        _metrics["loop_lag"] = lag
+        _metrics["loop_lag_max"] = max(_metrics["loop_lag_max"], lag)
+
+
+def _summary(samples):
+    values = sorted(samples)
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p90": None, "max": None}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": values[len(values) // 2],
+        "p90": values[min(len(values) - 1, int(len(values) * 0.9))],
+        "max": values[-1],
+    }
+
+
+def metrics_snapshot():
+    """JSON-ready view of the transfer, IRC and loop metrics."""
+    now = time.monotonic()
+    counters = dict(_metrics)
+    active = []
+    for rid, (sender, since, req) in list(_active_transfers.items()):
+        moved = req["bytes"] - req["offset"]
+        elapsed = now - since
+        active.append({"request_id": rid, "bot": sender, "filename": req["filename"],
+                       "bytes": req["bytes"], "size": req["size"],
+                       "bytes_per_sec": round(moved / elapsed) if elapsed > 0 else None})
+    with _requests_lock:
+        states = {}
+        for req in _requests.values():
+            states[req["state"]] = states.get(req["state"], 0) + 1
+    bots = {}
+    for nick, b in list(_bot_stats.items()):
+        bots[nick] = dict(b, bytes_per_sec=round(b["bytes"] / b["seconds"]) if b["seconds"] > 0 else None)
+    return {
+        "transfers": {
+            "active": len(active),
+            "waiting": sum(_scheduler.depth().values()),
+            "started": counters["transfers_started"],
+            "completed": counters["transfers_completed"],
+            "failed": counters["transfers_failed"],
+            "retried": counters["transfers_retried"],
+            "resumed": counters["transfers_resumed"],
+            "refused": counters["transfers_refused"],
+            "bytes_received": counters["bytes_received"],
+            "bytes_per_sec": sum(t["bytes_per_sec"] or 0 for t in active),
+            "active_list": active,
+        },
+        "throughput": _summary(_rate_samples),
+        "time_to_first_byte": _summary(_ttfb_samples),
+        "bots": bots,
+        "requests": states,
+        "irc": {
+            "connected": irc_connected,
+            "connects": counters["irc_connects"],
+            "reconnects": max(counters["irc_connects"] - 1, 0),
+            "disconnects": counters["irc_disconnects"],
+            "resent": counters["irc_resent"],
+            "held": len(_held_requests),
+            "restart_to_ready": counters["irc_ready_seconds"],
+        },
+        "scheduler": _scheduler.snapshot(),
+        "loop_lag": {"last": counters["loop_lag"], "max": counters["loop_lag_max"]},
+        "ingest": {
+            "pending": counters["ingest_pending"],
+            "done": counters["ingest_done"],
+            "failed": counters["ingest_failed"],
+        },
+    }
+
+
+def render_prometheus(snap):
+    """Prometheus text exposition (format 0.0.4) of a metrics_snapshot()."""
+    out = []
+
+    def metric(name, kind, help_text, samples):
+        out.append(f"# HELP ircdcc_{name} {help_text}")
+        out.append(f"# TYPE ircdcc_{name} {kind}")
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_text = ",".join(f'{k}="{_prom_escape(v)}"' for k, v in labels.items())
+            out.append(f"ircdcc_{name}{{{label_text}}} {value}" if label_text else f"ircdcc_{name} {value}")
+
+    t = snap["transfers"]
+    metric("transfers_active", "gauge", "DCC transfers currently receiving.", [({}, t["active"])])
+    metric("transfers_waiting", "gauge", "DCC offers waiting for a transfer slot.", [({}, t["waiting"])])
+    sched = snap["scheduler"]
+    metric("transfers_queued", "gauge", "DCC offers waiting for a transfer slot, by priority.",
+           [({"priority": p}, q["queued"]) for p, q in sched["queues"].items()])
+    metric("transfer_wait_seconds", "summary", "Time offers waited for a transfer slot.",
+           [({"priority": p, "quantile": qt}, q["wait"][key]) for p, q in sched["queues"].items()
+            for qt, key in (("0.5", "p50"), ("0.9", "p90"))])
+    metric("transfers_throttled_seconds_total", "counter", "Time transfers spent paused by rate limits.",
+           [({}, round(sched["throttled_seconds"], 3))])
+    metric("transfers_started_total", "counter", "DCC transfers that connected.", [({}, t["started"])])
+    metric("transfers_completed_total", "counter", "DCC transfers received in full.", [({}, t["completed"])])
+    metric("transfers_failed_total", "counter", "DCC transfers that failed.", [({}, t["failed"])])
+    metric("transfers_retried_total", "counter", "Offers for a file left incomplete by an earlier attempt.",
+           [({}, t["retried"])])
+    metric("transfers_resumed_total", "counter", "Transfers resumed with DCC RESUME.", [({}, t["resumed"])])
+    metric("transfers_refused_total", "counter", "Offers refused for lack of disk space.", [({}, t["refused"])])
+    metric("bytes_received_total", "counter", "Bytes received over DCC.", [({}, t["bytes_received"])])
+    metric("receive_bytes_per_second", "gauge", "Aggregate receive rate of active transfers.",
+           [({}, t["bytes_per_sec"])])
+    for name, key, help_text in (
+            ("transfer_bytes_per_second", "throughput", "Throughput of recent completed transfers."),
+            ("time_to_first_byte_seconds", "time_to_first_byte", "Time from connect to first byte.")):
+        summary = snap[key]
+        metric(name, "summary", help_text,
+               [({"quantile": "0.5"}, summary["p50"]), ({"quantile": "0.9"}, summary["p90"])])
+        if summary["count"]:
+            out.append(f"ircdcc_{name}_sum {summary['mean'] * summary['count']}")
+        out.append(f"ircdcc_{name}_count {summary['count']}")
+    bots = snap["bots"].items()
+    metric("bot_transfers_total", "counter", "Finished transfers per sending bot.",
+           [({"bot": nick, "result": result}, b[result]) for nick, b in bots for result in ("completed", "failed")])
+    metric("bot_bytes_total", "counter", "Bytes received per sending bot.", [({"bot": nick}, b["bytes"]) for nick, b in bots])
+    metric("bot_bytes_per_second", "gauge", "Mean receive rate per sending bot.",
+           [({"bot": nick}, b["bytes_per_sec"]) for nick, b in bots])
+    metric("requests", "gauge", "Download requests by state.",
+           [({"state": state}, count) for state, count in snap["requests"].items()])
+    irc = snap["irc"]
+    metric("irc_connected", "gauge", "1 while joined to the channel.", [({}, int(irc["connected"]))])
+    metric("irc_reconnects_total", "counter", "IRC connections after the first.", [({}, irc["reconnects"])])
+    metric("irc_disconnects_total", "counter", "IRC connections lost.", [({}, irc["disconnects"])])
+    metric("irc_resent_total", "counter", "Request commands sent after a reconnect.", [({}, irc["resent"])])
+    metric("irc_held_requests", "gauge", "Request commands waiting for the channel.", [({}, irc["held"])])
+    metric("irc_restart_to_ready_seconds", "gauge", "Time from the last disconnect to rejoining the channel.",
+           [({}, irc["restart_to_ready"])])
+    metric("loop_lag_seconds", "gauge", "Event loop wake-up delay at the last check.", [({}, snap["loop_lag"]["last"])])
+    metric("loop_lag_max_seconds", "gauge", "Largest event loop wake-up delay seen.", [({}, snap["loop_lag"]["max"])])
+    ingest = snap["ingest"]
+    metric("ingest_pending", "gauge", "Finished downloads waiting for or in the ingest pool.", [({}, ingest["pending"])])
+    metric("ingest_total", "counter", "Finished downloads run through ingest.",
+           [({"result": "done"}, ingest["done"]), ({"result": "failed"}, ingest["failed"])])
+    for key, value in _log.stats.items():
+        if key == "queued":
+            metric("log_queued", "gauge", "Log records waiting for the writer thread.", [({}, value)])
+        else:
+            metric(f"log_{key}_total", "counter", f"Log writer count of {key.replace('_', ' ')}.", [({}, value)])
+    return "\n".join(out) + "\n"
+
+
+def _prom_escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# --- TRANSFER SCHEDULER ---
+# Every DCC offer waits here for a transfer slot before connecting.  A slot
+# needs room under MAX_TRANSFERS overall and MAX_TRANSFERS_PER_BOT for its
+# sender; waiting offers are served interactive first, then bulk, each class
+# in arrival order, skipping any whose sender is already at its limit.  While
+# receiving, optional token buckets (overall, per sender, bulk only) pace the
+# reads, and TCP flow control slows the sender to match.  Runs on the IRC
+# loop only; HTTP threads read snapshot().
+class TokenBucket:
+    """Byte-rate limiter that lets `rate * DCC_RATE_BURST` bytes through at once and then paces."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate * CONFIG["DCC_RATE_BURST"]
+        self.stamp = time.monotonic()
+
+    def take(self, n, now):
+        """Spend `n` bytes (going into debt if need be); return seconds to wait before the next read."""
+        burst = self.rate * CONFIG["DCC_RATE_BURST"]
+        self.tokens = min(burst, self.tokens + (now - self.stamp) * self.rate) - n
+        self.stamp = now
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class TransferScheduler:
+    def __init__(self):
+        self.waiting = {p: deque() for p in PRIORITIES}   # [future, sender, priority, enqueued] entries
+        self.active = 0
+        self.active_by_bot = {}
+        self.wait_samples = {p: deque(maxlen=500) for p in PRIORITIES}
+        self.granted = {p: 0 for p in PRIORITIES}
+        self.buckets = {}         # (scope, key) -> TokenBucket, rebuilt if its CONFIG rate changes
+        self.throttled_seconds = 0.0
+
+    def _has_room(self, sender):
+        return (self.active < CONFIG["MAX_TRANSFERS"]
+                and self.active_by_bot.get(sender, 0) < CONFIG["MAX_TRANSFERS_PER_BOT"])
+
+    def _grant(self, sender):
+        self.active += 1
+        self.active_by_bot[sender] = self.active_by_bot.get(sender, 0) + 1
+
+    def _dispatch(self):
+        """Hand free slots to the first eligible waiters, interactive before bulk."""
+        for priority in PRIORITIES:
+            queue = self.waiting[priority]
+            for entry in list(queue):
+                if self.active >= CONFIG["MAX_TRANSFERS"]:
+                    return
+                fut, sender = entry[0], entry[1]
+                if fut.done() or not self._has_room(sender):
+                    continue
+                queue.remove(entry)
+                self._grant(sender)
+                fut.set_result(None)
+
+    async def acquire(self, sender, priority):
+        """Wait for a transfer slot; returns the seconds spent waiting."""
+        sender = (sender or "?").lower()
+        priority = priority if priority in PRIORITIES else "interactive"
+        t0 = time.monotonic()
+        if self._has_room(sender) and not any(self.waiting.values()):
+            self._grant(sender)
+        else:
+            entry = [asyncio.get_running_loop().create_future(), sender, priority, t0]
+            self.waiting[priority].append(entry)
+            self._dispatch()
+            try:
+                await entry[0]
+            except asyncio.CancelledError:
+                if entry in self.waiting[priority]:
+                    self.waiting[priority].remove(entry)
+                elif entry[0].done() and not entry[0].cancelled():
+                    self.release(sender)   # granted just as we were cancelled
+                raise
+        waited = time.monotonic() - t0
+        self.wait_samples[priority].append(waited)
+        self.granted[priority] += 1
+        return waited
+
+    def release(self, sender):
+        sender = (sender or "?").lower()
+        self.active -= 1
+        left = self.active_by_bot.get(sender, 1) - 1
+        if left:
+            self.active_by_bot[sender] = left
+        else:
+            self.active_by_bot.pop(sender, None)
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, sender, req):
+        """Hold a transfer slot for request `req` (recording how long it waited) from `sender`."""
+        waited = await self.acquire(sender, req["priority"])
+        req["waited"] = round(waited, 3)
+        if waited >= 1:
+            log_event(f"{req['filename']} waited {waited:.1f}s for a transfer slot ({req['priority']})",
+                      kind="transfer")
+        try:
+            yield
+        finally:
+            self.release(sender)
+
+    def _bucket(self, scope, key, rate):
+        bucket = self.buckets.get((scope, key))
+        if bucket is None or bucket.rate != rate:
+            bucket = self.buckets[(scope, key)] = TokenBucket(rate)
+        return bucket
+
+    def throttle(self, sender, priority):
+        """Coroutine function pacing one transfer's reads, or None when no rate limit applies."""
+        sender = (sender or "?").lower()
+        limits = [("all", None, CONFIG["DCC_RATE_LIMIT"]),
+                  ("bot", sender, CONFIG["DCC_RATE_LIMIT_PER_BOT"])]
+        if priority == "bulk":
+            limits.append(("bulk", None, CONFIG["DCC_RATE_LIMIT_BULK"]))
+        limits = [(scope, key, rate) for scope, key, rate in limits if rate]
+        if not limits:
+            return None
+
+        async def pace(n):
+            now = time.monotonic()
+            delay = max(self._bucket(scope, key, rate).take(n, now) for scope, key, rate in limits)
+            if delay > 0:
+                self.throttled_seconds += delay
+                await asyncio.sleep(delay)
+        return pace
+
+    def depth(self):
+        # Called from Flask threads too: list() copies each deque in one step,
+        # where iterating it directly races the loop adding and removing waiters
+        return {p: sum(1 for entry in list(q) if not entry[0].done()) for p, q in self.waiting.items()}
+
+    def snapshot(self):
+        now = time.monotonic()
+        queues = {}
+        for priority, queue in self.waiting.items():
+            entries = list(queue)
+            by_bot = {}
+            for entry in entries:
+                by_bot[entry[1]] = by_bot.get(entry[1], 0) + 1
+            queues[priority] = {
+                "queued": len(entries),
+                "oldest_wait": round(now - min(e[3] for e in entries), 3) if entries else None,
+                "by_bot": by_bot,
+                "granted": self.granted[priority],
+                "wait": _summary(self.wait_samples[priority]),
+            }
+        return {
+            "limits": {
+                "max_transfers": CONFIG["MAX_TRANSFERS"],
+                "max_transfers_per_bot": CONFIG["MAX_TRANSFERS_PER_BOT"],
+                "rate_limit": CONFIG["DCC_RATE_LIMIT"],
+                "rate_limit_per_bot": CONFIG["DCC_RATE_LIMIT_PER_BOT"],
+                "rate_limit_bulk": CONFIG["DCC_RATE_LIMIT_BULK"],
+            },
+            "active": self.active,
+            "active_by_bot": dict(self.active_by_bot),
+            "queues": queues,
+            "throttled_seconds": self.throttled_seconds,
+        }
+
+
+_scheduler = TransferScheduler()
+
+
+# --- DOWNLOAD DIRECTORY INDEX ---
+# /downloaded-files is served from an in-memory index per destination
+# directory instead of listing and stat()ing the whole directory per request.
+# The index is kept current by our own transfers (DirIndex.refresh) and by an
+# inotify watcher for files added, removed or renamed by anything else.  Where
+# inotify is unavailable it falls back to rescanning when the directory's
+# mtime changes.
+IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO = 0x4, 0x8, 0x40, 0x80
+IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF = 0x100, 0x200, 0x400, 0x800
+IN_Q_OVERFLOW, IN_IGNORED = 0x4000, 0x8000
+_INOTIFY_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+                 | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+_INOTIFY_EVENT = struct.Struct("iIII")
+_INDEX_EPOCH = f"{os.getpid():x}{int(time.time()):x}"   # keeps ETags unique across restarts
+
+
+def _libc():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        return None
+
+
+class DirIndex:
+    """Cached listing of one download directory: name -> entry dict."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.version = 0
+        self.dir_mtime = None
+        self.watching = False
+        self._sorted = {}       # (key, reverse) -> list, valid for the current version
+        os.makedirs(path, exist_ok=True)
+        self.rescan()
+        self.watching = self._start_inotify()
+
+    @staticmethod
+    def _entry(name, st):
+        return {
+            "name": name,
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "modified": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(st.st_mtime)),
+        }
+
+    def _changed(self):
+        """Bump the version; lock must be held."""
+        self.version += 1
+        self._sorted.clear()
+
+    def rescan(self):
+        entries = {}
+        with os.scandir(self.path) as it:
+            for de in it:
+                try:
+                    if de.is_file():
+                        entries[de.name] = self._entry(de.name, de.stat())
+                except OSError:
+                    pass
+        with self.lock:
+            self.dir_mtime = os.stat(self.path).st_mtime_ns
+            if entries != self.entries:
+                self.entries = entries
+                self._changed()
+
+    def refresh(self, name):
+        """Re-stat a single file (adding, updating or removing its entry)."""
+        try:
+            st = os.stat(os.path.join(self.path, name))
+            entry = self._entry(name, st) if stat.S_ISREG(st.st_mode) else None
+        except OSError:
+            entry = None
+        with self.lock:
+            if entry is None:
+                if self.entries.pop(name, None) is not None:
+                    self._changed()
+            elif self.entries.get(name) != entry:
+                self.entries[name] = entry
+                self._changed()
+
+    def _start_inotify(self):
+        libc = _libc()
+        if libc is None or not hasattr(libc, "inotify_init1"):
+            return False
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            return False
+        if libc.inotify_add_watch(fd, os.fsencode(self.path), _INOTIFY_MASK) < 0:
+            os.close(fd)
+            return False
+        threading.Thread(target=self._watch, args=(fd,), name=f"inotify:{self.path}", daemon=True).start()
+        return True
+
+    def _watch(self, fd):
+        try:
+            while True:
+                data = os.read(fd, 65536)
+                names = set()
+                rescan = False
+                for mask, name in self._parse_inotify(data):
+                    if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                        rescan = True
+                    elif name:
+                        names.add(name)
+                if rescan:
+                    break
+                for name in names:
+                    self.refresh(name)
+        except OSError as e:
+            log_event(f"inotify watcher for {self.path} stopped: {e!r}", "warning")
+        finally:
+            os.close(fd)
+        # Fall back to mtime-checked rescans (the directory may have been replaced)
+        self.watching = False
+        if os.path.isdir(self.path):
+            self.rescan()
+
+    @staticmethod
+    def _parse_inotify(data):
+        pos = 0
+        while pos + _INOTIFY_EVENT.size <= len(data):
+            _, mask, _, length = _INOTIFY_EVENT.unpack_from(data, pos)
+            pos += _INOTIFY_EVENT.size
+            name = data[pos:pos + length].split(b"\0", 1)[0]
+            pos += length
+            yield mask, os.fsdecode(name)
+
+    def listing(self, sort="mtime", reverse=True):
+        """Return (version, entries sorted by `sort`), refreshing live .incomplete sizes."""
+        if not self.watching:
+            try:
+                if os.stat(self.path).st_mtime_ns != self.dir_mtime:
+                    self.rescan()
+            except FileNotFoundError:
+                os.makedirs(self.path, exist_ok=True)
+                self.rescan()
+        with self.lock:
+            partial = [n for n in self.entries if n.endswith(".incomplete")]
+        for name in partial:
+            self.refresh(name)
+        with self.lock:
+            key = (sort, reverse)
+            if key not in self._sorted:
+                self._sorted[key] = sorted(self.entries.values(), key=lambda e: e[sort], reverse=reverse)
+            return self.version, self._sorted[key]
+
+
+_dir_indexes = {}
+_dir_indexes_lock = threading.Lock()
+
+
+def dest_dir(dest):
+    return CONFIG["SIMILAR_DOWNLOAD_DIR"] if dest == "similar" else CONFIG["DOWNLOAD_DIR"]
+
+
+def dir_index(dest):
+    """The DirIndex for a destination key ("default" or "similar"), created on first use."""
+    path = dest_dir(dest)
+    with _dir_indexes_lock:
+        index = _dir_indexes.get(path)
+        if index is None:
+            index = _dir_indexes[path] = DirIndex(path)
+        return index
+
+
+# --- IRC PROTOCOL ---
+IRCMessage = namedtuple("IRCMessage", "prefix nick command params")
+
+
+class IRCLineBuffer:
+    """
+    Reassemble IRC lines from arbitrary chunks of a byte stream.
+
+    Bytes are kept across feed() calls until a line terminator arrives, so a
+    line split across two reads is never cut in half.  Only complete lines are
+    decoded (UTF-8, falling back to Latin-1 for bots that send legacy
+    filenames).  A runaway line longer than `max_line` is discarded rather
+    than buffered forever.
+    """
+
+    def __init__(self, max_line=16384):
+        self.max_line = max_line
+        self._buf = bytearray()
+
+    def feed(self, data):
+        """Add received bytes; return the list of complete lines they finish."""
+        self._buf += data
+        if b"\n" not in data:
+            if len(self._buf) > self.max_line:
+                self._buf.clear()
+            return []
+        *complete, rest = self._buf.split(b"\n")
+        self._buf = bytearray(rest)
+        lines = []
+        for raw in complete:
+            raw = raw.rstrip(b"\r")
+            if not raw or len(raw) > self.max_line:
+                continue
+            try:
+                lines.append(raw.decode("utf-8"))
+            except UnicodeDecodeError:
+                lines.append(raw.decode("latin-1"))
+        return lines
+
+
+def parse_irc_line(line):
+    """
+    Split a raw IRC line into prefix, sender nick, command and params (RFC 1459).
+
+    The trailing ":"-parameter is returned as the last element of params with
+    its spaces intact.  IRCv3 message tags are skipped.  Returns None for a
+    line with no command.
+    """
+    prefix = nick = None
+    if line.startswith("@"):
+        _, _, line = line.partition(" ")
+    if line.startswith(":"):
+        prefix, _, line = line[1:].partition(" ")
+        nick = prefix.split("!", 1)[0]
+    line, sep, trailing = line.partition(" :")
+    params = line.split()
+    if not params:
+        return None
+    command = params.pop(0).upper()
+    if sep:
+        params.append(trailing)
+    return IRCMessage(prefix, nick, command, params)
 
 
 # --- IRC HANDLING ---
-def irc_connect():
-    global IRC_SOCKET, irc_connected
-    IRC_SOCKET = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+async def irc_writer(writer):
+    """Sole owner of the IRC stream's write side; serialises all outgoing lines."""
+    while True:
+        line = await _irc_out.get()
+        writer.write(f"{line}\r\n".encode())
+        await writer.drain()
+
+
+async def irc_main():
+    """
+    Supervise the IRC link: run sessions back to back, reconnecting with
+    exponential backoff (plus jitter) whenever one drops or fails to connect.
+
+    Transfers are separate tasks on the same loop and keep running while the
+    link is down; request commands issued meanwhile are held and sent once
+    the channel is rejoined.
+    """
+    global _down_since
+    lag_task = asyncio.create_task(monitor_loop_lag())
+    delay = CONFIG["IRC_RECONNECT_MIN"]
+    _down_since = time.monotonic()
+    try:
+        while True:
+            try:
+                await irc_session()
+            except (OSError, asyncio.TimeoutError) as e:
+                log_event(f"IRC connection failed: {e!r}", "warning")
+            if _down_since is None:
+                # The session got as far as joining: start the backoff over
+                _down_since = time.monotonic()
+                delay = CONFIG["IRC_RECONNECT_MIN"]
+            hold_unconfirmed_requests()
+            wait = delay * random.uniform(0.8, 1.2)
+            log_event(f"Reconnecting in {wait:.1f}s...", "warning")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, CONFIG["IRC_RECONNECT_MAX"])
+    finally:
+        lag_task.cancel()
+
+
+async def irc_session():
+    """One connection: log in, then read until the server or a PING timeout ends it."""
+    global _irc_out, _nick, irc_connected
+    _irc_out = asyncio.Queue()   # lines queued for a dead link are dropped with it
+    _nick = CONFIG["NICKNAME"]
+
     log_event(f"Connecting to {CONFIG['IRC_SERVER']}:{CONFIG['IRC_PORT']}...")
-    IRC_SOCKET.connect((CONFIG["IRC_SERVER"], CONFIG["IRC_PORT"]))
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(CONFIG["IRC_SERVER"], CONFIG["IRC_PORT"]), CONFIG["IRC_CONNECT_TIMEOUT"])
     log_event("Connected to server, logging in...")
+    _metrics["irc_connects"] += 1
+    writer_task = asyncio.create_task(irc_writer(writer))
 
-    IRC_SOCKET.sendall(f"NICK {CONFIG['NICKNAME']}\r\n".encode())
-    IRC_SOCKET.sendall(f"USER {CONFIG['NICKNAME']} 0 * :Python DCC Receiver\r\n".encode())
+    irc_send(f"NICK {_nick}")
+    irc_send(f"USER {CONFIG['NICKNAME']} 0 * :Python DCC Receiver")
+
+    try:
+        await irc_listener(reader)
+    finally:
+        irc_connected = False
+        _metrics["irc_disconnects"] += 1
+        writer_task.cancel()
+        writer.close()
+
+
+# --- HELD REQUESTS ---
+# /request-file commands are handed to the loop thread, which sends them at
+# once while joined and otherwise holds them until the channel is rejoined.
+_held_requests = deque()    # request records waiting for the channel; loop thread only
+_down_since = None          # monotonic time the link was lost, None while joined
+_last_rx = 0.0              # wall time of the last line from the server
+_nick = CONFIG["NICKNAME"]  # nick in use this session (differs if ours was taken)
+
+
+def queue_request_cmd(req):
+    """Hand a request's command to the IRC loop. Safe to call from any thread."""
+    if LOOP is None:
+        raise ConnectionError("IRC loop is not running")
+    LOOP.call_soon_threadsafe(_send_or_hold, req)
+
+
+def _send_or_hold(req):
+    if req["state"] != "queued":
+        return
+    if irc_connected:
+        _irc_out.put_nowait(f"PRIVMSG {CONFIG['CHANNEL']} :{req['cmd']}")
+        req["sent"] = time.time()
+    elif req not in _held_requests:
+        _held_requests.append(req)
+
+
+def hold_unconfirmed_requests():
+    """
+    After a disconnect, hold queued requests sent since the server was last
+    heard from: the dead link may have swallowed them.
+    """
+    with _requests_lock:
+        lost = [req for req in _requests.values()
+                if req["state"] == "queued" and req["sent"] and req["sent"] >= _last_rx]
+    for req in lost:
+        req["sent"] = None
+        if req not in _held_requests:
+            _held_requests.append(req)
+    if lost:
+        log_event(f"Holding {len(lost)} request(s) sent after the link went quiet", "warning")
+
+
+def flush_held_requests():
+    resent = 0
+    while _held_requests:
+        req = _held_requests.popleft()
+        if req["state"] == "queued":
+            _send_or_hold(req)
+            resent += 1
+    if resent:
+        _metrics["irc_resent"] += resent
+        log_event(f"Sent {resent} request(s) held while disconnected")
+
+
+def on_ping(msg):
+    irc_send(f"PONG :{msg.params[0] if msg.params else CONFIG['IRC_SERVER']}")
+
+
+def on_welcome(msg):
+    log_event(f"Successfully logged in as {_nick}.")
+    irc_send(f"JOIN {CONFIG['CHANNEL']}")
+    log_event(f"Joining {CONFIG['CHANNEL']}...")
+
+
+def on_join(msg):
+    global irc_connected, _down_since
+    if (msg.nick or "").lower() == _nick.lower() and \
+            msg.params and msg.params[0].lower() == CONFIG["CHANNEL"].lower():
+        log_event(f"Joined {CONFIG['CHANNEL']} successfully!")
+        irc_connected = True
+        if _down_since is not None:
+            _metrics["irc_ready_seconds"] = round(time.monotonic() - _down_since, 3)
+            log_event(f"IRC ready in {_metrics['irc_ready_seconds']}s")
+            _down_since = None
+        flush_held_requests()
+
+
+def on_nick_in_use(msg):
+    """433: our nick is taken, typically by our own ghost after a PING timeout."""
+    global _nick
+    _nick = f"{CONFIG['NICKNAME']}_{random.randint(100, 999)}"
+    log_event(f"Nick in use, retrying as {_nick}", "warning")
+    irc_send(f"NICK {_nick}")
+
+
+def on_kick(msg):
+    global irc_connected, _down_since
+    if len(msg.params) > 1 and msg.params[1].lower() == _nick.lower():
+        log_event(f"Kicked from {msg.params[0]}; rejoining", "warning")
+        irc_connected = False
+        _down_since = time.monotonic()
+        LOOP.call_later(CONFIG["IRC_RECONNECT_MIN"], irc_send, f"JOIN {CONFIG['CHANNEL']}")
 
-    while True:
-        data = IRC_SOCKET.recv(4096).decode(errors='ignore')
-        for line in data.split("\r\n"):
-            if line:
-                log_event(f"IRC >> {line}")
-                irc_last_messages.append(line)
-                if "001" in line:
-                    log_event(f"Successfully logged in as {CONFIG['NICKNAME']}.")
-                    IRC_SOCKET.sendall(f"JOIN {CONFIG['CHANNEL']}\r\n".encode())
-                    log_event(f"Joining {CONFIG['CHANNEL']}...")
-                if f"JOIN :{CONFIG['CHANNEL']}" in line and CONFIG['NICKNAME'] in line:
-                    log_event(f"Joined {CONFIG['CHANNEL']} successfully!")
-                    irc_connected = True
-                    threading.Thread(target=irc_listener, daemon=True).start()
-                    return
 
+def handle_privmsg(msg):
+    text = msg.params[-1] if len(msg.params) > 1 else ""
+    if text.startswith("\x01DCC ACCEPT "):
+        accept = parse_dcc_accept(text)
+        waiter = accept and _pending_resumes.get((msg.nick.lower(), accept[1]))
+        if waiter and not waiter.done():
+            waiter.set_result(accept[2])
+        return
+    if not text.startswith(("\x01DCC SEND ", "\x01DCC TSEND ")):
+        return
+    dcc_info = parse_dcc_send(text)
+    if dcc_info:
+        filename, ip, port, size, turbo = dcc_info
+        req = match_offer(msg.nick, filename, size)
+        mode = " turbo" if turbo else ""
+        log_event(f"Received DCC SEND{mode} offer: {filename} ({size} bytes) from {msg.nick} at {ip}:{port} "
+                  f"[request={req['id']} dest={req['dest']}]", kind="transfer")
+        spawn(receive_dcc_file(ip, port, filename, size, req, turbo, sender=msg.nick))
 
-def irc_pinger(data):
-    if data.startswith("PING"):
-        pong_reply = f"PONG {data.split()[1]}\r\n"
-        IRC_SOCKET.sendall(pong_reply.encode())
 
+# Command (or numeric) -> handler taking an IRCMessage
+IRC_HANDLERS = {
+    "PING": on_ping,
+    "001": on_welcome,
+    "JOIN": on_join,
+    "KICK": on_kick,
+    "433": on_nick_in_use,
+    "PRIVMSG": handle_privmsg,
+}
+
+
+def dispatch_irc_line(line):
+    """Record a received line and hand its parsed form to the matching handler."""
+    log_event(f"IRC >> {line}", "debug", "irc")
+    irc_last_messages.append(line)
+    msg = parse_irc_line(line)
+    if msg is None:
+        return
+    handler = IRC_HANDLERS.get(msg.command)
+    if handler:
+        try:
+            handler(msg)
+        except Exception as e:
+            log_event(f"Error handling IRC {msg.command}: {e!r}", "error")
 
-def irc_listener():
+
+async def irc_listener(reader):
+    global _last_rx
+    framer = IRCLineBuffer()
+    probing = False
     while True:
         try:
-            data = IRC_SOCKET.recv(4096).decode(errors='ignore')
+            wait = CONFIG["IRC_PING_TIMEOUT"] if probing else CONFIG["IRC_PING_INTERVAL"]
+            try:
+                data = await asyncio.wait_for(reader.read(65536), wait)
+            except asyncio.TimeoutError:
+                if probing:
+                    log_event(f"No reply to PING in {wait}s; dropping the connection", "warning")
+                    break
+                probing = True
+                irc_send(f"PING :{CONFIG['IRC_SERVER']}")
+                continue
+            probing = False
             if not data:
+                log_event("IRC connection closed by server", "warning")
                 break
-            for line in data.split("\r\n"):
-                if line.strip():
-                    log_event(f"IRC >> {line}")
-                    irc_last_messages.append(line)
-                    irc_pinger(line)
-                    handle_privmsg(line)
+            _last_rx = time.time()
+            for line in framer.feed(data):
+                dispatch_irc_line(line)
         except Exception as e:
-            log_event(f"IRC Listener Error: {e}")
+            log_event(f"IRC Listener Error: {e!r}", "error")
             break
 
 
-def handle_privmsg(line):
-    global _next_dest
-    if "PRIVMSG" in line and "DCC SEND" in line:
-        dcc_info = parse_dcc_send(line)
-        if dcc_info:
-            filename, ip, port, size = dcc_info
-            with _dest_lock:
-                dest = _next_dest
-                _next_dest = "default"
-            log_event(f"Received DCC SEND offer: {filename} ({size} bytes) from {ip}:{port} [dest={dest}]")
-            threading.Thread(target=receive_dcc_file, args=(ip, port, filename, size, dest), daemon=True).start()
-
-
 def parse_dcc_send(message):
     """
     Parse CTCP DCC SEND messages (quoted & unquoted filenames).
+
+    DCC TSEND offers are accepted too; they announce a "turbo" sender that
+    does not expect acknowledgements.
     """
     try:
-        match = re.search(r'DCC SEND\s+(?:"(.+?)"|(\S+))\s+(\d+)\s+(\d+)\s+(\d+)', message)
+        match = re.search(r'DCC (T?)SEND\s+(?:"(.+?)"|(\S+))\s+(\d+)\s+(\d+)\s+(\d+)', message)
         if not match:
-            log_event(f"Failed to match DCC SEND in message: {message}")
+            log_event(f"Failed to match DCC SEND in message: {message}", "warning", "transfer")
             return None
 
-        filename = match.group(1) if match.group(1) else match.group(2)
-        ip_int = int(match.group(3))
-        port = int(match.group(4))
-        size = int(match.group(5))
+        turbo = match.group(1) == "T"
+        filename = match.group(2) if match.group(2) else match.group(3)
+        ip_int = int(match.group(4))
+        port = int(match.group(5))
+        size = int(match.group(6))
 
         ip = socket.inet_ntoa(struct.pack('!I', ip_int))
-        return filename, ip, port, size
+        return filename, ip, port, size, turbo
     except Exception as e:
-        log_event(f"Failed to parse DCC SEND: {e} | Message: {message}")
+        log_event(f"Failed to parse DCC SEND: {e} | Message: {message}", "warning", "transfer")
         return None
 
 
-def receive_dcc_file(ip, port, filename, filesize, dest="default"):
-    """Accept DCC connection and download file with .incomplete flag."""
-    dest_dir = CONFIG["SIMILAR_DOWNLOAD_DIR"] if dest == "similar" else CONFIG["DOWNLOAD_DIR"]
-    os.makedirs(dest_dir, exist_ok=True)
-    final_path = os.path.join(dest_dir, filename)
-    temp_path = final_path + ".incomplete"
+def parse_dcc_accept(message):
+    """Parse a CTCP DCC ACCEPT reply into (filename, port, position), or None."""
+    match = re.search(r'DCC ACCEPT\s+(?:"(.+?)"|(\S+))\s+(\d+)\s+(\d+)', message)
+    if not match:
+        log_event(f"Failed to match DCC ACCEPT in message: {message}", "warning", "transfer")
+        return None
+    return match.group(1) or match.group(2), int(match.group(3)), int(match.group(4))
+
+
+# --- DCC RESUME ---
+# A dropped transfer leaves its .incomplete file behind.  When the same file
+# is offered again the daemon asks the sender to resume from the bytes it
+# already has (DCC RESUME), waits for DCC ACCEPT and appends from there.
+
+_PARTIAL_SIZE_XATTR = "user.dcc.size"
+_pending_resumes = {}   # (sender nick, port) -> Future for the accepted position; loop thread only
 
+
+def _tag_partial(fd, filesize):
+    """Record the offered size on a .incomplete file so a later offer can be matched to it."""
     try:
-        log_event(f"Connecting to {ip}:{port} to receive {filename} ({filesize} bytes)...")
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((ip, port))
-
-        bytes_received = 0
-        with open(temp_path, "wb") as f:
-            while bytes_received < filesize:
-                data = s.recv(4096)
-                if not data:
-                    break
-                f.write(data)
-                bytes_received += len(data)
-                ack = struct.pack("!I", bytes_received)
-                s.send(ack)
+        os.setxattr(fd, _PARTIAL_SIZE_XATTR, str(filesize).encode())
+    except (AttributeError, OSError):
+        pass  # no xattr support; resumable_offset() falls back to the length check
 
-        s.close()
 
-        if bytes_received < filesize:
-            log_event(f"⚠️ Incomplete download: {filename} received {bytes_received} / {filesize} bytes")
-        else:
-            os.rename(temp_path, final_path)
-            log_event(f"✅ File {filename} received successfully ({bytes_received} bytes)")
+def resumable_offset(temp_path, filesize):
+    """
+    Bytes of `temp_path` a transfer of a `filesize`-byte file can resume from, or 0.
 
-    except Exception as e:
-        log_event(f"❌ Error receiving file {filename}: {e}")
+    The partial file must be shorter than the offer and, where the filesystem
+    kept it, carry the same size it was started with.
+    """
+    try:
+        have = os.path.getsize(temp_path)
+    except OSError:
+        return 0
+    if not 0 < have < filesize:
+        return 0
+    try:
+        recorded = int(os.getxattr(temp_path, _PARTIAL_SIZE_XATTR))
+    except (AttributeError, OSError, ValueError):
+        return have
+    return have if recorded == filesize else 0
+
+
+async def negotiate_resume(sender, filename, port, offset):
+    """Ask `sender` to resume the offer on `port` from `offset`; return the accepted position or 0."""
+    key = (sender.lower(), port)
+    waiter = asyncio.get_running_loop().create_future()
+    _pending_resumes[key] = waiter
+    name = f'"{filename}"' if " " in filename else filename
+    try:
+        irc_send(f"PRIVMSG {sender} :\x01DCC RESUME {name} {port} {offset}\x01")
+        position = await asyncio.wait_for(waiter, CONFIG["DCC_RESUME_TIMEOUT"])
+    except asyncio.TimeoutError:
+        log_event(f"No DCC ACCEPT from {sender} for {filename}; restarting from byte 0", "warning", "transfer")
+        return 0
+    finally:
+        _pending_resumes.pop(key, None)
+    if not 0 < position <= offset:
+        log_event(f"{sender} accepted {filename} at {position} (asked {offset}); restarting from byte 0",
+                  "warning", "transfer")
+        return 0
+    return position
+
+
+# --- DISK WRITER ---
+# The offer carries the file size, so the whole file is reserved up front
+# with fallocate(FALLOC_FL_KEEP_SIZE): the filesystem can hand out one run of
+# extents instead of growing the file a buffer at a time between other
+# transfers' writes, and a full disk fails the transfer before it starts.
+# KEEP_SIZE leaves st_size at the bytes actually written, which the resume
+# and size checks rely on.  Finished files get one fsync before the rename.
+FALLOC_FL_KEEP_SIZE = 0x1
+_fallocate = None
+
+
+def preallocate(fd, offset, length):
+    """Reserve [offset, offset + length) of `fd` without changing its size; False where unsupported."""
+    global _fallocate
+    if _fallocate is None:
+        libc = _libc()
+        _fallocate = getattr(libc, "fallocate", False) if libc else False
+        if _fallocate:
+            _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+    if not _fallocate or length <= 0:
+        return False
+    if _fallocate(fd, FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        err = ctypes.get_errno()
+        if err != errno.EOPNOTSUPP:
+            log_event(f"fallocate failed: {os.strerror(err)}", "debug", "transfer")
+        return False
+    return True
+
+
+def release_preallocation(fd):
+    """Give back blocks reserved past the end of a partial file."""
+    try:
+        os.ftruncate(fd, os.fstat(fd).st_size)
+    except OSError:
+        pass
+
+
+def free_space(path):
+    """Bytes available to us on the filesystem holding `path`, or None if unknown."""
+    try:
+        st = os.statvfs(path)
+    except OSError:
+        return None
+    return st.f_bavail * st.f_frsize
+
+
+_DCC_ACK = struct.Struct("!I")
+
+
+def _write_all(f, view):
+    """Write a memoryview to an unbuffered file, retrying short writes."""
+    while view:
+        written = f.write(view)
+        view = view[written:]
+
+
+async def dcc_recv_stream(sock, f, filesize, received=0, turbo=False, progress=None, throttle=None):
+    """
+    Receive up to `filesize` bytes from a non-blocking DCC socket into `f`.
+
+    Data is read with sock_recv_into() straight into one page-aligned buffer
+    and written out (in the default executor, so a slow disk never stalls the
+    loop) only when the buffer fills; flushes land on multiples of the buffer
+    size in the file, even when resuming from an odd offset.  Instead of acknowledging every 4 KiB,
+    one cumulative ACK (the 32-bit byte count the DCC protocol asks for) is
+    sent per recv() call: a send-ahead sender gets far fewer ACK packets,
+    while a stop-and-wait sender is still acknowledged as soon as each packet
+    has been drained.  Turbo senders get no ACKs.
+
+    `f` should be opened unbuffered (buffering=0).  `progress`, if given, is
+    called with the running byte count after every recv().  `throttle`, if
+    given, is awaited with each recv()'s byte count and may sleep to hold the
+    transfer to a rate limit.  Returns the total number of bytes received,
+    including the starting `received` offset.
+    """
+    loop = asyncio.get_running_loop()
+    idle = CONFIG["DCC_IDLE_TIMEOUT"]
+    size = -(-CONFIG["DCC_RECV_BUFFER"] // mmap.PAGESIZE) * mmap.PAGESIZE
+    view = memoryview(mmap.mmap(-1, size))   # anonymous mapping: page-aligned, unlike a bytearray
+    cap = size - received % size
+    filled = 0
+    try:
+        while received < filesize:
+            want = min(cap - filled, filesize - received)
+            n = await asyncio.wait_for(loop.sock_recv_into(sock, view[filled:filled + want]), idle)
+            if not n:
+                break
+            filled += n
+            received += n
+            if progress:
+                progress(received)
+            if not turbo:
+                await loop.sock_sendall(sock, _DCC_ACK.pack(received & 0xFFFFFFFF))
+            if throttle:
+                await throttle(n)
+            if filled == cap:
+                await loop.run_in_executor(None, _write_all, f, view[:filled])
+                filled = 0
+                cap = size
+    finally:
+        if filled:
+            _write_all(f, view[:filled])
+    return received
+
+
+async def receive_dcc_file(ip, port, filename, filesize, req, turbo=False, sender=None):
+    """
+    Accept DCC connection and download file with .incomplete flag, updating request `req`.
+
+    If a matching .incomplete file is already there and `sender` is known, the
+    transfer is resumed from its end with DCC RESUME before connecting.
+    """
+    index = dir_index(req["dest"])
+    filename = os.path.basename(filename)
+    final_path = os.path.join(index.path, filename)
+    temp_path = final_path + ".incomplete"
+    since = None
+
+    async with _scheduler.slot(sender, req):
+        try:
+            offset = resumable_offset(temp_path, filesize) if sender else 0
+            if os.path.exists(temp_path):
+                _metrics["transfers_retried"] += 1
+            if offset:
+                log_event(f"Found {offset} / {filesize} bytes of {filename}; asking {sender} to resume",
+                          kind="transfer")
+                offset = await negotiate_resume(sender, filename, port, offset)
+                if offset:
+                    _metrics["transfers_resumed"] += 1
+            req["offset"] = req["bytes"] = offset
+
+            free = free_space(index.path)
+            if free is not None and filesize - offset + CONFIG["DCC_MIN_FREE"] > free:
+                _metrics["transfers_refused"] += 1
+                log_event(f"⚠️ Refusing {filename}: needs {filesize - offset} bytes, {free} free in {index.path}",
+                          "warning", "transfer")
+                finish_request(req, "failed", f"not enough free space: {free} bytes free")
+                emit_event("failed", req, error=req["error"])
+                return
+
+            log_event(f"Connecting to {ip}:{port} to receive {filename} ({filesize} bytes"
+                      f"{f', resuming at {offset}' if offset else ''})...", kind="transfer")
+            loop = asyncio.get_running_loop()
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CONFIG["DCC_SOCKET_RCVBUF"])
+            s.setblocking(False)
+
+            last_event = time.monotonic()
+
+            def on_progress(received):
+                nonlocal last_event
+                _metrics["bytes_received"] += received - req["bytes"]
+                req["bytes"] = received
+                now = time.monotonic()
+                if req["id"] not in _active_transfers:
+                    _ttfb_samples.append(now - since)
+                    _active_transfers[req["id"]] = (sender, now, req)
+                if now - last_event >= CONFIG["PROGRESS_EVENT_INTERVAL"]:
+                    last_event = now
+                    emit_event("progress", req)
+
+            with s, open(temp_path, "ab" if offset else "wb", buffering=0) as f:
+                if offset:
+                    f.truncate(offset)
+                else:
+                    _tag_partial(f.fileno(), filesize)
+                reserved = CONFIG["DCC_PREALLOCATE"] and preallocate(f.fileno(), offset, filesize - offset)
+                index.refresh(os.path.basename(temp_path))
+                try:
+                    since = time.monotonic()
+                    await asyncio.wait_for(loop.sock_connect(s, (ip, port)), CONFIG["DCC_CONNECT_TIMEOUT"])
+                    _metrics["transfers_started"] += 1
+                    emit_event("started", req, offset=offset)
+                    bytes_received = await dcc_recv_stream(s, f, filesize, received=offset, turbo=turbo,
+                                                           progress=on_progress,
+                                                           throttle=_scheduler.throttle(sender, req["priority"]))
+                    if bytes_received == filesize and CONFIG["DCC_FSYNC"]:
+                        await loop.run_in_executor(None, os.fsync, f.fileno())
+                finally:
+                    if reserved and os.fstat(f.fileno()).st_size < filesize:
+                        release_preallocation(f.fileno())   # don't let an abandoned partial hold the space
+                on_disk = os.fstat(f.fileno()).st_size
+
+            index.refresh(os.path.basename(temp_path))
+            if bytes_received < filesize:
+                log_event(f"⚠️ Incomplete download: {filename} received {bytes_received} / {filesize} bytes",
+                          "warning", "transfer")
+                finish_request(req, "failed", f"incomplete: {bytes_received} / {filesize} bytes")
+                emit_event("failed", req, error=req["error"])
+            elif on_disk != filesize:
+                log_event(f"⚠️ Size mismatch: {filename} is {on_disk} bytes on disk, expected {filesize}",
+                          "warning", "transfer")
+                finish_request(req, "failed", f"size mismatch: {on_disk} / {filesize} bytes")
+                emit_event("failed", req, error=req["error"])
+            else:
+                os.rename(temp_path, final_path)
+                index.refresh(os.path.basename(temp_path))
+                index.refresh(filename)
+                resumed = f", resumed at {offset}" if offset else ""
+                log_event(f"✅ File {filename} received successfully ({bytes_received} bytes{resumed})",
+                          kind="transfer")
+                finish_request(req, "done")
+                snap = request_snapshot(req)
+                emit_event("completed", req, elapsed=snap["elapsed"], bytes_per_sec=snap["bytes_per_sec"])
+                if CONFIG["INGEST_WORKERS"]:
+                    spawn(ingest_download(req, final_path))
+
+        except Exception as e:
+            log_event(f"❌ Error receiving file {filename}: {e!r}", "error", "transfer")
+            finish_request(req, "failed", repr(e))
+            emit_event("failed", req, error=req["error"])
+        finally:
+            active = _active_transfers.pop(req["id"], None)
+            if since is not None:
+                record_transfer(sender, req["state"] == "done", req["bytes"] - req["offset"],
+                                time.monotonic() - (active[1] if active else since))
+
+
+# --- INGEST ---
+# Finished downloads go through dcc_ingest.ingest_file() in a small process
+# pool: hashing, unzipping and metadata parsing never run on the IRC loop,
+# and a burst of completions queues for INGEST_WORKERS processes instead of
+# competing with transfers for CPU.
+_ingest_pool = None
+
+
+def ingest_pool():
+    """The ingest process pool, started on first use (forkserver, so the threaded daemon is never forked)."""
+    global _ingest_pool
+    if _ingest_pool is None:
+        _ingest_pool = concurrent.futures.ProcessPoolExecutor(
+            CONFIG["INGEST_WORKERS"], mp_context=multiprocessing.get_context("forkserver"))
+        atexit.register(_ingest_pool.shutdown, wait=False, cancel_futures=True)
+    return _ingest_pool
+
+
+async def ingest_download(req, path):
+    """Run the ingest stages on a finished download and publish the result on `req`."""
+    global _ingest_pool
+    index = dir_index(req["dest"])
+    library = CONFIG["CALIBRE_LIBRARY"] if req["dest"] in CONFIG["CALIBRE_DESTS"] else None
+    _metrics["ingest_pending"] += 1
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(
+            ingest_pool(), dcc_ingest.ingest_file, path, library, CONFIG["SEARCH_DB"], CONFIG["SEARCH_TTL"])
+    except concurrent.futures.process.BrokenProcessPool as e:
+        _ingest_pool = None   # a worker died; start a fresh pool for the next file
+        result = {"path": path, "error": repr(e)}
+    finally:
+        _metrics["ingest_pending"] -= 1
+
+    with _requests_lock:
+        req["ingest"] = result
+    index.refresh(os.path.basename(path))
+    if result.get("results_path"):
+        index.refresh(os.path.basename(result["results_path"]))
+
+    name = os.path.basename(path)
+    if result.get("error"):
+        _metrics["ingest_failed"] += 1
+        log_event(f"⚠️ Ingest failed for {name}: {result['error']}", "warning", "transfer")
+    else:
+        _metrics["ingest_done"] += 1
+        what = f"{result['kind']}/{result['format']}"
+        if result.get("title"):
+            what += f" \"{result['title']}\" by {', '.join(result['authors']) or '?'}"
+        if result.get("search"):
+            what += f", {result['search']['results']} results cached for \"{result['search']['query']}\""
+        if result.get("book_id"):
+            what += f", added to Calibre as book {result['book_id']}"
+        elif result.get("duplicate_of"):
+            what += f", already in Calibre as book {result['duplicate_of']}"
+        log_event(f"Ingested {name} in {result['seconds']}s: {what}", kind="transfer")
+    emit_event("ingested", req, ingest={k: result.get(k) for k in (
+        "kind", "format", "title", "authors", "sha256", "book_id", "duplicate_of", "results_path", "search", "error")})
 
 
 # --- HTTP API ---
@@ -182,69 +1773,252 @@ def api_status():
         "connected": irc_connected,
         "server": CONFIG["IRC_SERVER"],
         "channel": CONFIG["CHANNEL"],
-        "last_messages": list(irc_last_messages)
+        "last_messages": list(irc_last_messages),
+        "log": dict(_log.stats),
+        "metrics": metrics_snapshot(),
     })
 
 
+@app.route("/metrics", methods=["GET"])
+def api_metrics():
+    """Prometheus text exposition of the transfer and loop metrics."""
+    return Response(render_prometheus(metrics_snapshot()), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/downloaded-files", methods=["GET"])
 def api_downloaded_files():
-    dir_key = request.args.get("dir", "default")
-    watch_dir = CONFIG["SIMILAR_DOWNLOAD_DIR"] if dir_key == "similar" else CONFIG["DOWNLOAD_DIR"]
-    os.makedirs(watch_dir, exist_ok=True)
-    files = []
-    for fname in os.listdir(watch_dir):
-        fpath = os.path.join(watch_dir, fname)
-        if os.path.isfile(fpath):
-            stat = os.stat(fpath)
-            files.append({
-                "name": fname,
-                "size": stat.st_size,
-                "modified": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stat.st_mtime))
-            })
-    return jsonify(files)
+    """
+    List files in a download directory, newest first.
+
+    ?dir=similar selects the similar-books directory.  Optional: sort=mtime|name|size,
+    order=desc|asc, since=<unix mtime> (only files modified after it),
+    limit/offset for paging (X-Total-Count carries the unpaged count).  Sends
+    an ETag and answers If-None-Match with 304 while the listing is unchanged.
+    """
+    index = dir_index(request.args.get("dir", "default"))
+    sort = request.args.get("sort", "mtime")
+    if sort not in ("mtime", "name", "size"):
+        return jsonify({"error": "sort must be mtime, name or size"}), 400
+    reverse = request.args.get("order", "asc" if sort == "name" else "desc") == "desc"
+    since = request.args.get("since", type=float)
+    limit = request.args.get("limit", type=int)
+    offset = max(request.args.get("offset", 0, type=int), 0)
+
+    version, files = index.listing(sort, reverse)
+    etag = f"{_INDEX_EPOCH}-{version}-{zlib.crc32(request.query_string):x}"
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    if since is not None:
+        files = [f for f in files if f["mtime"] > since]
+    total = len(files)
+    files = files[offset:offset + limit] if limit is not None else files[offset:]
+
+    resp = jsonify(files)
+    resp.set_etag(etag)
+    resp.headers["X-Total-Count"] = str(total)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 
 @app.route("/request-file", methods=["GET"])
 def api_request_file():
-    global _next_dest
+    """
+    Send an XDCC request command (?cmd=) and track it as a request.
+
+    ?dest= picks the download directory; ?priority=bulk marks batch jobs so
+    the transfer scheduler serves interactive requests (the default) first.
+    """
     cmd = request.args.get("cmd")
     dest = request.args.get("dest", "default")
+    priority = request.args.get("priority", "interactive")
+    if priority not in PRIORITIES:
+        return jsonify({"error": f"'priority' must be one of: {', '.join(PRIORITIES)}"}), 400
     if cmd:
-        with _dest_lock:
-            _next_dest = dest
-        IRC_SOCKET.sendall(f"PRIVMSG {CONFIG['CHANNEL']} :{cmd}\r\n".encode())
-        log_event(f"Sent request command: {cmd} [dest={dest}]")
-        return jsonify({"status": f"Request command '{cmd}' sent"}), 200
+        if LOOP is None:
+            return jsonify({"error": "IRC loop is not running"}), 503
+        cursor = current_event_cursor()
+        req = add_request(cmd, dest, priority)
+        queue_request_cmd(req)
+        connected = irc_connected
+        if connected:
+            log_event(f"Sent request command: {cmd} [request={req['id']} dest={dest}]")
+        else:
+            log_event(f"Holding request command until IRC reconnects: {cmd} [request={req['id']} dest={dest}]",
+                      "warning")
+        return jsonify({
+            "status": f"Request command '{cmd}' " + ("sent" if connected else "queued until IRC reconnects"),
+            "request_id": req["id"],
+            "cursor": cursor,
+        }), 200 if connected else 202
     return jsonify({"error": "No 'cmd' parameter provided"}), 400
 
 
+@app.route("/requests", methods=["GET"])
+def api_requests():
+    """Recent requests, newest first; ?state=queued|transferring|done|failed|expired filters."""
+    state = request.args.get("state")
+    with _requests_lock:
+        reqs = [req for req in reversed(list(_requests.values())) if not state or req["state"] == state]
+    return jsonify([request_snapshot(req) for req in reqs])
+
+
+@app.route("/requests/<request_id>", methods=["GET"])
+def api_request_status(request_id):
+    req = _requests.get(request_id)
+    if req is None:
+        return jsonify({"error": "Unknown request id"}), 404
+    return jsonify(request_snapshot(req))
+
+
+@app.route("/events", methods=["GET"])
+def api_events():
+    """
+    Server-Sent Events stream of transfer events.
+
+    Resumes after the Last-Event-ID header or ?cursor=; without either only
+    new events are sent.  ?request_id= limits the stream to one request.
+    """
+    cursor = request.headers.get("Last-Event-ID") or request.args.get("cursor")
+    cursor = int(cursor) if cursor and cursor.isdigit() else current_event_cursor()
+    request_id = request.args.get("request_id")
+
+    def stream():
+        nonlocal cursor
+        yield "retry: 3000\n\n"
+        while True:
+            events, cursor, _ = events_after(cursor, timeout=15, request_id=request_id)
+            if not events:
+                yield ": keepalive\n\n"
+            for ev in events:
+                yield f"id: {ev['id']}\nevent: {ev['event']}\ndata: {json.dumps(ev)}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/events/poll", methods=["GET"])
+def api_events_poll():
+    """Long-poll variant of /events: waits up to ?timeout= seconds (max 60) for events after ?cursor=."""
+    cursor = request.args.get("cursor", type=int)
+    if cursor is None:
+        cursor = current_event_cursor()
+    timeout = min(max(request.args.get("timeout", 25, type=float), 0), 60)
+    events, cursor, missed = events_after(cursor, timeout, request.args.get("request_id"))
+    return jsonify({"cursor": cursor, "events": events, "missed": missed})
+
+
+_searches_sent = {}              # normalised query -> time its @search last went to the channel
+_searches_lock = threading.Lock()
+
+
+@app.route("/search", methods=["GET"])
+def api_search():
+    """
+    Search-bot results from the local cache.
+
+    ?q=<terms> (required), limit (default 100), format=epub|... to filter.
+    "cached" is true when a fresh (< SEARCH_TTL) batch for exactly this query
+    exists; otherwise results come from other fresh batches that match, and
+    ?fetch=1 sends "@search <q>" to the channel (202) so the next call hits.
+    """
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"error": "No 'q' parameter provided"}), 400
+    limit = min(max(request.args.get("limit", 100, type=int), 1), 1000)
+    t0 = time.perf_counter()
+    try:
+        found = dcc_search.search(CONFIG["SEARCH_DB"], q, CONFIG["SEARCH_TTL"], limit, request.args.get("format"))
+    except sqlite3.Error as e:
+        return jsonify({"error": f"Search cache error: {e}"}), 500
+    body = {
+        "query": q,
+        "cached": found["batch"] is not None,
+        "batch": found["batch"],
+        "count": len(found["results"]),
+        "results": found["results"],
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2),
+        "searching": False,
+    }
+    status = 200
+    if found["batch"] is None and request.args.get("fetch") == "1" and irc_connected:
+        norm = dcc_search.normalise_query(q)
+        now = time.time()
+        with _searches_lock:
+            due = now - _searches_sent.get(norm, 0) >= CONFIG["SEARCH_RESEND_AFTER"]
+            if due:
+                for stale in [k for k, t in _searches_sent.items() if now - t >= CONFIG["SEARCH_RESEND_AFTER"]]:
+                    del _searches_sent[stale]
+                _searches_sent[norm] = now
+        if due:
+            irc_send(f"PRIVMSG {CONFIG['CHANNEL']} :@search {q}")
+            log_event(f"Sent search: @search {q}")
+        body["searching"] = True
+        status = 202
+    return jsonify(body), status
+
+
 @app.route("/send-message", methods=["POST"])
 def api_send_message():
     msg = request.json.get("msg", "")
     if msg:
-        IRC_SOCKET.sendall(f"PRIVMSG {CONFIG['CHANNEL']} :{msg}\r\n".encode())
+        if not irc_connected:
+            return jsonify({"error": "Not connected to IRC"}), 503
+        irc_send(f"PRIVMSG {CONFIG['CHANNEL']} :{msg}")
         log_event(f"Sent message: {msg}")
         return jsonify({"status": "Message sent"}), 200
     return jsonify({"error": "No message provided"}), 400
 
 @app.route("/logs", methods=["GET"])
 def api_logs():
-    """Return the last 50 lines of the DCC log file."""
+    """
+    Return the last ?n= (default 50, max 1000) lines of the DCC log.
+
+    ?type=transfer|error narrows to transfer records or warnings/errors.
+    ?after=<offset> returns lines written since a previous response's
+    X-Log-Offset header instead, oldest first, for incremental fetching.
+    """
+    n = min(max(request.args.get("n", 50, type=int), 1), 1000)
+    after = request.args.get("after", type=int)
+    match = LOG_FILTERS.get(request.args.get("type", "all").rstrip("s"))
+    if match is None:
+        return jsonify({"error": "type must be all, transfer or error"}), 400
     try:
-        if not os.path.exists(CONFIG["LOG_FILE"]):
+        if after is None and not _log.ring and not os.path.exists(CONFIG["LOG_FILE"]):
             return jsonify(["Log file not found."])
-        with open(CONFIG["LOG_FILE"], "r", encoding="utf-8") as log_file:
-            lines = log_file.readlines()
-            return jsonify(lines[-50:])  # Return last 50 lines
+        lines, cursor = read_log(n, after, match)
     except Exception as e:
         return jsonify([f"Error reading log file: {e}"])
+    resp = jsonify(lines)
+    resp.headers["X-Log-Offset"] = str(cursor)
+    return resp
 
     
+def start_irc_loop():
+    """Run the IRC/DCC event loop in a daemon thread and return once it exists."""
+    global LOOP
+    LOOP = asyncio.new_event_loop()
+
+    def run():
+        asyncio.set_event_loop(LOOP)
+        try:
+            LOOP.run_until_complete(irc_main())
+        except Exception as e:
+            log_event(f"IRC supervisor stopped: {e!r}", "error")
+        # Let transfers that are still running finish after the IRC link is gone
+        if _tasks:
+            LOOP.run_until_complete(asyncio.gather(*_tasks, return_exceptions=True))
+
+    threading.Thread(target=run, name="irc-loop", daemon=True).start()
+
+
 def start_flask():
-    app.run(host="0.0.0.0", port=CONFIG["HTTP_PORT"])
+    app.run(host="0.0.0.0", port=CONFIG["HTTP_PORT"], threaded=True)
 
 
 if __name__ == "__main__":
-    irc_connect()
+    start_irc_loop()
     start_flask()
 
@@ -29,20 +29,42 @@ if (!is_dir($cacheDir)) {
 $outFile = $cacheDir . '/cover_dl_' . $bookId . '.jpg';
 $script  = __DIR__ . '/../scripts/download_cover.py';
 
-$sourceArg = $source ? ' --source ' . escapeshellarg($source) : '';
-$cmd = sprintf(
-    'python3 %s --book-id %d --db-path %s --out-file %s%s 2>/dev/null',
-    escapeshellarg($script),
-    $bookId,
-    escapeshellarg($dbPath),
-    escapeshellarg($outFile),
-    $sourceArg
-);
+// A running cover worker (download_cover.py --serve) answers without the
+// cost of starting Python; otherwise run the script, which also tries it.
+$output = null;
+$worker = @stream_socket_client('unix:///tmp/download_cover.sock', $errno, $errstr, 1);
+if ($worker) {
+    stream_set_timeout($worker, 120);
+    fwrite($worker, json_encode([
+        'book_id'  => $bookId,
+        'db_path'  => realpath($dbPath),
+        'out_file' => $outFile,
+        'source'   => $source ?: null,
+    ]) . "\n");
+    $line = fgets($worker);
+    fclose($worker);
+    // A worker refuses paths outside its --cache-dir; the script still runs those
+    if ($line !== false && empty(json_decode($line, true)['refused'])) {
+        $output = $line;
+    }
+}
 
-$output = shell_exec($cmd);
 if ($output === null) {
-    echo json_encode(['error' => 'Script execution failed']);
-    exit;
+    $sourceArg = $source ? ' --source ' . escapeshellarg($source) : '';
+    $cmd = sprintf(
+        'python3 %s --book-id %d --db-path %s --out-file %s%s 2>/dev/null',
+        escapeshellarg($script),
+        $bookId,
+        escapeshellarg($dbPath),
+        escapeshellarg($outFile),
+        $sourceArg
+    );
+
+    $output = shell_exec($cmd);
+    if ($output === null) {
+        echo json_encode(['error' => 'Script execution failed']);
+        exit;
+    }
 }
 
 $result = json_decode(trim($output), true);
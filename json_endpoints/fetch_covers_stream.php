@@ -0,0 +1,138 @@
+<?php
+/**
+ * SSE stream: download covers for many books with download_cover.py's batch
+ * mode and report each book as it finishes.
+ *
+ * GET ?book_ids=1,2,3          specific books
+ * GET ?missing=1               every book without a cover
+ *     &source=amazon|kindle|goodreads   (optional, default auto)
+ *     &workers=8                        (1-16)
+ *     &token=TOKEN                      (stop flag, as for the send streams)
+ *
+ * Events:
+ *   started   {total}
+ *   cover     {book_id, ok, source, width, height, size_kb, preview_url} or {book_id, ok: false, error}
+ *   progress  {done, total, ok, failed}
+ *   stopped   {done}
+ *   done      {done, ok, failed, seconds}
+ *   error     {message}
+ */
+
+header('Content-Type: text/event-stream');
+header('Cache-Control: no-cache');
+header('X-Accel-Buffering: no');
+
+require_once __DIR__ . '/../db.php';
+requireLogin();
+
+ignore_user_abort(true);
+set_time_limit(0);
+
+function sse(string $event, array $data): void {
+    echo "event: {$event}\ndata: " . json_encode($data) . "\n\n";
+    if (ob_get_level()) ob_flush();
+    flush();
+}
+
+function isStopped(string $flag): bool {
+    if (file_exists($flag)) {
+        @unlink($flag);
+        return true;
+    }
+    return false;
+}
+
+$token    = preg_replace('/[^a-z0-9]/i', '', trim($_GET['token'] ?? ''));
+$stopFlag = sys_get_temp_dir() . '/calibre_nilla_stop_' . $token;
+$workers  = max(1, min(16, (int)($_GET['workers'] ?? 8)));
+$source   = $_GET['source'] ?? '';
+if (!in_array($source, ['amazon', 'kindle', 'goodreads'], true)) {
+    $source = '';
+}
+
+$dbPath = currentDatabasePath();
+if (!file_exists($dbPath)) {
+    sse('error', ['message' => 'Database not found']);
+    exit;
+}
+
+$bookIds = array_values(array_filter(array_map('intval', preg_split('/[\s,]+/', $_GET['book_ids'] ?? '')),
+    fn($id) => $id > 0));
+$missing = !empty($_GET['missing']);
+if (!$bookIds && !$missing) {
+    sse('error', ['message' => 'Give book_ids or missing=1']);
+    exit;
+}
+
+if ($missing) {
+    $total = (int)getDatabaseConnection()->query('SELECT COUNT(*) FROM books WHERE has_cover = 0')->fetchColumn();
+} else {
+    $total = count($bookIds);
+}
+
+$user     = currentUser();
+$cacheDir = __DIR__ . '/../cache/' . $user;
+if (!is_dir($cacheDir)) {
+    mkdir($cacheDir, 0775, true);
+}
+
+$script = __DIR__ . '/../scripts/download_cover.py';
+$cmd = sprintf(
+    'python3 %s --db-path %s --out-dir %s --workers %d%s%s',
+    escapeshellarg($script),
+    escapeshellarg($dbPath),
+    escapeshellarg($cacheDir),
+    $workers,
+    $missing ? ' --query ' . escapeshellarg('SELECT id FROM books WHERE has_cover = 0') : ' --book-ids -',
+    $source ? ' --source ' . escapeshellarg($source) : ''
+);
+
+$proc = proc_open($cmd, [0 => ['pipe', 'r'], 1 => ['pipe', 'w'], 2 => ['pipe', 'w']], $pipes);
+if (!is_resource($proc)) {
+    sse('error', ['message' => 'Script execution failed']);
+    exit;
+}
+fwrite($pipes[0], implode("\n", $bookIds));
+fclose($pipes[0]);
+
+sse('started', ['total' => $total]);
+
+$docRoot = rtrim($_SERVER['DOCUMENT_ROOT'] ?? '', '/');
+$start   = time();
+$done    = 0;
+$ok      = 0;
+$failed  = 0;
+while (($line = fgets($pipes[1])) !== false) {
+    $result = json_decode(trim($line), true);
+    if (!is_array($result)) {
+        continue;
+    }
+    if (!isset($result['book_id'])) {
+        // The script failed before starting (bad database, bad query)
+        sse('error', ['message' => $result['error'] ?? 'Invalid script output']);
+        continue;
+    }
+    $done++;
+    if (!empty($result['ok'])) {
+        $ok++;
+        // Convert filesystem path to web URL
+        $result['preview_url'] = '/' . ltrim(str_replace($docRoot, '', $result['out_file'] ?? ''), '/');
+        unset($result['out_file']);
+    } else {
+        $failed++;
+    }
+    sse('cover', $result);
+    sse('progress', ['done' => $done, 'total' => $total, 'ok' => $ok, 'failed' => $failed]);
+
+    if (connection_aborted() || isStopped($stopFlag)) {
+        proc_terminate($proc);
+        sse('stopped', ['done' => $done]);
+        break;
+    }
+}
+
+fclose($pipes[1]);
+fclose($pipes[2]);
+proc_close($proc);
+
+sse('done', ['done' => $done, 'ok' => $ok, 'failed' => $failed, 'seconds' => time() - $start]);
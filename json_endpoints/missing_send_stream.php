@@ -8,8 +8,9 @@
  *   queue_loaded      {total, sent, pending}
  *   sending           {n, total, cmd}
  *   send_result       {ok, status}
- *   waiting           {elapsed, remaining}
+ *   waiting           {elapsed, remaining, state, bytes, size}
  *   transfer_received {name, elapsed}
+ *   transfer_failed   {name, error}
  *   transfer_timeout  {}
  *   countdown         {seconds}
  *   skipped           {cmd}
@@ -35,7 +36,7 @@ $sentFile  = __DIR__ . '/../data/missing-books-sent.txt';
 $stopFlag  = sys_get_temp_dir() . '/calibre_nilla_stop_' . $token;
 
 const API_BASE      = 'https://node2.nilla.local';
-const POLL_INTERVAL = 5;
+const POLL_INTERVAL = 5;   // seconds per /events/poll long-poll
 const MIN_DELAY     = 5;
 const MAX_DELAY     = 15;
 const TIMEOUT       = 300;
@@ -54,11 +55,11 @@ function isStopped(string $flag): bool {
     return false;
 }
 
-function curlGet(string $url): ?string {
+function curlGet(string $url, int $timeout = 15): ?string {
     $ch = curl_init($url);
     curl_setopt_array($ch, [
         CURLOPT_RETURNTRANSFER => true,
-        CURLOPT_TIMEOUT        => 15,
+        CURLOPT_TIMEOUT        => $timeout,
         CURLOPT_SSL_VERIFYPEER => false,
         CURLOPT_SSL_VERIFYHOST => false,
     ]);
@@ -68,36 +69,45 @@ function curlGet(string $url): ?string {
     return $err ? null : $body;
 }
 
-function getNewestMtime(): int {
-    $body = curlGet(API_BASE . '/downloaded-files');
-    if (!$body) return 0;
-    $files = json_decode($body, true);
-    if (!is_array($files)) return 0;
-    $newest = 0;
-    foreach ($files as $f) {
-        $mt = strtotime($f['modified'] ?? '') ?: 0;
-        if ($mt > $newest) $newest = $mt;
-    }
-    return $newest;
-}
-
-function pollForTransfer(int $baseline, int $maxWait, string $stopFlag): ?array {
-    $deadline = time() + $maxWait;
+/**
+ * Wait for the daemon to report this request's transfer as completed or
+ * failed. Long-polls /events/poll from $cursor, so a finished transfer is
+ * seen the moment it happens; the stop flag is checked between polls.
+ */
+function pollForTransfer(string $requestId, int $cursor, int $maxWait, string $stopFlag): ?array {
+    $start    = time();
+    $deadline = $start + $maxWait;
+    $progress = [];
     while (time() < $deadline) {
         if (isStopped($stopFlag)) return ['stopped' => true];
-        sleep(POLL_INTERVAL);
-
-        $body = curlGet(API_BASE . '/downloaded-files');
-        if ($body) {
-            foreach (json_decode($body, true) ?? [] as $f) {
-                $mt = strtotime($f['modified'] ?? '') ?: 0;
-                if ($mt > $baseline) {
-                    return ['name' => $f['name'] ?? '?', 'elapsed' => time() - ($deadline - $maxWait)];
-                }
+
+        $wait = max(1, min(POLL_INTERVAL, $deadline - time()));
+        $body = curlGet(API_BASE . '/events/poll?request_id=' . rawurlencode($requestId)
+            . "&cursor={$cursor}&timeout={$wait}", $wait + 10);
+        $resp = $body ? json_decode($body, true) : null;
+        if (!is_array($resp)) {
+            sleep(POLL_INTERVAL);
+            continue;
+        }
+        $cursor = (int)($resp['cursor'] ?? $cursor);
+
+        foreach ($resp['events'] ?? [] as $ev) {
+            if ($ev['event'] === 'completed') {
+                return ['name' => $ev['filename'] ?? '?', 'elapsed' => time() - $start];
             }
+            if ($ev['event'] === 'failed') {
+                return ['failed' => true, 'name' => $ev['filename'] ?? '?', 'error' => $ev['error'] ?? 'failed'];
+            }
+            $progress = $ev;
         }
 
-        sse('waiting', ['elapsed' => time() - ($deadline - $maxWait), 'remaining' => max(0, $deadline - time())]);
+        sse('waiting', [
+            'elapsed'   => time() - $start,
+            'remaining' => max(0, $deadline - time()),
+            'state'     => $progress ? 'transferring' : 'queued',
+            'bytes'     => $progress['bytes'] ?? 0,
+            'size'      => $progress['size'] ?? null,
+        ]);
     }
     return null;
 }
@@ -147,9 +157,7 @@ foreach ($toSend as $idx => $cmd) {
 
     sse('sending', ['n' => $idx + 1, 'total' => count($toSend), 'cmd' => $cmd]);
 
-    $baseline = getNewestMtime();
-
-    $body = curlGet(API_BASE . '/request-file?cmd=' . rawurlencode($cmd));
+    $body = curlGet(API_BASE . '/request-file?cmd=' . rawurlencode($cmd) . '&priority=bulk');
     $resp = $body ? (json_decode($body, true) ?? []) : [];
     $ok   = empty($resp['error']);
 
@@ -164,10 +172,12 @@ foreach ($toSend as $idx => $cmd) {
     }
 
     // Poll for incoming transfer
-    $result = pollForTransfer($baseline, TIMEOUT, $stopFlag);
+    $result = pollForTransfer($resp['request_id'] ?? '', (int)($resp['cursor'] ?? 0), TIMEOUT, $stopFlag);
 
     if ($result === null) {
         sse('transfer_timeout', []);
+    } elseif (!empty($result['failed'])) {
+        sse('transfer_failed', ['name' => $result['name'], 'error' => $result['error']]);
     } elseif (!empty($result['stopped'])) {
         fwrite($sentFh, $cmd . "\n");
         fflush($sentFh);
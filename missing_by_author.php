@@ -504,6 +504,11 @@ sendStartBtn.addEventListener('click', () => {
         sendLog_append('  ⚠ No transfer detected — moving on', 'sl-timeout');
     });
 
+    sendSource.addEventListener('transfer_failed', e => {
+        const d = JSON.parse(e.data);
+        sendLog_append(`  ✗ Transfer failed: ${d.name} (${d.error})`, 'sl-timeout');
+    });
+
     sendSource.addEventListener('skipped', e => {
         const d = JSON.parse(e.data);
         sendLog_append(`  — Skipped (request failed)`, 'sl-skipped');
@@ -559,6 +559,10 @@ sendStartBtn.addEventListener('click', () => {
     sendSource.addEventListener('transfer_timeout', () => {
         sendLog_append('  ⚠ No transfer detected — moving on', 'sl-timeout');
     });
+    sendSource.addEventListener('transfer_failed', e => {
+        const d = JSON.parse(e.data);
+        sendLog_append(`  ✗ Transfer failed: ${d.name} (${d.error})`, 'sl-timeout');
+    });
     sendSource.addEventListener('countdown', e => {
         const d = JSON.parse(e.data);
         if (d.seconds > 0) sendLog_transient(`  Next request in ${d.seconds}s…`, 'sl-transient');
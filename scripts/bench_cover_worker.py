@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark fetching one book's cover with download_cover.py cold against a
+warm worker (download_cover.py --serve).
+
+Fetches the same book --runs times in three ways:
+
+    cold       a fresh `download_cover.py --no-worker` process per request:
+               interpreter start, requests/bs4 import, new connections, no caches
+    forwarded  the same CLI call while a worker listens; the CLI hands the
+               request over the socket before importing anything heavy
+    socket     one JSON line straight to the worker socket, as
+               fetch_cover_preview.php does
+
+and reports the first request and the median / p90 in ms.  The on-disk
+HTTP cache is turned off (HTTP_CACHE=off) so that every cold request
+really goes to the network.  By default the book comes from a throwaway
+library whose cover is served by a local HTTP server answering after
+--latency seconds, so the numbers don't depend on (or hammer) Amazon and
+Goodreads.  Point it at a real book with --db-path and --book-id to
+include real page fetches and parsing.
+
+Usage:
+    python3 bench_cover_worker.py
+    python3 bench_cover_worker.py --runs 20 --latency 0.3
+    python3 bench_cover_worker.py --db-path /path/to/metadata.db --book-id 42 --source goodreads
+"""
+
+import argparse
+import http.server
+import json
+import os
+import socket
+import sqlite3
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "download_cover.py")
+
+
+def start_cover_server(latency):
+    """Serve a 1000x1500 JPEG header at /cover.jpg after `latency` seconds; returns its URL."""
+    body = b"\xff\xd8\xff\xc0" + struct.pack(">HBHH", 17, 8, 1500, 1000) + b"\x00" * 16 * 1024
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/cover.jpg"
+
+
+def make_library(path, url):
+    con = sqlite3.connect(path)
+    con.executescript(
+        "CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT);"
+        "CREATE TABLE identifiers (id INTEGER PRIMARY KEY, book INTEGER, type TEXT, val TEXT);"
+    )
+    con.execute("INSERT INTO books VALUES (1, 'Benchmark')")
+    con.execute("INSERT INTO identifiers (book, type, val) VALUES (1, 'gr_image_url', ?)", (url,))
+    con.commit()
+    con.close()
+
+
+def cli(args, out_file, extra):
+    cmd = [sys.executable, SCRIPT, "--book-id", str(args.book_id), "--db-path", args.db_path,
+           "--out-file", out_file, "--socket", args.socket, *extra]
+    if args.source:
+        cmd += ["--source", args.source]
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    elapsed = time.perf_counter() - t0
+    result = json.loads(proc.stdout or "{}")
+    if not result.get("ok"):
+        sys.exit(f"download_cover.py failed: {result.get('error') or proc.stderr.strip()}")
+    return elapsed
+
+
+def direct(args, out_file):
+    req = {"book_id": args.book_id, "db_path": os.path.abspath(args.db_path),
+           "out_file": os.path.abspath(out_file), "source": args.source}
+    t0 = time.perf_counter()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(args.socket)
+        s.sendall(json.dumps(req).encode() + b"\n")
+        result = json.loads(s.makefile("rb").readline())
+    elapsed = time.perf_counter() - t0
+    if not result.get("ok"):
+        sys.exit(f"worker failed: {result.get('error')}")
+    return elapsed
+
+
+def wait_for_socket(path, proc):
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f"worker exited: {proc.stderr.read().decode().strip()}")
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(path)
+            return
+        except OSError:
+            time.sleep(0.05)
+    sys.exit("worker did not start listening")
+
+
+def report(name, times):
+    ms = sorted(t * 1000 for t in times)
+    rest = ms[1:] or ms
+    p90 = rest[min(len(rest) - 1, int(len(rest) * 0.9))]
+    print(f"{name:<10} {times[0] * 1000:>8.0f} {statistics.median(rest):>8.0f} {p90:>8.0f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=10, help="requests per mode (default: 10)")
+    ap.add_argument("--latency", type=float, default=0.15,
+                    help="seconds the local cover server takes to answer (default: 0.15)")
+    ap.add_argument("--db-path", help="real library to fetch from (default: a throwaway one)")
+    ap.add_argument("--book-id", type=int, default=1)
+    ap.add_argument("--source", choices=["amazon", "kindle", "goodreads"])
+    args = ap.parse_args()
+
+    os.environ["HTTP_CACHE"] = "off"
+    tmp = tempfile.mkdtemp(prefix="coverbench_")
+    args.socket = os.path.join(tmp, "worker.sock")
+    out_file = os.path.join(tmp, "cover.jpg")
+    if not args.db_path:
+        args.db_path = os.path.join(tmp, "metadata.db")
+        make_library(args.db_path, start_cover_server(args.latency))
+        print(f"local cover server answering after {args.latency * 1000:.0f} ms")
+
+    print(f"{args.runs} requests per mode for book {args.book_id}")
+    print(f"{'mode':<10} {'first':>8} {'median':>8} {'p90':>8}   (ms)")
+    report("cold", [cli(args, out_file, ["--no-worker"]) for _ in range(args.runs)])
+
+    worker = subprocess.Popen([sys.executable, SCRIPT, "--serve", "--socket", args.socket],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        wait_for_socket(args.socket, worker)
+        report("forwarded", [cli(args, out_file, []) for _ in range(args.runs)])
+        report("socket", [direct(args, out_file) for _ in range(args.runs)])
+    finally:
+        worker.terminate()
+        worker.wait()
+
+    for name in os.listdir(tmp):
+        os.remove(os.path.join(tmp, name))
+    os.rmdir(tmp)
+
+
+if __name__ == "__main__":
+    main()
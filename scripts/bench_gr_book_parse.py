@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Benchmark parsing Goodreads book pages: scrape_goodreads_metadata.py's
+streaming extraction against the full parse it replaced.
+
+    legacy   decode the whole page, regex-search it for __NEXT_DATA__,
+             json.loads the entire block (every review, user and
+             contributor on the page) and read the fields from the dict
+    stream   parse_book_page(): find the block by byte offset and decode
+             only the Apollo nodes that are used (ApolloState)
+
+Both feed the same field extraction (parse_apollo), so the difference is
+the extraction alone, and the results are checked to be identical before
+timing.  The corpus is the book pages already in the HTTP cache (real
+pages from earlier scraper runs) or a directory of saved pages named
+<gr_id>.html.  No network is used.  Each mode runs in its own process so
+its peak RSS can be reported; "load" only reads the pages, the floor the
+other two start from.
+
+Usage:
+    python3 bench_gr_book_parse.py                      # pages in data/http_cache.db
+    python3 bench_gr_book_parse.py --dir saved_pages/ --rounds 5
+    python3 bench_gr_book_parse.py --cache /path/to/http_cache.db --limit 200
+"""
+
+import argparse
+import json
+import os
+import re
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+import zlib
+
+import http_cache
+import scrape_goodreads_metadata as md
+
+BOOK_URL = re.compile(r"^https://www\.goodreads\.com/book/show/(\d+)")
+
+
+def legacy_parse(content, gr_id):
+    """The extraction fetch_book_page did before ApolloState (kept for comparison)."""
+    text = content.decode("utf-8", "replace")
+    m = re.search(r'<script id="__NEXT_DATA__" type="application/json">(.*?)</script>', text, re.DOTALL)
+    if not m:
+        return None, "__NEXT_DATA__ not found"
+    nd = json.loads(m.group(1))
+    apollo = nd.get("props", {}).get("pageProps", {}).get("apolloState", {})
+    if not apollo:
+        return None, "apolloState missing"
+    return md.parse_apollo(apollo, gr_id)
+
+
+PARSERS = {"legacy": legacy_parse, "stream": md.parse_book_page, "load": None}
+
+
+def pages(args):
+    """Yield (gr_id, body) for each page of the corpus, one at a time."""
+    n = 0
+    if args.dir:
+        for name in sorted(os.listdir(args.dir)):
+            m = re.match(r"(\d+)", name)
+            if not m or not name.endswith((".html", ".htm")):
+                continue
+            with open(os.path.join(args.dir, name), "rb") as f:
+                yield m.group(1), f.read()
+            n += 1
+            if args.limit and n >= args.limit:
+                return
+        return
+    con = sqlite3.connect(f"file:{args.cache}?mode=ro", uri=True)
+    try:
+        for url, encoding, data in con.execute(
+            "SELECT r.url, b.encoding, b.data FROM responses r JOIN bodies b ON b.hash = r.hash "
+            "WHERE r.status = 200 AND r.url LIKE 'https://www.goodreads.com/book/show/%' ORDER BY r.url"
+        ):
+            m = BOOK_URL.match(url)
+            if not m:
+                continue
+            yield m.group(1), zlib.decompress(data) if encoding == "zlib" else data
+            n += 1
+            if args.limit and n >= args.limit:
+                return
+    finally:
+        con.close()
+
+
+def peak_rss_kb():
+    """
+    This process's peak RSS in KB.  VmHWM rather than ru_maxrss, which on
+    Linux carries the parent's peak over fork + exec.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(args):
+    """Run one mode over the corpus and print {pages, bytes, seconds, maxrss_kb}."""
+    parse = PARSERS[args.child]
+    count = size = 0
+    elapsed = 0.0
+    for _ in range(args.rounds):
+        for gr_id, body in pages(args):
+            count += 1
+            size += len(body)
+            if parse is not None:
+                t0 = time.perf_counter()
+                parse(body, gr_id)
+                elapsed += time.perf_counter() - t0
+    print(json.dumps({"pages": count, "bytes": size, "seconds": elapsed,
+                      "maxrss_kb": peak_rss_kb()}))
+
+
+def check(args):
+    """
+    Parse every page both ways; returns (pages, [gr_ids whose results
+    differ]).  A page also differs if any Apollo node the stream parse
+    looked up isn't the one json.loads has, even if the fields agree.
+    """
+    count, differ = 0, []
+    for gr_id, body in pages(args):
+        count += 1
+        if legacy_parse(body, gr_id) != md.parse_book_page(body, gr_id) or md.apollo_mismatches(body, gr_id):
+            differ.append(gr_id)
+    return count, differ
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--cache", default=http_cache.CACHE_PATH, help="HTTP cache to take pages from")
+    ap.add_argument("--dir", help="directory of saved pages named <gr_id>.html (instead of the cache)")
+    ap.add_argument("--limit", type=int, default=0, help="use at most this many pages")
+    ap.add_argument("--rounds", type=int, default=3, help="passes over the corpus per mode (default: 3)")
+    ap.add_argument("--child", choices=PARSERS, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        child(args)
+        return
+    if not args.dir and not os.path.exists(args.cache):
+        sys.exit(f"no HTTP cache at {args.cache}: run the scraper first, or give --dir")
+
+    count, differ = check(args)
+    if not count:
+        sys.exit("no Goodreads book pages in the corpus")
+    print(f"{count} pages; results identical" if not differ else
+          f"{count} pages; {len(differ)} differ, e.g. GR {', '.join(differ[:5])}")
+
+    base = [sys.executable, os.path.abspath(__file__), "--rounds", str(args.rounds), "--limit", str(args.limit)]
+    base += ["--dir", args.dir] if args.dir else ["--cache", args.cache]
+    print(f"{'mode':<8} {'pages/s':>9} {'MB/s':>8} {'peak RSS MB':>12}")
+    for mode in ("load", "legacy", "stream"):
+        out = subprocess.run(base + ["--child", mode], capture_output=True, text=True, check=True).stdout
+        r = json.loads(out)
+        rss = f"{r['maxrss_kb'] / 1024:>12.1f}"
+        if mode == "load":
+            print(f"{mode:<8} {'-':>9} {'-':>8} {rss}")
+        else:
+            print(f"{mode:<8} {r['pages'] / r['seconds']:>9.1f} {r['bytes'] / 1024 / 1024 / r['seconds']:>8.1f} {rss}")
+    if differ:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
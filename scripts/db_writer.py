@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Batched writes to a Calibre library for the Goodreads scrapers.
+
+The scrapers used to open a connection, run a dozen statements and commit
+for every book.  DBWriter keeps one connection open for the whole run and
+groups books into transactions instead:
+
+    with DBWriter(db_path, open_db, on_commit=lambda: save_progress(progress)) as writer:
+        for book in books:
+            with writer.book() as con:      # one savepoint per book
+                save_tags(writer.names, book["id"], tags)
+
+A book's statements run as soon as its `with` block does, so whatever the
+save functions read back (rowcounts, existing series) is current; only the
+COMMIT is deferred.  The transaction is committed once BATCH_BOOKS books
+are pending or the oldest is FLUSH_SECONDS old, and by flush(), which a
+script calls before it goes quiet (a network request, a politeness
+delay): the PHP app writes to the same file with a 5 s busy timeout, so
+the write lock must never be held while we wait on Goodreads.  Replays from
+the HTTP cache never wait, and that is where the batching pays off.
+
+on_commit runs after every commit, so a progress checkpoint never lists a
+book whose writes could still be rolled back.  SIGTERM (what
+gr_import_stream.php sends on stop) rolls back the book in progress,
+commits the finished ones and exits.  The journal is switched to WAL, as
+db.php does, unless the library is on a network filesystem where WAL's
+shared memory doesn't work.
+
+writer.names holds the run's tag / series / publisher lookups (see
+calibre_names.py), so they are loaded once per run rather than per book.
+"""
+
+import contextlib
+import os
+import signal
+import sys
+import threading
+import time
+
+from calibre_names import CalibreNames
+
+BATCH_BOOKS   = 50      # books per transaction at most
+FLUSH_SECONDS = 2.0     # commit once the oldest uncommitted book is this old
+BUSY_TIMEOUT  = 30      # seconds to wait for the PHP app's write lock
+NETWORK_FS    = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "ceph",
+                 "fuse.sshfs", "fuse.glusterfs", "glusterfs"}
+
+
+def filesystem_type(path):
+    """The type of the filesystem `path` lives on, from /proc/mounts ("" if unknown)."""
+    path = os.path.realpath(path)
+    best, fstype = "", ""
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                mount = fields[1].replace("\\040", " ")
+                if (path == mount or path.startswith(mount.rstrip("/") + "/")) and len(mount) > len(best):
+                    best, fstype = mount, fields[2]
+    except OSError:
+        pass
+    return fstype
+
+
+class DBWriter:
+    """
+    One connection to `db_path`, opened with `connect(db_path)` so the
+    script's own setup (title_sort, foreign keys) applies.  Use it from the
+    thread that opened it.
+    """
+
+    def __init__(self, db_path, connect, batch_books=BATCH_BOOKS, flush_seconds=FLUSH_SECONDS, on_commit=None):
+        self.db_path = db_path
+        self.connect = connect
+        self.batch_books = batch_books
+        self.flush_seconds = flush_seconds
+        self.on_commit = on_commit
+        self.con = None
+        self.names = None
+        self.pending = 0            # books finished since the last flush
+        self.opened_at = None       # monotonic time the first of them finished
+        self.commits = 0
+        self._prev_sigterm = None
+
+    def __enter__(self):
+        self.con = self.connect(self.db_path)
+        self.con.isolation_level = None          # we issue BEGIN / COMMIT ourselves
+        self.con.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}")
+        if filesystem_type(self.db_path) not in NETWORK_FS:
+            self.con.execute("PRAGMA journal_mode = WAL")
+        self.names = CalibreNames(self.con)
+        if threading.current_thread() is threading.main_thread():
+            self._prev_sigterm = signal.signal(signal.SIGTERM, self._on_sigterm)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.flush()
+        finally:
+            if self._prev_sigterm is not None:
+                signal.signal(signal.SIGTERM, self._prev_sigterm)
+            self.con.close()
+            self.con = None
+            self.names = None
+
+    def _on_sigterm(self, signum, frame):
+        # Unwind through book() and __exit__ so finished books are committed
+        sys.exit(128 + signum)
+
+    @contextlib.contextmanager
+    def book(self, writes=True):
+        """
+        Run one book's writes; they are rolled back on their own if the block
+        raises.  writes=False counts a book that needs none (a dry run, a
+        fetch error) towards the batch without taking the write lock.
+        """
+        if writes:
+            if not self.con.in_transaction:
+                self.con.execute("BEGIN IMMEDIATE")
+            self.con.execute("SAVEPOINT book")
+            try:
+                yield self.con
+            except BaseException:
+                self.con.execute("ROLLBACK TO book")
+                self.con.execute("RELEASE book")
+                self.names.reset()              # it may hold ids the rollback undid
+                raise
+            self.con.execute("RELEASE book")
+        else:
+            yield None
+        if not self.pending:
+            self.opened_at = time.monotonic()
+        self.pending += 1
+        if self.pending >= self.batch_books or time.monotonic() - self.opened_at >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """Commit the books finished since the last flush, then run on_commit."""
+        if not self.pending:
+            return
+        if self.con.in_transaction:
+            self.con.execute("COMMIT")
+            self.commits += 1
+        self.pending = 0
+        self.opened_at = None
+        if self.on_commit is not None:
+            self.on_commit()
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 """
-Download a hi-res cover for a single book from Amazon (via ASIN) or Goodreads (via GR ID).
+Download a hi-res cover for a book from Amazon (via ASIN) or Goodreads (via GR ID).
 
-Tries Amazon first if ASIN is available, falls back to Goodreads.
+By default every source the book has an identifier for (Amazon, GR image
+URL, Goodreads page, Kindle) is fetched at once.  The first image at least
+GOOD_COVER_HEIGHT tall with a front-cover aspect ratio wins immediately.
+Otherwise the largest well-proportioned image wins once all sources have
+answered.  --source fetches from one source only.
 
 Usage:
     python3 download_cover.py --book-id N --db-path /path/to/metadata.db --out-file /tmp/cover.jpg
@@ -10,18 +14,58 @@ Usage:
 Outputs JSON to stdout:
     {"ok": true, "source": "amazon", "width": 600, "height": 900, "size_kb": 120}
     {"ok": false, "error": "No Amazon or Goodreads ID found"}
+
+Batch mode fetches many books' covers at once: identifiers for every book
+are read in one query, covers are fetched by --workers threads sharing one
+connection pool, requests to each host are spaced by HOST_RATES, and one
+JSON line per book is printed as soon as it finishes (in completion order):
+
+    python3 download_cover.py --db-path metadata.db --out-dir covers/ --book-ids 12,15,99
+    python3 download_cover.py --db-path metadata.db --out-dir covers/ --book-ids - < ids.txt
+    python3 download_cover.py --db-path metadata.db --out-dir covers/ \
+        --query "SELECT id FROM books WHERE has_cover = 0" --workers 16 --skip-existing
+
+    {"book_id": 12, "ok": true, "source": "goodreads", "width": 1000, "height": 1500, "size_kb": 210,
+     "out_file": "covers/cover_dl_12.jpg"}
+    {"book_id": 15, "ok": false, "error": "Could not download cover from any source"}
+
+A summary ({"done": N, "ok": N, "failed": N, "seconds": S}) goes to stderr.
+
+Worker mode keeps one process warm: its HTTP session (and so its TLS
+connections), host rate limits and caches of parsed pages and downloaded
+images outlive each request.  While it listens, a single-book CLI call
+forwards its request over the Unix socket before importing requests or
+bs4, and falls back to running locally if no worker answers:
+
+    python3 download_cover.py --serve [--socket /tmp/download_cover.sock] [--cache-dir cache/]
+
+The socket speaks one JSON line each way: {"book_id", "db_path", "out_file",
+"source"} in, the usual result object out.  The socket is only open to the
+user the worker runs as, which should be the web server's, and the worker
+only writes covers under --cache-dir; anything else is refused and the CLI
+falls back to fetching the cover itself.
 """
 
 import argparse
+import collections
+import concurrent.futures
 import json
 import os
+import queue
 import re
+import signal
+import socket
 import sqlite3
 import struct
 import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from http_cache import ROOT_DIR, HTTPCache
 
-import requests
-from bs4 import BeautifulSoup
+# requests and bs4 are imported where first used: together they cost more
+# start-up time than the rest of a call forwarded to a worker
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0",
@@ -32,6 +76,116 @@ HEADERS = {
 
 TIMEOUT = 20
 
+# Requests per second allowed to each host; image CDNs not listed get DEFAULT_HOST_RATE
+HOST_RATES = {
+    "www.amazon.com": 1.0,
+    "www.goodreads.com": 1.0,
+}
+DEFAULT_HOST_RATE = 5.0
+
+# Auto mode fetches every source a book has at once and keeps the best image.
+# A candidate at least this tall with a front-cover aspect ratio (width /
+# height) ends the race as soon as it arrives; otherwise the race waits for
+# every source, up to RACE_TIMEOUT, and picks by cover_score.
+GOOD_COVER_HEIGHT = 1000
+COVER_ASPECT = (0.55, 0.8)
+RACE_TIMEOUT = TIMEOUT * 2
+
+SOCKET_PATH = "/tmp/download_cover.sock"
+WORKER_CACHE_DIR = os.path.join(ROOT_DIR, "cache")     # where a worker may write covers
+CACHE_TTL = 600                     # seconds a parsed page or image stays cached
+
+
+class CoverError(Exception):
+    pass
+
+
+class HostLimiter:
+    """Spaces requests to each host at least 1/rate seconds apart, across threads."""
+
+    def __init__(self, rates=None, default=DEFAULT_HOST_RATE):
+        self.rates = dict(HOST_RATES if rates is None else rates)
+        self.default = default
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlsplit(url).hostname or ""
+        rate = self.rates.get(host, self.default)
+        if not rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, 0.0))
+            self.next_slot[host] = slot + 1.0 / rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class TTLCache:
+    """Thread-safe LRU of values younger than `ttl`, bounded by entry count and total size."""
+
+    def __init__(self, ttl=CACHE_TTL, max_items=512, max_bytes=None):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.items = collections.OrderedDict()   # key -> (expires, value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, size=1):
+        with self.lock:
+            if key in self.items:
+                self._drop(key)
+            self.items[key] = (time.monotonic() + self.ttl, value, size)
+            self.size += size
+            while self.items and (len(self.items) > self.max_items
+                                  or (self.max_bytes and self.size > self.max_bytes)):
+                self._drop(next(iter(self.items)))
+
+    def _drop(self, key):
+        self.size -= self.items.pop(key)[2]
+
+
+SESSION = None
+_session_lock = threading.Lock()
+LIMITER = HostLimiter()
+PAGE_CACHE = TTLCache(max_items=1024)                          # ("amazon"|"goodreads", id) -> image URLs
+IMAGE_CACHE = TTLCache(max_items=256, max_bytes=64 * 1024 * 1024)  # URL -> image bytes
+HTTP = HTTPCache()                  # on disk, shared with the Goodreads scripts
+
+
+def configure_session(pool_size=10):
+    """Create the shared session, its connection pool sized for `pool_size` concurrent requests."""
+    global SESSION
+    import requests
+    with _session_lock:
+        if SESSION is None:
+            SESSION = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        SESSION.mount("https://", adapter)
+        SESSION.mount("http://", adapter)
+    return SESSION
+
+
+def http_get(url):
+    return HTTP.get(url, headers=HEADERS, timeout=TIMEOUT, session=SESSION or configure_session(),
+                    throttle=LIMITER.wait)
+
 
 def fail(msg):
     print(json.dumps({"ok": False, "error": msg}))
@@ -39,7 +193,7 @@ def fail(msg):
 
 
 def get_identifiers(db_path, book_id):
-    con = sqlite3.connect(db_path)
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
     con.row_factory = sqlite3.Row
     rows = con.execute(
         "SELECT type, val FROM identifiers WHERE book = ?", (book_id,)
@@ -48,66 +202,111 @@ def get_identifiers(db_path, book_id):
     return {row["type"]: row["val"] for row in rows}
 
 
+def get_identifiers_bulk(db_path, book_ids=None, query=None):
+    """
+    Identifiers for many books in one query: {book_id: {type: val}} in the
+    order given, including books that have none.  `query` is SQL whose first
+    column is a book id (any other columns are ignored); otherwise
+    `book_ids` is used.
+    """
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        if query:
+            book_ids = [row[0] for row in con.execute(query.strip().rstrip(";"))]
+        rows = con.execute(
+            "WITH wanted(book) AS (SELECT value FROM json_each(?)) "
+            "SELECT w.book, i.type, i.val FROM wanted w LEFT JOIN identifiers i ON i.book = w.book",
+            (json.dumps(list(book_ids)),),
+        ).fetchall()
+    finally:
+        con.close()
+    books = {}
+    for book, type_, val in rows:
+        ids = books.setdefault(int(book), {})
+        if type_ is not None:
+            ids[type_] = val
+    return books
+
+
 def fetch_url(url):
     """GET with headers, return bytes or None."""
+    data = IMAGE_CACHE.get(url)
+    if data is not None:
+        return data
     try:
-        r = requests.get(url, headers=HEADERS, timeout=TIMEOUT)
+        r = http_get(url)
         if r.status_code == 200 and len(r.content) > 1000:
+            IMAGE_CACHE.put(url, r.content, len(r.content))
             return r.content
     except Exception:
         pass
     return None
 
 
-def fetch_amazon_cover(asin):
-    """Scrape the Amazon product page for the highest-resolution cover image."""
+def _unique(urls):
+    return list(dict.fromkeys(u for u in urls if u))
+
+
+def amazon_candidates(asin):
+    """
+    Cover image URLs from the Amazon product page, best first; None if the
+    page could not be fetched.  Parsed results are cached for CACHE_TTL.
+    """
+    cached = PAGE_CACHE.get(("amazon", asin))
+    if cached is not None:
+        return cached
+    from bs4 import BeautifulSoup
+
+    r = http_get(f"https://www.amazon.com/dp/{asin}")
+    if r.status_code != 200:
+        return None
+    soup = BeautifulSoup(r.text, "html.parser")
+    urls = []
+
+    img = soup.find("img", id="landingImage") or soup.find("img", id="main-image")
+    if img:
+        # data-old-hires is the full-resolution image (typically _SL1500_)
+        urls.append(img.get("data-old-hires", "").strip())
+
+        # data-a-dynamic-image lists all responsive sizes — pick the largest
+        dynamic = img.get("data-a-dynamic-image", "")
+        if dynamic:
+            sizes = json.loads(dynamic)
+            urls.append(max(sizes, key=lambda u: sizes[u][0] * sizes[u][1]))
+
+    # og:image fallback — strip size token to get the largest available variant
+    og = soup.find("meta", property="og:image")
+    if og and og.get("content", "").startswith("http"):
+        url = og["content"]
+        urls += [re.sub(r"\._[A-Z]{1,3}\d*_", "", url), url]
+
+    # Last resort: src on the img tag
+    if img:
+        urls.append(img.get("src", "").strip())
+
+    urls = _unique(urls)
+    PAGE_CACHE.put(("amazon", asin), urls)
+    return urls
+
+
+def fetch_amazon_cover(asin, stop=None):
+    """Scrape the Amazon product page for the highest-resolution cover image; gives up once `stop` is set."""
     try:
-        r = requests.get(
-            f"https://www.amazon.com/dp/{asin}", headers=HEADERS, timeout=TIMEOUT
-        )
-        if r.status_code != 200:
+        urls = amazon_candidates(asin)
+        if urls is None:
             return None, None
-        soup = BeautifulSoup(r.text, "html.parser")
-
-        img = soup.find("img", id="landingImage") or soup.find("img", id="main-image")
-        if img:
-            # data-old-hires is the full-resolution image (typically _SL1500_)
-            hires = img.get("data-old-hires", "").strip()
-            if hires:
-                data = fetch_url(hires)
-                if data:
-                    return data, "amazon-page"
-
-            # data-a-dynamic-image lists all responsive sizes — pick the largest
-            dynamic = img.get("data-a-dynamic-image", "")
-            if dynamic:
-                sizes = json.loads(dynamic)
-                best_url = max(sizes, key=lambda u: sizes[u][0] * sizes[u][1])
-                data = fetch_url(best_url)
-                if data:
-                    return data, "amazon-page"
-
-        # og:image fallback — strip size token to get the largest available variant
-        og = soup.find("meta", property="og:image")
-        if og and og.get("content", "").startswith("http"):
-            url = og["content"]
-            clean = re.sub(r"\._[A-Z]{1,3}\d*_", "", url)
-            data = fetch_url(clean) or fetch_url(url)
+        for url in urls:
+            if stop is not None and stop.is_set():
+                return None, None
+            data = fetch_url(url)
             if data:
                 return data, "amazon-page"
-
-        # Last resort: src on the img tag or the old thumbnail URL pattern
-        if img:
-            src = img.get("src", "").strip()
-            if src:
-                data = fetch_url(src)
-                if data:
-                    return data, "amazon-page"
-
     except Exception:
         pass
 
     # Final fallback: old thumbnail URL (low-res, last resort only)
+    if stop is not None and stop.is_set():
+        return None, None
     direct = fetch_url(
         f"https://images-na.ssl-images-amazon.com/images/P/{asin}.01.LZZZZZZZ.jpg"
     )
@@ -117,42 +316,42 @@ def fetch_amazon_cover(asin):
     return None, None
 
 
-def fetch_goodreads_cover(gr_id):
+def goodreads_candidates(gr_id):
     """
-    Fetch og:image from Goodreads book page.
-    Strip ._SX999_ / ._SY999_ size suffixes to get the full-resolution version.
+    og:image URLs from the Goodreads book page: the full-resolution version
+    (size suffixes like ._SX999_ / ._SY999_ stripped) first, then the
+    original.  None if the page could not be fetched; cached like Amazon's.
     """
-    try:
-        r = requests.get(
-            f"https://www.goodreads.com/book/show/{gr_id}",
-            headers=HEADERS,
-            timeout=TIMEOUT,
-        )
-        if r.status_code != 200:
-            return None, None
-
-        soup = BeautifulSoup(r.text, "html.parser")
-        og = soup.find("meta", property="og:image")
-        if not og:
-            return None, None
+    cached = PAGE_CACHE.get(("goodreads", gr_id))
+    if cached is not None:
+        return cached
+    from bs4 import BeautifulSoup
 
-        url = og.get("content", "").strip()
-        if not url:
-            return None, None
+    r = http_get(f"https://www.goodreads.com/book/show/{gr_id}")
+    if r.status_code != 200:
+        return None
 
-        # Strip embedded size tokens like ._SY475_, ._SX318_, ._SS150_, etc.
-        clean_url = re.sub(r"\._[A-Z]{1,3}\d*_", "", url)
+    soup = BeautifulSoup(r.text, "html.parser")
+    og = soup.find("meta", property="og:image")
+    url = og.get("content", "").strip() if og else ""
+    if not url:
+        return None
 
-        if clean_url != url:
-            data = fetch_url(clean_url)
-            if data:
-                return data, clean_url
+    # Strip embedded size tokens like ._SY475_, ._SX318_, ._SS150_, etc.
+    urls = _unique([re.sub(r"\._[A-Z]{1,3}\d*_", "", url), url])
+    PAGE_CACHE.put(("goodreads", gr_id), urls)
+    return urls
 
-        # Fall back to original og:image URL
-        data = fetch_url(url)
-        if data:
-            return data, url
 
+def fetch_goodreads_cover(gr_id, stop=None):
+    """Fetch the og:image from the Goodreads book page, full resolution if available."""
+    try:
+        for url in goodreads_candidates(gr_id) or []:
+            if stop is not None and stop.is_set():
+                return None, None
+            data = fetch_url(url)
+            if data:
+                return data, url
     except Exception:
         pass
 
@@ -183,88 +382,355 @@ def image_dimensions(data):
     return 0, 0
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--book-id", type=int, required=True)
-    parser.add_argument("--db-path", required=True)
-    parser.add_argument("--out-file", required=True)
-    parser.add_argument("--source", choices=["amazon", "kindle", "goodreads", "gr_image_url"], default=None,
-                        help="Force a specific source instead of auto-selecting")
-    args = parser.parse_args()
+def cover_score(w, h):
+    """Rank an image as a front cover: its pixel count, cut to a quarter outside COVER_ASPECT."""
+    if not w or not h:
+        return 0
+    score = w * h
+    if not COVER_ASPECT[0] <= w / h <= COVER_ASPECT[1]:
+        score //= 4     # a square thumbnail, a banner or a full wrap-around
+    return score
 
-    if not os.path.exists(args.db_path):
-        fail(f"Database not found: {args.db_path}")
 
-    ids = get_identifiers(args.db_path, args.book_id)
+def clearly_good(w, h):
+    return h >= GOOD_COVER_HEIGHT and COVER_ASPECT[0] <= w / h <= COVER_ASPECT[1]
+
+
+def race_sources(ids):
+    """
+    Auto mode: fetch from every source the book has concurrently and return
+    (image bytes, source) for the best cover, or (None, None).  The first
+    clearly good image wins outright and the other sources are told to stop;
+    otherwise the highest cover_score wins, earlier sources breaking ties.
+    """
+    asin         = ids.get("amazon") or ids.get("asin")
+    kindle_asin  = ids.get("kindle_asin")
+    gr_id        = ids.get("goodreads")
+    gr_image_url = ids.get("gr_image_url")
+
+    # In order of preference when two images score the same
+    fetchers = []
+    if asin:
+        fetchers.append(("amazon", lambda stop: fetch_amazon_cover(asin, stop)[0]))
+    if gr_image_url:
+        fetchers.append(("gr_image_url", lambda stop: fetch_url(gr_image_url)))
+    if gr_id:
+        fetchers.append(("goodreads", lambda stop: fetch_goodreads_cover(gr_id, stop)[0]))
+    if kindle_asin:
+        fetchers.append(("kindle", lambda stop: fetch_amazon_cover(kindle_asin, stop)[0]))
+
+    stop = threading.Event()
+    results = queue.Queue()
+
+    def run(rank, source, fetch):
+        try:
+            data = fetch(stop)
+        except Exception:
+            data = None
+        results.put((rank, source, data))
+
+    # Daemon threads, so a CLI call that has its cover exits without waiting for the losers
+    for rank, (source, fetch) in enumerate(fetchers):
+        threading.Thread(target=run, args=(rank, source, fetch), name=f"cover-{source}", daemon=True).start()
+
+    best = None
+    deadline = time.monotonic() + RACE_TIMEOUT
+    try:
+        for _ in fetchers:
+            try:
+                rank, source, data = results.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if not data:
+                continue
+            w, h = image_dimensions(data)
+            if clearly_good(w, h):
+                return data, source
+            key = (cover_score(w, h), -rank)
+            if best is None or key > best[0]:
+                best = (key, data, source)
+    finally:
+        stop.set()
+    return (best[1], best[2]) if best else (None, None)
+
+
+SOURCE_NAMES = {"amazon": "Amazon", "kindle": "Kindle", "goodreads": "Goodreads", "gr_image_url": "GR image URL"}
+
+
+def fetch_cover(ids, source=None):
+    """Return (image bytes, source) for a book's identifiers, or raise CoverError."""
     asin         = ids.get("amazon") or ids.get("asin")
     kindle_asin  = ids.get("kindle_asin")
     gr_id        = ids.get("goodreads")
     gr_image_url = ids.get("gr_image_url")
 
     if not asin and not kindle_asin and not gr_id and not gr_image_url:
-        fail("No Amazon, Kindle, Goodreads, or GR image URL found for this book")
+        raise CoverError("No Amazon, Kindle, Goodreads, or GR image URL found for this book")
 
     img_data = None
-    source   = None
+    found    = None
 
-    if args.source == "amazon":
+    if source == "amazon":
         if not asin:
-            fail("No Amazon/ASIN identifier found for this book")
-        img_data, source = fetch_amazon_cover(asin)
+            raise CoverError("No Amazon/ASIN identifier found for this book")
+        img_data, found = fetch_amazon_cover(asin)
         if img_data:
-            source = "amazon"
-    elif args.source == "kindle":
+            found = "amazon"
+    elif source == "kindle":
         if not kindle_asin:
-            fail("No Kindle ASIN identifier found for this book")
-        img_data, source = fetch_amazon_cover(kindle_asin)
+            raise CoverError("No Kindle ASIN identifier found for this book")
+        img_data, found = fetch_amazon_cover(kindle_asin)
         if img_data:
-            source = "kindle"
-    elif args.source == "goodreads":
+            found = "kindle"
+    elif source == "goodreads":
         if not gr_id:
-            fail("No Goodreads identifier found for this book")
-        img_data, source = fetch_goodreads_cover(gr_id)
+            raise CoverError("No Goodreads identifier found for this book")
+        img_data, found = fetch_goodreads_cover(gr_id)
         if img_data:
-            source = "goodreads"
-    elif args.source == "gr_image_url":
+            found = "goodreads"
+    elif source == "gr_image_url":
         if not gr_image_url:
-            fail("No GR image URL identifier found for this book")
+            raise CoverError("No GR image URL identifier found for this book")
         img_data = fetch_url(gr_image_url)
-        source = "gr_image_url" if img_data else None
+        found = "gr_image_url" if img_data else None
     else:
-        # Auto: Amazon first, GR image URL fallback, Goodreads page last
-        if asin:
-            img_data, source = fetch_amazon_cover(asin)
-            if img_data:
-                source = "amazon"
-        if not img_data and gr_image_url:
-            img_data = fetch_url(gr_image_url)
-            if img_data:
-                source = "gr_image_url"
-        if not img_data and gr_id:
-            img_data, source = fetch_goodreads_cover(gr_id)
-            if img_data:
-                source = "goodreads"
+        img_data, found = race_sources(ids)
 
     if not img_data:
-        source_name = {"amazon": "Amazon", "kindle": "Kindle", "goodreads": "Goodreads", "gr_image_url": "GR image URL"}.get(args.source or "", "any source")
-        fail(f"Could not download cover from {source_name}")
+        raise CoverError(f"Could not download cover from {SOURCE_NAMES.get(source or '', 'any source')}")
+    return img_data, found
+
 
-    out_dir = os.path.dirname(args.out_file)
+def save_cover(img_data, source, out_file):
+    """Write the image to `out_file` and return the JSON result for it."""
+    out_dir = os.path.dirname(out_file)
     if out_dir:
         os.makedirs(out_dir, exist_ok=True)
 
-    with open(args.out_file, "wb") as f:
+    with open(out_file, "wb") as f:
         f.write(img_data)
 
     w, h = image_dimensions(img_data)
 
-    print(json.dumps({
+    return {
         "ok":      True,
         "source":  "amazon" if source and source.startswith("amazon") else source,
         "width":   w,
         "height":  h,
         "size_kb": len(img_data) // 1024,
-    }))
+    }
+
+
+def cover_request(req, cache_dir=None):
+    """
+    Handle one single-book request ({"book_id", "db_path", "out_file",
+    "source"}); return its JSON result.  With `cache_dir` (the worker) a
+    request to write anywhere else is refused.
+    """
+    if cache_dir is not None:
+        out_file = os.path.realpath(req["out_file"])
+        if os.path.commonpath([out_file, cache_dir]) != cache_dir or not out_file.endswith(".jpg"):
+            return {"ok": False, "refused": True, "error": f"Not a cover file under {cache_dir}"}
+        if not os.path.isfile(req["db_path"]):
+            return {"ok": False, "refused": True, "error": f"Database not found: {req['db_path']}"}
+        req = {**req, "out_file": out_file}
+    if not os.path.exists(req["db_path"]):
+        return {"ok": False, "error": f"Database not found: {req['db_path']}"}
+    ids = get_identifiers(req["db_path"], req["book_id"])
+    try:
+        img_data, source = fetch_cover(ids, req.get("source"))
+    except CoverError as e:
+        return {"ok": False, "error": str(e)}
+    return save_cover(img_data, source, req["out_file"])
+
+
+def forward_to_worker(socket_path, req):
+    """
+    Run `req` on a worker listening on `socket_path`; None if none is
+    running, it did not answer or it refused the request.
+    """
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(TIMEOUT * 10)
+            s.connect(socket_path)
+            s.sendall(json.dumps(req).encode() + b"\n")
+            line = s.makefile("rb").readline()
+        result = json.loads(line)
+    except (OSError, ValueError):
+        return None
+    return None if result.get("refused") else result
+
+
+def serve(socket_path, cache_dir):
+    """
+    Answer single-book requests on a Unix socket, keeping the session and
+    caches warm between them.  Covers are only written under `cache_dir`.
+    """
+    import socketserver
+
+    cache_dir = os.path.realpath(cache_dir)
+
+    if os.path.exists(socket_path):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(socket_path)
+            fail(f"A worker is already listening on {socket_path}")
+        except ConnectionRefusedError:
+            os.unlink(socket_path)   # left behind by a worker that was killed
+
+    configure_session(16)
+    # Parse once up front so the first request doesn't pay for the import either
+    from bs4 import BeautifulSoup
+    BeautifulSoup("<html></html>", "html.parser")
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            t0 = time.monotonic()
+            line = self.rfile.readline()
+            if not line.strip():
+                return   # a liveness probe, or a client that gave up
+            try:
+                req = json.loads(line)
+                result = cover_request(req, cache_dir)
+            except Exception as e:
+                req = {}
+                result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            try:
+                self.wfile.write(json.dumps(result).encode() + b"\n")
+            except OSError:
+                pass   # the CLI timed out and will have fetched it itself
+            outcome = result.get("source") if result.get("ok") else result.get("error")
+            print(f"book {req.get('book_id')}: {outcome} in {(time.monotonic() - t0) * 1000:.0f} ms "
+                  f"(page cache {PAGE_CACHE.hits}/{PAGE_CACHE.hits + PAGE_CACHE.misses}, "
+                  f"image cache {IMAGE_CACHE.hits}/{IMAGE_CACHE.hits + IMAGE_CACHE.misses})",
+                  file=sys.stderr, flush=True)
+
+    # Owner-only from the moment it is bound: other local users could
+    # otherwise have the worker read their choice of database
+    old_umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    finally:
+        os.umask(old_umask)
+    server.daemon_threads = True
+    print(f"Cover worker listening on {socket_path}", file=sys.stderr, flush=True)
+    # A service manager's SIGTERM should remove the socket too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def batch_one(book_id, ids, source, out_file, skip_existing):
+    if skip_existing and os.path.exists(out_file):
+        return {"book_id": book_id, "ok": True, "skipped": True, "out_file": out_file}
+    try:
+        img_data, found = fetch_cover(ids, source)
+        result = save_cover(img_data, found, out_file)
+    except CoverError as e:
+        return {"book_id": book_id, "ok": False, "error": str(e)}
+    except Exception as e:
+        return {"book_id": book_id, "ok": False, "error": f"{type(e).__name__}: {e}"}
+    return {"book_id": book_id, **result, "out_file": out_file}
+
+
+def run_batch(args):
+    """Fetch covers for every selected book concurrently, printing one JSON line per book."""
+    if args.book_ids == "-":
+        raw = sys.stdin.read()
+    else:
+        raw = args.book_ids or ""
+    book_ids = [int(tok) for tok in re.split(r"[\s,]+", raw) if tok]
+    try:
+        books = get_identifiers_bulk(args.db_path, book_ids=book_ids, query=args.query)
+    except sqlite3.Error as e:
+        fail(f"Could not read identifiers: {e}")
+
+    for spec in args.host_rate or []:
+        host, _, rate = spec.partition("=")
+        LIMITER.rates[host] = float(rate)
+    # Each book races up to two requests to Amazon (ASIN and Kindle ASIN) at once
+    configure_session(args.workers * 2)
+
+    t0 = time.monotonic()
+    counts = {"done": 0, "ok": 0, "failed": 0}
+    with concurrent.futures.ThreadPoolExecutor(args.workers) as pool:
+        futures = [
+            pool.submit(batch_one, book_id, ids, args.source,
+                        os.path.join(args.out_dir, args.out_name.format(id=book_id)), args.skip_existing)
+            for book_id, ids in books.items()
+        ]
+        for fut in concurrent.futures.as_completed(futures):
+            result = fut.result()
+            counts["done"] += 1
+            counts["ok" if result["ok"] else "failed"] += 1
+            print(json.dumps(result), flush=True)
+    counts["seconds"] = round(time.monotonic() - t0, 1)
+    print(json.dumps(counts), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--book-id", type=int)
+    parser.add_argument("--db-path")
+    parser.add_argument("--out-file")
+    parser.add_argument("--offline", action="store_true", help="Only use pages and images in the HTTP cache")
+    parser.add_argument("--source", choices=["auto", "amazon", "kindle", "goodreads", "gr_image_url"], default=None,
+                        help="Force a specific source instead of racing them all (auto, the default)")
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument("--book-ids", help="Comma/space separated book IDs, or - to read them from stdin")
+    batch.add_argument("--query", help="SQL returning book IDs in its first column (other columns are ignored)")
+    batch.add_argument("--out-dir", help="Directory for batch covers")
+    batch.add_argument("--out-name", default="cover_dl_{id}.jpg", help="File name per book (default: cover_dl_{id}.jpg)")
+    batch.add_argument("--workers", type=int, default=8, help="Concurrent downloads (default: 8)")
+    batch.add_argument("--host-rate", action="append", metavar="HOST=RPS",
+                       help="Requests per second for a host (repeatable), e.g. www.amazon.com=0.5")
+    batch.add_argument("--skip-existing", action="store_true", help="Skip books whose cover file already exists")
+    worker = parser.add_argument_group("worker mode")
+    worker.add_argument("--serve", action="store_true", help="Run as a long-lived worker on --socket")
+    worker.add_argument("--socket", default=SOCKET_PATH, help=f"Worker socket (default: {SOCKET_PATH})")
+    worker.add_argument("--cache-dir", default=WORKER_CACHE_DIR,
+                        help=f"The only directory the worker writes covers to (default: {WORKER_CACHE_DIR})")
+    worker.add_argument("--no-worker", action="store_true", help="Don't forward to a running worker")
+    args = parser.parse_args()
+    HTTP.offline = args.offline
+
+    if args.serve:
+        serve(args.socket, args.cache_dir)
+        return
+
+    if not args.db_path:
+        fail("--db-path is required")
+    if not os.path.exists(args.db_path):
+        fail(f"Database not found: {args.db_path}")
+
+    if args.book_ids or args.query:
+        if not args.out_dir:
+            fail("--out-dir is required with --book-ids or --query")
+        run_batch(args)
+        return
+
+    if args.book_id is None or not args.out_file:
+        fail("--book-id and --out-file are required (or use --book-ids/--query with --out-dir)")
+
+    req = {
+        "book_id":  args.book_id,
+        "db_path":  os.path.abspath(args.db_path),
+        "out_file": os.path.abspath(args.out_file),
+        "source":   args.source,
+    }
+    result = None if args.no_worker or args.offline else forward_to_worker(args.socket, req)
+    if result is None:
+        result = cover_request(req)
+    print(json.dumps(result))
+    if not result.get("ok"):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
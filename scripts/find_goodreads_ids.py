@@ -10,6 +10,12 @@ Usage:
     python3 find_goodreads_ids.py                  # all users in users.json
     python3 find_goodreads_ids.py david            # one user
     python3 find_goodreads_ids.py /path/to/metadata.db
+    python3 find_goodreads_ids.py --offline [user]  # replay cached pages only
+    python3 find_goodreads_ids.py --workers 4 --rate 20 [user]  # concurrency, requests/min
+
+Up to WORKERS books are looked up at once (ISBN lookup, title + author
+search, title-only retry), all sharing one rate limit of REQUESTS_PER_MIN
+Goodreads requests.  Pages replayed from the HTTP cache don't count.
 
 Output files (created next to this script):
     goodreads_saved.tsv      — matches written to the DB
@@ -18,12 +24,14 @@ Output files (created next to this script):
     goodreads_progress.json  — checkpoint; delete to restart from scratch
 """
 
+import concurrent.futures
 import json
 import os
 import random
 import re
 import sqlite3
 import sys
+import threading
 import time
 import unicodedata
 from datetime import datetime
@@ -31,12 +39,15 @@ from datetime import datetime
 import requests
 from bs4 import BeautifulSoup
 
+from db_writer import DBWriter
+from http_cache import HTTPCache
+
 # ── Config ────────────────────────────────────────────────────────────────────
 
-DELAY_MIN      = 5      # seconds between requests (min)
-DELAY_MAX      = 10     # seconds between requests (max)
+WORKERS        = 4      # books looked up concurrently
+REQUESTS_PER_MIN = 20   # Goodreads requests per minute across all workers
+REQUEST_BURST  = 3      # requests allowed back to back after a quiet spell
 BATCH_SIZE     = 50     # log progress every N books
-BATCH_PAUSE    = 30     # extra pause (seconds) after each batch
 MAX_RESULTS    = 15     # how many GR results to consider per book
 SCRIPT_DIR     = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR       = os.path.dirname(SCRIPT_DIR)
@@ -53,6 +64,40 @@ HEADERS = {
     "Accept-Language": "en-US,en;q=0.5",
 }
 
+# Pages already fetched are replayed from data/http_cache.db (see http_cache.py)
+HTTP = HTTPCache()
+
+
+class RateLimiter:
+    """
+    Token bucket shared by the worker threads: `per_minute` requests on
+    average, at most `burst` back to back.  Callers reserve their slot under
+    the lock and sleep outside it, so waiting workers are served in order.
+    """
+
+    def __init__(self, per_minute, burst):
+        self.per_minute = per_minute
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()     # set on shutdown so waiting workers give up
+
+    def wait(self, url=None):
+        interval = 60.0 / self.per_minute
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) / interval)
+            self.updated = now
+            self.tokens -= 1
+            delay = -self.tokens * interval if self.tokens < 0 else 0.0
+        # A little jitter so the requests don't arrive on a fixed beat
+        if delay and self.stopped.wait(delay + random.uniform(0, interval * 0.2)):
+            raise RuntimeError("shutting down")
+
+
+LIMITER = RateLimiter(REQUESTS_PER_MIN, REQUEST_BURST)
+
 # ── Text normalisation for matching ──────────────────────────────────────────
 
 def _strip_accents(s):
@@ -188,7 +233,7 @@ def lookup_by_isbn(isbn):
     """
     url = f"https://www.goodreads.com/book/isbn/{requests.utils.quote(isbn)}"
     try:
-        r = requests.get(url, headers=HEADERS, timeout=20, allow_redirects=True)
+        r = HTTP.get(url, headers=HEADERS, timeout=20, allow_redirects=True, throttle=LIMITER.wait)
     except Exception as e:
         return None, str(e)
 
@@ -198,16 +243,24 @@ def lookup_by_isbn(isbn):
     if r.status_code != 200:
         return None, f"HTTP {r.status_code}"
 
+    return parse_isbn_page(r.url, r.text), None
+
+
+def parse_isbn_page(final_url, html):
+    """
+    Parse the page an ISBN lookup landed on (`final_url` after redirects)
+    into a candidate dict, or None if it isn't a book page we can read.
+    """
     # Check the final URL after redirects
-    m = re.search(r"goodreads\.com/book/show/(\d+)", r.url)
+    m = re.search(r"goodreads\.com/book/show/(\d+)", final_url)
     if not m:
-        return None, None  # didn't redirect to a book page
+        return None  # didn't redirect to a book page
 
     gr_id = m.group(1)
 
     # Parse __NEXT_DATA__ for title / author / ratings
     title_val = author_val = avg_rating = rating_count = pub_year = ""
-    nd_m = re.search(r'<script[^>]+id="__NEXT_DATA__"[^>]*>(.+?)</script>', r.text, re.S)
+    nd_m = re.search(r'<script[^>]+id="__NEXT_DATA__"[^>]*>(.+?)</script>', html, re.S)
     if nd_m:
         try:
             nd = json.loads(nd_m.group(1))
@@ -232,18 +285,18 @@ def lookup_by_isbn(isbn):
 
     # Fallback: get title from <title> tag
     if not title_val:
-        t_m = re.search(r"<title[^>]*>([^<]+)</title>", r.text, re.I)
+        t_m = re.search(r"<title[^>]*>([^<]+)</title>", html, re.I)
         if t_m:
             title_val = re.sub(r"\s*[|\-].*$", "", t_m.group(1).strip())
 
     if not title_val:
-        return None, None  # couldn't parse anything useful
+        return None  # couldn't parse anything useful
 
     return {
         "id": gr_id, "title": title_val, "author": author_val,
         "avg_rating": avg_rating, "rating_count": rating_count,
         "pub_year": pub_year,
-    }, None
+    }
 
 
 # ── Goodreads search ──────────────────────────────────────────────────────────
@@ -322,7 +375,7 @@ def search_goodreads(title, authors, rejected_ids=None):
     def _fetch(q):
         url = f"https://www.goodreads.com/search?q={requests.utils.quote(q)}"
         try:
-            r = requests.get(url, headers=HEADERS, timeout=20)
+            r = HTTP.get(url, headers=HEADERS, timeout=20, throttle=LIMITER.wait)
         except Exception as e:
             return None, str(e)
         if r.status_code != 200:
@@ -482,77 +535,57 @@ def get_books_without_goodreads(db_path):
     con.close()
     return rows
 
-def save_match(db_path, book_id, gr_id, gr_title, avg_rating="", rating_count="", pub_year=""):
+def save_match(con, names, book_id, gr_id, gr_title, avg_rating="", rating_count="", pub_year=""):
     """
     Save the Goodreads identifier and, if the book has no series yet, also
-    save the series name and index parsed from the Goodreads title.
+    save the series name and index parsed from the Goodreads title.  `con`
+    and `names` are a DBWriter's connection and name lookups; the caller's
+    transaction is committed later.
 
     Returns a string describing what was saved, e.g. "id+series" or "id only".
     """
     series_name, series_index = parse_gr_series(gr_title)
 
-    con = _open_db(db_path)
-    try:
-        # Always save the GR identifier
+    # Always save the GR identifier
+    con.execute(
+        "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'goodreads', ?)",
+        (book_id, gr_id),
+    )
+    if avg_rating:
+        con.execute(
+            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_rating', ?)",
+            (book_id, avg_rating),
+        )
+    if rating_count:
         con.execute(
-            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'goodreads', ?)",
-            (book_id, gr_id),
+            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_rating_count', ?)",
+            (book_id, rating_count),
         )
-        if avg_rating:
+    if pub_year:
+        # Only set pubdate if the book currently has the Calibre default (year 101 = "not set")
+        cur = con.execute("SELECT pubdate FROM books WHERE id = ?", (book_id,))
+        row = cur.fetchone()
+        if row and row[0] and str(row[0]).startswith("0101-"):
             con.execute(
-                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_rating', ?)",
-                (book_id, avg_rating),
+                "UPDATE books SET pubdate = ? WHERE id = ?",
+                (f"{pub_year}-01-01T00:00:00+00:00", book_id),
             )
-        if rating_count:
+
+    series_saved = False
+    if series_name:
+        # Only set series if the book doesn't already have one
+        if not names.series.linked(book_id):
+            # Find or create the series row (an existing one is reused as is;
+            # the series_insert_trg trigger sets sort = title_sort(name))
+            # and link the book to it
+            names.series.link(book_id, [names.series.id(series_name)])
+
+            # Set the series index on the book row
             con.execute(
-                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_rating_count', ?)",
-                (book_id, rating_count),
+                "UPDATE books SET series_index = ? WHERE id = ?",
+                (series_index, book_id),
             )
-        if pub_year:
-            # Only set pubdate if the book currently has the Calibre default (year 101 = "not set")
-            cur = con.execute("SELECT pubdate FROM books WHERE id = ?", (book_id,))
-            row = cur.fetchone()
-            if row and row[0] and str(row[0]).startswith("0101-"):
-                con.execute(
-                    "UPDATE books SET pubdate = ? WHERE id = ?",
-                    (f"{pub_year}-01-01T00:00:00+00:00", book_id),
-                )
-
-        series_saved = False
-        if series_name:
-            # Only set series if the book doesn't already have one
-            existing_series = con.execute(
-                "SELECT id FROM books_series_link WHERE book = ?", (book_id,)
-            ).fetchone()
-
-            if not existing_series:
-                # Find or create the series row
-                # INSERT OR IGNORE so we don't clobber an existing series entry;
-                # the series_insert_trg trigger sets sort = title_sort(name)
-                con.execute(
-                    "INSERT OR IGNORE INTO series (name, sort, link) VALUES (?, ?, '')",
-                    (series_name, _title_sort_fn(series_name)),
-                )
-                series_id = con.execute(
-                    "SELECT id FROM series WHERE name = ? COLLATE NOCASE", (series_name,)
-                ).fetchone()[0]
-
-                # Link the book to the series
-                con.execute(
-                    "INSERT OR IGNORE INTO books_series_link (book, series) VALUES (?, ?)",
-                    (book_id, series_id),
-                )
-
-                # Set the series index on the book row
-                con.execute(
-                    "UPDATE books SET series_index = ? WHERE id = ?",
-                    (series_index, book_id),
-                )
-                series_saved = True
-
-        con.commit()
-    finally:
-        con.close()
+            series_saved = True
 
     if series_saved:
         return f"id+series ({series_name} #{series_index:g})"
@@ -620,6 +653,99 @@ def resolve_db_paths(argv):
     return paths
 
 
+def match_book(book):
+    """
+    The network half of processing one book, run on a worker thread: try an
+    ISBN lookup, then the title + author search.  Returns a dict for
+    apply_match() with the notes to print and one of:
+        kind="isbn"     candidate found by ISBN that passed the filters
+        kind="error"    search failed (book stays pending, retried next run)
+        kind="none"     no results / reason="no_results"
+        kind="nomatch"  results but nothing usable, with reason
+        kind="high" | "low"   best search candidate and its confidence
+    """
+    title   = book["title"] or ""
+    authors = book["authors"] or ""
+    isbn    = book.get("isbn") or ""
+    notes   = []
+
+    # ── Step 1: try ISBN direct lookup ────────────────────────────────────────
+    if isbn:
+        isbn_candidate, isbn_err = lookup_by_isbn(isbn)
+        if isbn_err:
+            notes.append(f"    ISBN {isbn} → isbn_error ({isbn_err}), falling back to search")
+        elif isbn_candidate:
+            gr_title = isbn_candidate.get("title", "")
+            # Apply the same filters as the search path
+            if is_likely_audiobook(gr_title):
+                notes.append(f"    ISBN {isbn} → isbn resolved to audiobook ({gr_title[:40]!r}), falling back to search")
+            elif is_foreign_script(gr_title):
+                notes.append(f"    ISBN {isbn} → isbn resolved to foreign-script edition ({gr_title[:40]!r}), falling back to search")
+            elif not title_match(title, gr_title):
+                notes.append(f"    ISBN {isbn} → isbn title mismatch ({gr_title[:40]!r}), falling back to search")
+            else:
+                return {"kind": "isbn", "isbn": isbn, "candidate": isbn_candidate, "notes": notes}
+        else:
+            notes.append(f"    ISBN {isbn} → no isbn match, falling back to search")
+
+    # ── Step 2: title + author search ────────────────────────────────────────
+    rejected_ids = set(filter(None, (book.get("gr_rejected_ids") or "").split(",")))
+
+    candidates, err = search_goodreads(title, authors, rejected_ids=rejected_ids)
+    if err:
+        return {"kind": "error", "reason": err, "notes": notes}
+    if not candidates:
+        return {"kind": "none", "notes": notes}
+
+    best, confidence = find_best_match(title, authors, candidates)
+    if best is None:
+        # Results existed but all were audiobooks or nothing matched title
+        audio_skipped   = sum(1 for c in candidates if is_likely_audiobook(c["title"]))
+        foreign_skipped = sum(1 for c in candidates if is_foreign_script(c["title"]))
+        if audio_skipped + foreign_skipped == len(candidates):
+            reason = "all_filtered(audiobook/foreign)"
+        else:
+            reason = "no_title_match"
+        return {"kind": "nomatch", "reason": reason, "count": len(candidates), "notes": notes}
+    return {"kind": confidence, "candidate": best, "notes": notes}
+
+
+def apply_match(con, names, book, result):
+    """
+    The database half, run on the main thread inside the DBWriter's
+    transaction: save or log `result` from match_book().  Returns (outcome
+    text, counter to bump, whether the book is done).
+    """
+    bid     = book["id"]
+    title   = book["title"] or ""
+    authors = book["authors"] or ""
+    kind    = result["kind"]
+    c       = result.get("candidate")
+
+    if kind == "isbn":
+        what = save_match(con, names, bid, c["id"], c.get("title", ""),
+                          c.get("avg_rating", ""), c.get("rating_count", ""), c.get("pub_year", ""))
+        log_saved(bid, title, authors, c["id"], c.get("title", ""), c.get("author", ""), f"isbn_match/{what}")
+        return (f"    ISBN {result['isbn']} → SAVED {c['id']} [isbn_match/{what}]  "
+                f"({c.get('title', '')[:35]})"), "saved", True
+    if kind == "error":
+        log_notfound(bid, title, authors, f"fetch_error: {result['reason']}")
+        return f"ERROR ({result['reason']})", "notfound", False
+    if kind == "none":
+        log_notfound(bid, title, authors, "no_results")
+        return "no results", "notfound", True
+    if kind == "nomatch":
+        log_notfound(bid, title, authors, result["reason"])
+        return f"no match ({result['reason']}, {result['count']} results)", "notfound", True
+    if kind == "high":
+        what = save_match(con, names, bid, c["id"], c["title"],
+                          c.get("avg_rating", ""), c.get("rating_count", ""), c.get("pub_year", ""))
+        log_saved(bid, title, authors, c["id"], c["title"], c["author"], what)
+        return f"SAVED {c['id']} [{what}]  ({c['title'][:35]})", "saved", True
+    log_review(bid, title, authors, c["id"], c["title"], c["author"], "low_confidence")
+    return f"review → {c['id']}  ({c['title'][:35]})", "reviewed", True
+
+
 def process_db(label, db_path, progress):
     books = get_books_without_goodreads(db_path)
     done  = set(progress["done_ids"])
@@ -630,113 +756,73 @@ def process_db(label, db_path, progress):
         print(f"[{label}] All books already have a Goodreads ID.")
         return
 
-    print(f"[{label}] {total} books to process  (DB: {db_path})")
-
-    saved = reviewed = notfound = 0
-
-    for i, book in enumerate(todo, 1):
-        bid     = book["id"]
-        title   = book["title"] or ""
-        authors = book["authors"] or ""
-        isbn    = book.get("isbn") or ""
-
-        print(f"  [{i}/{total}] {title[:55]!r} by {authors[:35]!r} ... ", end="", flush=True)
-
-        # ── Step 1: try ISBN direct lookup ────────────────────────────────────
-        if isbn:
-            print(f"\n    ISBN {isbn} → ", end="", flush=True)
-            isbn_candidate, isbn_err = lookup_by_isbn(isbn)
-            if isbn_err:
-                print(f"isbn_error ({isbn_err}), falling back to search")
-            elif isbn_candidate:
-                gr_title  = isbn_candidate.get("title", "")
-                gr_author = isbn_candidate.get("author", "")
-                # Apply the same filters as the search path
-                if is_likely_audiobook(gr_title):
-                    print(f"isbn resolved to audiobook ({gr_title[:40]!r}), falling back to search")
-                elif is_foreign_script(gr_title):
-                    print(f"isbn resolved to foreign-script edition ({gr_title[:40]!r}), falling back to search")
-                elif not title_match(title, gr_title):
-                    print(f"isbn title mismatch ({gr_title[:40]!r}), falling back to search")
-                else:
-                    what = save_match(db_path, bid, isbn_candidate["id"], gr_title,
-                                      isbn_candidate.get("avg_rating", ""),
-                                      isbn_candidate.get("rating_count", ""),
-                                      isbn_candidate.get("pub_year", ""))
-                    log_saved(bid, title, authors, isbn_candidate["id"],
-                              gr_title, gr_author, f"isbn_match/{what}")
-                    print(f"SAVED {isbn_candidate['id']} [isbn_match/{what}]  ({gr_title[:35]})")
-                    saved += 1
-                    done.add(bid)
-                    progress["done_ids"] = list(done)
-                    if i % 10 == 0:
-                        save_progress(progress)
-                    if i % BATCH_SIZE == 0:
-                        print(f"\n  ── Batch {i // BATCH_SIZE} done: {saved} saved, {reviewed} review, {notfound} not found ──")
-                        print(f"  Pausing {BATCH_PAUSE}s ...\n")
-                        time.sleep(BATCH_PAUSE)
-                    else:
-                        time.sleep(random.uniform(DELAY_MIN, DELAY_MAX))
-                    continue
-            else:
-                print(f"no isbn match, falling back to search")
-
-        # ── Step 2: title + author search ────────────────────────────────────
-        rejected_ids = set(filter(None, (book.get("gr_rejected_ids") or "").split(",")))
-
-        candidates, err = search_goodreads(title, authors, rejected_ids=rejected_ids)
-
-        if err:
-            print(f"ERROR ({err})")
-            log_notfound(bid, title, authors, f"fetch_error: {err}")
-            notfound += 1
-        elif not candidates:
-            print("no results")
-            log_notfound(bid, title, authors, "no_results")
-            notfound += 1
-            done.add(bid)
-        else:
-            best, confidence = find_best_match(title, authors, candidates)
-            if best is None:
-                # Results existed but all were audiobooks or nothing matched title
-                audio_skipped   = sum(1 for c in candidates if is_likely_audiobook(c["title"]))
-                foreign_skipped = sum(1 for c in candidates if is_foreign_script(c["title"]))
-                if audio_skipped + foreign_skipped == len(candidates):
-                    reason = "all_filtered(audiobook/foreign)"
-                else:
-                    reason = "no_title_match"
-                log_notfound(bid, title, authors, reason)
-                print(f"no match ({reason}, {len(candidates)} results)")
-                notfound += 1
-            elif confidence == "high":
-                what = save_match(db_path, bid, best["id"], best["title"],
-                                  best.get("avg_rating", ""), best.get("rating_count", ""),
-                                  best.get("pub_year", ""))
-                log_saved(bid, title, authors, best["id"], best["title"], best["author"], what)
-                print(f"SAVED {best['id']} [{what}]  ({best['title'][:35]})")
-                saved += 1
-            else:
-                log_review(bid, title, authors,
-                           best["id"], best["title"], best["author"], "low_confidence")
-                print(f"review → {best['id']}  ({best['title'][:35]})")
-                reviewed += 1
-            done.add(bid)
+    print(f"[{label}] {total} books to process  (DB: {db_path})  "
+          f"[{WORKERS} workers, {LIMITER.per_minute:g} requests/min]")
 
-        progress["done_ids"] = list(done)
+    counts = {"saved": 0, "reviewed": 0, "notfound": 0}
 
-        if i % 10 == 0:
-            save_progress(progress)
+    def checkpoint():
+        progress["done_ids"] = list(done)
+        save_progress(progress)
+
+    # Workers overlap the lookups for different books while LIMITER holds the
+    # total request rate.  Results are written and printed here as they
+    # finish, so [n/total] counts completed books; the writer commits
+    # whenever we'd otherwise sit waiting on the workers.
+    books = iter(todo)
+    pending = {}
+    pool = concurrent.futures.ThreadPoolExecutor(WORKERS, thread_name_prefix="gr-match")
+    try:
+        with DBWriter(db_path, _open_db, on_commit=checkpoint) as writer:
+            i = 0
+            while True:
+                while len(pending) < WORKERS * 2:
+                    book = next(books, None)
+                    if book is None:
+                        break
+                    pending[pool.submit(match_book, book)] = book
+                if not pending:
+                    break
+                ready, _ = concurrent.futures.wait(pending, timeout=0, return_when=concurrent.futures.FIRST_COMPLETED)
+                if not ready:
+                    writer.flush()
+                    ready, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for fut in ready:
+                    i += 1
+                    book    = pending.pop(fut)
+                    title   = book["title"] or ""
+                    authors = book["authors"] or ""
+                    try:
+                        result = fut.result()
+                    except Exception as e:
+                        result = {"kind": "error", "reason": f"{type(e).__name__}: {e}", "notes": []}
+                    # A fetch error writes nothing, so it needn't take the write lock
+                    with writer.book(writes=result["kind"] != "error") as con:
+                        outcome, counter, finished = apply_match(con, writer.names, book, result)
+                        if finished:
+                            done.add(book["id"])
+                    counts[counter] += 1
+
+                    lines = [f"  [{i}/{total}] {title[:55]!r} by {authors[:35]!r} ... ", *result["notes"]]
+                    if result["notes"] or result["kind"] == "isbn":
+                        lines.append(outcome)
+                    else:
+                        lines[-1] += outcome
+                    print("\n".join(lines), flush=True)
 
-        if i % BATCH_SIZE == 0:
-            print(f"\n  ── Batch {i // BATCH_SIZE} done: "
-                  f"{saved} saved, {reviewed} review, {notfound} not found ──")
-            print(f"  Pausing {BATCH_PAUSE}s ...\n")
-            time.sleep(BATCH_PAUSE)
-        else:
-            time.sleep(random.uniform(DELAY_MIN, DELAY_MAX))
+                    if i % BATCH_SIZE == 0:
+                        print(f"\n  ── Batch {i // BATCH_SIZE} done: "
+                              f"{counts['saved']} saved, {counts['reviewed']} review, {counts['notfound']} not found ──\n")
+    finally:
+        # On a stop, don't start queued books or wait out the rate limit
+        LIMITER.stopped.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        LIMITER.stopped = threading.Event()
 
-    save_progress(progress)
-    print(f"\n[{label}] Done: {saved} saved, {reviewed} need review, {notfound} not found")
+    checkpoint()
+    print(f"\n[{label}] Done: {counts['saved']} saved, {counts['reviewed']} need review, "
+          f"{counts['notfound']} not found")
 
 
 def refetch_book(book_id, db_path):
@@ -789,15 +875,35 @@ def refetch_book(book_id, db_path):
 
     print(f"\nConfidence : {confidence}")
     print(f"Saving GR ID {best['id']} for book {book_id} …")
-    what = save_match(db_path, book_id, best["id"], best["title"],
-                      best.get("avg_rating", ""), best.get("rating_count", ""),
-                      best.get("pub_year", ""))
+    with DBWriter(db_path, _open_db) as writer, writer.book() as con:
+        what = save_match(con, writer.names, book_id, best["id"], best["title"],
+                          best.get("avg_rating", ""), best.get("rating_count", ""),
+                          best.get("pub_year", ""))
     _write_header(SAVED_LOG, "book_id","book_title","book_authors","gr_id","gr_title","gr_author","saved")
     log_saved(book_id, title, authors, best["id"], best["title"], best["author"], what)
     print(f"Done: {what}")
 
 
+def _pop_option(name, default):
+    """Remove `name VALUE` from sys.argv and return VALUE (or `default` if absent)."""
+    if name not in sys.argv:
+        return default
+    idx = sys.argv.index(name)
+    if idx + 1 >= len(sys.argv):
+        print(f"ERROR: {name} requires a value"); sys.exit(1)
+    value = sys.argv[idx + 1]
+    del sys.argv[idx:idx + 2]
+    return value
+
+
 def main():
+    if "--offline" in sys.argv:
+        # Replay from the HTTP cache only (e.g. to re-run parsing after a fix)
+        sys.argv.remove("--offline")
+        HTTP.offline = True
+    global WORKERS
+    WORKERS = int(_pop_option("--workers", WORKERS))
+    LIMITER.per_minute = float(_pop_option("--rate", LIMITER.per_minute))
     args = sys.argv[1:]
 
     # --book-id N [user_or_db]: re-fetch a single book by Calibre ID
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Recorded Goodreads pages for regression-testing and benchmarking the
+scrapers' parsers without touching goodreads.com.
+
+The corpus lives in data/gr_corpus/:
+
+    pages.db      the recorded responses, in http_cache.py's format plus a
+                  `cases` table labelling each page (book:non-english,
+                  book:audiobook, book:omnibus, search:audio, ...)
+    golden.json   the expected parser output per URL
+
+Each page goes to the parser the scripts use for it, with the network
+left out:
+
+    /book/show/{id}      scrape_goodreads_metadata.parse_book_page
+    /book/isbn/{isbn}    find_goodreads_ids.parse_isbn_page (lookup_by_isbn)
+    /search?q=...        find_goodreads_ids._parse_gr_search_page
+    /work/shelves/{id}   scrape_goodreads_shelves.parse_shelves
+
+Pages are picked from the HTTP cache the scrapers fill as they run, so the
+corpus is real markup: `record` parses every cached Goodreads page, labels
+it and keeps up to --per-label pages of each label, so rare cases (foreign
+editions, audiobooks, omnibus editions, empty searches) are represented
+next to the common ones.  --url records specific pages live.  The pages
+are Goodreads content, so the corpus stays local rather than in git.
+
+Because pages.db is an HTTP cache, a whole scraper run can also be
+replayed against it:  HTTP_CACHE=data/gr_corpus/pages.db
+python3 scrape_goodreads_metadata.py --offline /path/to/metadata.db
+
+Usage:
+    python3 gr_corpus.py record [--from data/http_cache.db] [--per-label 30]
+    python3 gr_corpus.py record --url https://www.goodreads.com/book/show/2767052
+    python3 gr_corpus.py golden          # accept the current output as expected
+    python3 gr_corpus.py check           # field-level diff against golden.json
+    python3 gr_corpus.py bench [--rounds 3]
+"""
+
+import argparse
+import collections
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+import tracemalloc
+import zlib
+
+import find_goodreads_ids as fgi
+import scrape_goodreads_metadata as md
+import scrape_goodreads_shelves as sh
+from http_cache import CACHE_PATH, SCHEMA, CachedResponse, HTTPCache
+
+CORPUS_DIR = os.path.join(md.DATA_DIR, "gr_corpus")
+PER_LABEL  = 30
+
+ROUTES = [
+    ("book",    re.compile(r"^https://www\.goodreads\.com/book/show/(\d+)")),
+    ("isbn",    re.compile(r"^https://www\.goodreads\.com/book/isbn/")),
+    ("search",  re.compile(r"^https://www\.goodreads\.com/search\?")),
+    ("shelves", re.compile(r"^https://www\.goodreads\.com/work/shelves/(\d+)")),
+]
+
+CASES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    url   TEXT PRIMARY KEY REFERENCES responses (url),
+    kind  TEXT NOT NULL,        -- which parser: book, isbn, search, shelves
+    label TEXT NOT NULL         -- what the page exercises, e.g. book:audiobook
+);
+"""
+
+_OMNIBUS_POSITION = re.compile(r'"userPosition":\s*"\d+(?:\.\d+)?\s*-')
+_OMNIBUS_TITLE    = re.compile(r"#\d+(?:\.\d+)?\s*-\s*\d+|\s/\s|\bomnibus\b|\bbox(?:ed)? set\b", re.I)
+
+
+def route(url):
+    for kind, pattern in ROUTES:
+        if pattern.match(url):
+            return kind
+    return None
+
+
+def parse(kind, url, resp):
+    """Run `kind`'s parser on a 200 response; the result as plain JSON types."""
+    if kind == "book":
+        data, err = md.parse_book_page(resp.content, ROUTES[0][1].match(url).group(1))
+        out = {"data": data, "error": err}
+    elif kind == "isbn":
+        out = fgi.parse_isbn_page(resp.url, resp.text)
+    elif kind == "search":
+        out = fgi._parse_gr_search_page(resp.text)
+    else:
+        out = sh.parse_shelves(resp.text)
+    return json.loads(json.dumps(out))
+
+
+def parse_or_error(kind, url, resp):
+    """parse(), with an exception standing in as the output so golden/check record it like any change."""
+    try:
+        return parse(kind, url, resp)
+    except Exception as e:
+        return {"exception": f"{type(e).__name__}: {e}"}
+
+
+def label(kind, out, resp):
+    """Which case a parsed page exercises; `record` keeps a few pages of each."""
+    if kind == "book":
+        data = out["data"]
+        if out["error"]:
+            return "book:error"
+        if data["is_audiobook"]:
+            return "book:audiobook"
+        if not data["is_english"]:
+            return "book:non-english"
+        if _OMNIBUS_POSITION.search(md.next_data(resp.content) or ""):
+            return "book:omnibus"
+        if not data["reviews"]:
+            return "book:no-reviews"
+        return "book:series" if data["series_name"] else "book:standalone"
+    if kind == "isbn":
+        return "isbn:hit" if out else "isbn:unreadable"
+    if kind == "search":
+        if not out:
+            return "search:empty"
+        if any(c["narrator_role"] or fgi._candidate_is_audio(c) for c in out):
+            return "search:audio"
+        if any(_OMNIBUS_TITLE.search(c["title"]) for c in out):
+            return "search:omnibus"
+        if any(fgi.is_foreign_script(c["title"]) for c in out):
+            return "search:foreign-script"
+        return "search:plain"
+    return "shelves" if out else "shelves:empty"
+
+
+def classify(kind, url, resp):
+    """label() of the parsed page, or {kind}:crash if the parser raised: worth keeping, it failed on real markup."""
+    try:
+        return label(kind, parse(kind, url, resp), resp)
+    except Exception as e:
+        print(f"  {url}: {type(e).__name__}: {e}")
+        return f"{kind}:crash"
+
+
+# ── Corpus storage ────────────────────────────────────────────────────────────
+
+def open_corpus(corpus_dir):
+    os.makedirs(corpus_dir, exist_ok=True)
+    con = sqlite3.connect(os.path.join(corpus_dir, "pages.db"), isolation_level=None)
+    con.executescript(SCHEMA + CASES_SCHEMA)
+    return con
+
+
+def cases(corpus_dir, kinds=None):
+    """Yield (url, kind, label, response) for each recorded page, one at a time."""
+    path = os.path.join(corpus_dir, "pages.db")
+    if not os.path.exists(path):
+        sys.exit(f"no corpus at {path}: run `gr_corpus.py record` first")
+    con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        for url, kind, lbl, final_url, headers, encoding, data in con.execute(
+            "SELECT c.url, c.kind, c.label, r.final_url, r.headers, b.encoding, b.data "
+            "FROM cases c JOIN responses r ON r.url = c.url JOIN bodies b ON b.hash = r.hash "
+            "ORDER BY c.kind, c.label, c.url"
+        ):
+            if kinds and kind not in kinds:
+                continue
+            content = zlib.decompress(data) if encoding == "zlib" else data
+            yield url, kind, lbl, CachedResponse(final_url, 200, json.loads(headers), content, True)
+    finally:
+        con.close()
+
+
+def golden_path(corpus_dir):
+    return os.path.join(corpus_dir, "golden.json")
+
+
+def load_golden(corpus_dir):
+    try:
+        with open(golden_path(corpus_dir), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# ── Commands ──────────────────────────────────────────────────────────────────
+
+def cmd_record(args):
+    con = open_corpus(args.corpus)
+    counts = collections.Counter(lbl for lbl, in con.execute("SELECT label FROM cases"))
+    added = collections.Counter()
+
+    if args.url:
+        cache = HTTPCache(os.path.join(args.corpus, "pages.db"))
+        for url in args.url:
+            kind = route(url)
+            if kind is None:
+                print(f"skip {url}: not a page any parser reads")
+                continue
+            try:
+                resp = cache.get(url, headers=md.HEADERS, timeout=20)
+            except Exception as e:
+                print(f"skip {url}: {e}")
+                continue
+            if resp.status_code != 200:
+                print(f"skip {url}: HTTP {resp.status_code}")
+                continue
+            lbl = classify(kind, url, resp)
+            con.execute("INSERT OR REPLACE INTO cases (url, kind, label) VALUES (?, ?, ?)", (url, kind, lbl))
+            added[lbl] += 1
+    else:
+        source = args.source
+        if not os.path.exists(source):
+            sys.exit(f"no HTTP cache at {source}: run the scrapers first, or give --url")
+        src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+        con.execute("ATTACH DATABASE ? AS src", (source,))
+        recorded = {url for url, in con.execute("SELECT url FROM cases")}
+        for url, final_url, headers, encoding, data in src.execute(
+            "SELECT r.url, r.final_url, r.headers, b.encoding, b.data FROM responses r "
+            "JOIN bodies b ON b.hash = r.hash WHERE r.status = 200 AND r.url LIKE 'https://www.goodreads.com/%' "
+            "ORDER BY r.url"
+        ):
+            kind = route(url)
+            if kind is None or url in recorded:
+                continue
+            content = zlib.decompress(data) if encoding == "zlib" else data
+            resp = CachedResponse(final_url, 200, json.loads(headers), content, True)
+            lbl = classify(kind, url, resp)
+            if counts[lbl] >= args.per_label:
+                continue
+            with con:
+                con.execute("BEGIN")
+                con.execute("INSERT OR IGNORE INTO bodies SELECT b.* FROM src.bodies b "
+                            "JOIN src.responses r ON r.hash = b.hash WHERE r.url = ?", (url,))
+                con.execute("INSERT OR REPLACE INTO responses SELECT * FROM src.responses WHERE url = ?", (url,))
+                con.execute("INSERT OR REPLACE INTO cases (url, kind, label) VALUES (?, ?, ?)", (url, kind, lbl))
+            counts[lbl] += 1
+            added[lbl] += 1
+        src.close()
+
+    for lbl in sorted(counts):
+        print(f"  {lbl:<24} {counts[lbl]:>4}  (+{added[lbl]})")
+    print(f"{sum(added.values())} pages recorded; run `gr_corpus.py check` to see how they parse, "
+          f"then `gr_corpus.py golden` to accept the output")
+
+
+def cmd_golden(args):
+    golden = {url: parse_or_error(kind, url, resp) for url, kind, _, resp in cases(args.corpus)}
+    with open(golden_path(args.corpus), "w", encoding="utf-8") as f:
+        json.dump(golden, f, ensure_ascii=False, indent=1, sort_keys=True)
+    print(f"{len(golden)} golden outputs written to {golden_path(args.corpus)}")
+
+
+_MISSING = object()
+
+
+def diff(golden, now, path=""):
+    """Yield (field path, golden value, current value) for every field that differs."""
+    if isinstance(golden, dict) and isinstance(now, dict):
+        for key in sorted(golden.keys() | now.keys()):
+            yield from diff(golden.get(key, _MISSING), now.get(key, _MISSING), f"{path}.{key}" if path else key)
+    elif isinstance(golden, list) and isinstance(now, list):
+        for i in range(max(len(golden), len(now))):
+            yield from diff(golden[i] if i < len(golden) else _MISSING,
+                            now[i] if i < len(now) else _MISSING, f"{path}[{i}]")
+    elif golden != now:
+        yield path or "(whole)", golden, now
+
+
+def _show(value, width=70):
+    text = "(missing)" if value is _MISSING else json.dumps(value, ensure_ascii=False)
+    return text if len(text) <= width else text[:width - 1] + "…"
+
+
+def cmd_check(args):
+    golden = load_golden(args.corpus)
+    per_label = collections.defaultdict(lambda: [0, 0])
+    new = changed = wrong_nodes = 0
+    for url, kind, lbl, resp in cases(args.corpus, args.kind):
+        per_label[lbl][0] += 1
+        now = parse_or_error(kind, url, resp)
+        if kind == "book" and "exception" not in now:
+            # golden.json can't catch this: a wrong node would be in it too
+            keys = md.apollo_mismatches(resp.content, ROUTES[0][1].match(url).group(1))
+            if keys:
+                wrong_nodes += 1
+                print(f"{url}  [{lbl}]\n    ApolloState differs from json.loads for: {', '.join(keys[:5])}")
+        if url not in golden:
+            new += 1
+            continue
+        fields = list(diff(golden[url], now))
+        if fields:
+            changed += 1
+            per_label[lbl][1] += 1
+            print(f"{url}  [{lbl}]")
+            for field, old, cur in fields[:args.max_fields]:
+                print(f"    {field}: {_show(old)} → {_show(cur)}")
+            if len(fields) > args.max_fields:
+                print(f"    … {len(fields) - args.max_fields} more fields")
+
+    print(f"\n{'label':<24} {'pages':>6} {'changed':>8}")
+    for lbl, (n, c) in sorted(per_label.items()):
+        print(f"{lbl:<24} {n:>6} {c:>8}")
+    total = sum(n for n, _ in per_label.values())
+    print(f"{total} pages, {changed} changed, {new} without golden output"
+          + (f", {wrong_nodes} with Apollo nodes found wrongly" if wrong_nodes else ""))
+    if changed or wrong_nodes:
+        sys.exit(1)
+
+
+def cmd_bench(args):
+    stats = collections.defaultdict(lambda: {"pages": 0, "bytes": 0, "seconds": 0.0, "peaks": []})
+    crashed = {}                # url → label: left out of the timings, listed after them
+    for _ in range(args.rounds):
+        for url, kind, lbl, resp in cases(args.corpus, args.kind):
+            if url in crashed:
+                continue
+            t0 = time.perf_counter()
+            try:
+                parse(kind, url, resp)
+            except Exception:
+                crashed[url] = lbl
+                continue
+            s = stats[kind]
+            s["seconds"] += time.perf_counter() - t0
+            s["pages"] += 1
+            s["bytes"] += len(resp.content)
+
+    # Allocations in a separate pass: tracing slows the parsers down several times
+    tracemalloc.start()
+    for url, kind, _, resp in cases(args.corpus, args.kind):
+        if url in crashed:
+            continue
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        parse(kind, url, resp)
+        stats[kind]["peaks"].append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    print(f"{'parser':<8} {'pages':>6} {'pages/s':>9} {'MB/s':>7} {'alloc peak KB mean / max':>26}")
+    for kind, _ in ROUTES:
+        s = stats.get(kind)
+        if not s:
+            continue
+        peaks = s["peaks"]
+        print(f"{kind:<8} {len(peaks):>6} {s['pages'] / s['seconds']:>9.1f} "
+              f"{s['bytes'] / 1024 / 1024 / s['seconds']:>7.1f} "
+              f"{sum(peaks) / len(peaks) / 1024:>15.0f} / {max(peaks) / 1024:<8.0f}")
+    if crashed:
+        print(f"\n{'label':<24} {'crashed':>8}   (not timed; `check` shows the exceptions)")
+        for lbl, n in sorted(collections.Counter(crashed.values()).items()):
+            print(f"{lbl:<24} {n:>8}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus", default=CORPUS_DIR, help=f"corpus directory (default: {CORPUS_DIR})")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="add pages to the corpus")
+    rec.add_argument("--from", dest="source", default=CACHE_PATH, help="HTTP cache to pick pages from")
+    rec.add_argument("--per-label", type=int, default=PER_LABEL,
+                     help=f"pages to keep of each label (default: {PER_LABEL})")
+    rec.add_argument("--url", action="append", help="record this page live instead (repeatable)")
+
+    sub.add_parser("golden", help="write the current parser output as golden.json")
+
+    chk = sub.add_parser("check", help="diff the parsers' output against golden.json")
+    chk.add_argument("--kind", action="append", choices=[k for k, _ in ROUTES])
+    chk.add_argument("--max-fields", type=int, default=10, help="fields to show per changed page")
+
+    bench = sub.add_parser("bench", help="parser throughput and allocations")
+    bench.add_argument("--kind", action="append", choices=[k for k, _ in ROUTES])
+    bench.add_argument("--rounds", type=int, default=3, help="passes over the corpus (default: 3)")
+
+    args = ap.parse_args()
+    {"record": cmd_record, "golden": cmd_golden, "check": cmd_check, "bench": cmd_bench}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
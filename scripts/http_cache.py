@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+On-disk HTTP cache shared by the scraping scripts.
+
+Responses are kept in one SQLite file (data/http_cache.db, or $HTTP_CACHE;
+HTTP_CACHE=off disables caching).  Each URL maps to its status, final URL
+after redirects, a few headers and the hash of its body.  Bodies are stored
+once per distinct content, zlib-compressed when that helps (HTML shrinks
+5-10x, images don't).
+
+A fresh entry (younger than its TTL) is returned without touching the
+network.  A stale one is revalidated with If-None-Match / If-Modified-Since
+when the server gave an ETag or Last-Modified, so an unchanged page costs a
+304 instead of a download.  Only 200/404/410 answers are stored; errors and
+rate-limit responses always go to the network next time.  Once the bodies
+pass MAX_BYTES, the least recently used responses are dropped.
+
+Offline mode never touches the network: stale entries are served as they
+are and a URL that was never fetched raises CacheMiss, which the scripts
+treat like any other fetch error.
+
+    from http_cache import HTTPCache
+    HTTP = HTTPCache()
+    r = HTTP.get(url, headers=HEADERS, timeout=20)
+    r.status_code, r.text, r.url, r.from_cache
+
+    python3 http_cache.py             # entries and size
+    python3 http_cache.py --clear     # empty the cache
+"""
+
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+SCRIPT_DIR  = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR    = os.path.dirname(SCRIPT_DIR)
+CACHE_PATH  = os.environ.get("HTTP_CACHE") or os.path.join(ROOT_DIR, "data", "http_cache.db")
+DEFAULT_TTL = 7 * 24 * 3600           # seconds before an entry is revalidated
+MAX_BYTES   = 512 * 1024 * 1024       # stored (compressed) body size before LRU eviction
+CACHEABLE   = {200, 404, 410}
+KEEP_HEADERS = ("content-type", "etag", "last-modified")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bodies (
+    hash     TEXT PRIMARY KEY,      -- sha256 of the uncompressed body
+    encoding TEXT NOT NULL,         -- 'zlib' or 'identity'
+    data     BLOB NOT NULL,
+    size     INTEGER NOT NULL       -- bytes stored
+);
+CREATE TABLE IF NOT EXISTS responses (
+    url       TEXT PRIMARY KEY,
+    final_url TEXT NOT NULL,
+    status    INTEGER NOT NULL,
+    headers   TEXT NOT NULL,        -- JSON of KEEP_HEADERS
+    hash      TEXT NOT NULL REFERENCES bodies (hash),
+    fetched   REAL NOT NULL,
+    expires   REAL NOT NULL,
+    used      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+CREATE INDEX IF NOT EXISTS responses_hash ON responses (hash);
+"""
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class CachedResponse:
+    """The parts of a requests.Response the scripts use, whether it came from the cache or not."""
+
+    def __init__(self, url, status_code, headers, content, from_cache):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.from_cache = from_cache
+
+    @functools.cached_property
+    def text(self):
+        ctype = self.headers.get("content-type", "")
+        charset = ctype.split("charset=", 1)[1].split(";")[0].strip() if "charset=" in ctype else "utf-8"
+        try:
+            return self.content.decode(charset, "replace")
+        except LookupError:
+            return self.content.decode("utf-8", "replace")
+
+
+class HTTPCache:
+    def __init__(self, path=CACHE_PATH, ttl=DEFAULT_TTL, max_bytes=MAX_BYTES, offline=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.before_network = None   # called (in the requesting thread) before any request goes out
+        self.network_requests = 0
+        self.hits = 0
+        self.revalidated = 0
+        self._paused_at = 0
+        self._con = None
+        self._disabled = path == "off"
+        self._lock = threading.Lock()
+
+    def _db(self):
+        """
+        The cache connection, opened on first use; None if caching is off or
+        the file can't be opened.  Threads sharing the cache open it once.
+        """
+        if self._con is None and not self._disabled:
+            with self._lock:
+                if self._con is None and not self._disabled:
+                    try:
+                        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                        con = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+                        con.execute("PRAGMA journal_mode = WAL")
+                        con.execute("PRAGMA synchronous = NORMAL")
+                        con.executescript(SCHEMA)
+                        self._con = con
+                    except (OSError, sqlite3.Error) as e:
+                        print(f"http_cache: not caching ({self.path}: {e})", file=sys.stderr)
+                        self._disabled = True
+        return self._con
+
+    # ── Lookup / store ───────────────────────────────────────────────────────
+
+    def _lookup(self, url):
+        con = self._db()
+        if con is None:
+            return None
+        with self._lock:
+            row = con.execute(
+                "SELECT r.final_url, r.status, r.headers, r.expires, b.encoding, b.data "
+                "FROM responses r JOIN bodies b ON b.hash = r.hash WHERE r.url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            con.execute("UPDATE responses SET used = ? WHERE url = ?", (time.time(), url))
+        final_url, status, headers, expires, encoding, data = row
+        content = zlib.decompress(data) if encoding == "zlib" else data
+        return CachedResponse(final_url, status, json.loads(headers), content, True), expires
+
+    def _store(self, url, resp, ttl):
+        con = self._db()
+        if con is None:
+            return
+        digest = hashlib.sha256(resp.content).hexdigest()
+        packed = zlib.compress(resp.content, 6)
+        encoding, data = ("zlib", packed) if len(packed) < len(resp.content) * 0.9 else ("identity", resp.content)
+        now = time.time()
+        with self._lock, con:
+            con.execute("BEGIN IMMEDIATE")
+            old = con.execute("SELECT hash FROM responses WHERE url = ?", (url,)).fetchone()
+            con.execute("INSERT OR IGNORE INTO bodies (hash, encoding, data, size) VALUES (?, ?, ?, ?)",
+                        (digest, encoding, data, len(data)))
+            con.execute(
+                "INSERT OR REPLACE INTO responses (url, final_url, status, headers, hash, fetched, expires, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, resp.url, resp.status_code, json.dumps(resp.headers), digest, now, now + ttl, now),
+            )
+            if old and old[0] != digest:
+                con.execute("DELETE FROM bodies WHERE hash = ? AND NOT EXISTS "
+                            "(SELECT 1 FROM responses WHERE hash = ?)", (old[0], old[0]))
+            self._evict(con)
+
+    def _touch(self, url, ttl):
+        con = self._db()
+        now = time.time()
+        with self._lock:
+            con.execute("UPDATE responses SET fetched = ?, expires = ?, used = ? WHERE url = ?",
+                        (now, now + ttl, now, url))
+
+    def _evict(self, con):
+        """Once the bodies pass max_bytes, drop the least recently used responses until they fit in 90% of it."""
+        total = con.execute("SELECT COALESCE(SUM(size), 0) FROM bodies").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes * 0.9
+        victims = []
+        for url, digest, size in con.execute(
+            "SELECT r.url, r.hash, b.size FROM responses r JOIN bodies b ON b.hash = r.hash ORDER BY r.used"
+        ):
+            victims.append((url, digest))
+            excess -= size
+            if excess <= 0:
+                break
+        con.executemany("DELETE FROM responses WHERE url = ?", [(url,) for url, _ in victims])
+        con.executemany("DELETE FROM bodies WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM responses WHERE hash = ?)",
+                        [(digest, digest) for _, digest in victims])
+
+    # ── Public API ───────────────────────────────────────────────────────────
+
+    def get(self, url, headers=None, timeout=20, allow_redirects=True, ttl=None, session=None, throttle=None):
+        """
+        GET `url` through the cache and return a CachedResponse.  `session` is
+        the requests session to use (default: a plain requests.get) and
+        `throttle(url)`, if given, is called only before going to the network.
+        Raises CacheMiss in offline mode when `url` was never cached, and
+        whatever requests raises otherwise.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        cached = self._lookup(url)
+        if cached is not None:
+            resp, expires = cached
+            if self.offline or expires > time.time():
+                with self._lock:
+                    self.hits += 1
+                return resp
+        elif self.offline:
+            raise CacheMiss(f"not cached (offline): {url}")
+
+        send = dict(headers or {})
+        if cached is not None:
+            if resp.headers.get("etag"):
+                send["If-None-Match"] = resp.headers["etag"]
+            if resp.headers.get("last-modified"):
+                send["If-Modified-Since"] = resp.headers["last-modified"]
+
+        if self.before_network is not None:
+            self.before_network()
+        if throttle is not None:
+            throttle(url)
+        if session is None:
+            import requests
+            session = requests
+        with self._lock:
+            self.network_requests += 1
+        r = session.get(url, headers=send, timeout=timeout, allow_redirects=allow_redirects)
+
+        if r.status_code == 304 and cached is not None:
+            with self._lock:
+                self.revalidated += 1
+            self._touch(url, ttl)
+            return resp
+
+        fresh = CachedResponse(r.url, r.status_code,
+                               {k: r.headers[k] for k in KEEP_HEADERS if k in r.headers},
+                               r.content, False)
+        if r.status_code in CACHEABLE:
+            self._store(url, fresh, ttl)
+        return fresh
+
+    def used_network(self):
+        """Whether a request has gone to the network since the last call: replaying from cache needs no politeness delay."""
+        used = self.network_requests != self._paused_at
+        self._paused_at = self.network_requests
+        return used
+
+    def stats(self):
+        con = self._db()
+        if con is None:
+            return {"path": self.path, "enabled": False}
+        with self._lock:
+            entries, = con.execute("SELECT COUNT(*) FROM responses").fetchone()
+            bodies, stored = con.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM bodies").fetchone()
+            stale, = con.execute("SELECT COUNT(*) FROM responses WHERE expires < ?", (time.time(),)).fetchone()
+        return {"path": self.path, "enabled": True, "entries": entries, "stale": stale,
+                "bodies": bodies, "stored_mb": round(stored / 1024 / 1024, 1)}
+
+    def clear(self):
+        con = self._db()
+        if con is None:
+            return
+        with self._lock, con:
+            con.execute("BEGIN IMMEDIATE")
+            con.execute("DELETE FROM responses")
+            con.execute("DELETE FROM bodies")
+        con.execute("VACUUM")
+
+
+def main():
+    cache = HTTPCache()
+    if "--clear" in sys.argv[1:]:
+        cache.clear()
+    print(json.dumps(cache.stats()))
+
+
+if __name__ == "__main__":
+    main()
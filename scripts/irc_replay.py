@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Replay captured IRC traffic through the daemon's line framing at random splits.
+
+Takes raw channel traffic (either a raw capture with one IRC line per line,
+or the daemon's own dcc_log, whose "IRC >> ..." entries are extracted),
+re-joins it into a CRLF byte stream and feeds it to IRCLineBuffer in chunks
+cut at random byte offsets, many times over.  Every DCC SEND offer present
+in the capture must come back out of parse_irc_line()/parse_dcc_send()
+identically on every round; the old recv().decode().split("\\r\\n") framing
+is run over the same chunks for comparison.
+
+Usage:
+    python3 irc_replay.py /srv/http/calibre-nilla/ircLog/dcc_log
+    python3 irc_replay.py capture.txt --rounds 500 --seed 7
+    python3 irc_replay.py --synthetic 5000          # generated busy-channel traffic
+
+Exits non-zero if any offer is lost or mangled.
+"""
+
+import argparse
+import os
+import random
+import socket
+import struct
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import irc_dcc_daemon as daemon  # noqa: E402
+
+# Replaying thousands of lines should not spam the console or the real log
+daemon.log_event = lambda message, level="info", kind="daemon": None
+
+
+def load_capture(path):
+    lines = []
+    with open(path, "rb") as f:
+        for raw in f:
+            raw = raw.rstrip(b"\r\n")
+            marker = raw.find(b"] IRC >> ")
+            if marker != -1:
+                lines.append(raw[marker + len(b"] IRC >> "):])
+            elif raw and b"] " not in raw[:24]:
+                lines.append(raw)
+    return lines
+
+
+def synthetic_capture(count, rng):
+    """Busy-channel chatter with DCC offers mixed in, including quoted and non-ASCII names."""
+    ip = struct.unpack("!I", socket.inet_aton("203.0.113.7"))[0]
+    names = [
+        "Author - Title.epub",
+        "Ursula K. Le Guin - The Dispossessed (retail).epub",
+        "Günter Grass - Die Blechtrommel.epub",
+        "José Saramago - Ensaio sobre a Cegueira.pdf",
+        "single_token_name.mobi",
+        "Иван Тургенев - Отцы и дети.epub",
+    ]
+    lines = []
+    for i in range(count):
+        roll = rng.random()
+        if roll < 0.15:
+            name = rng.choice(names)
+            quoted = f'"{name}"' if " " in name else name
+            size = rng.randint(10_000, 900_000_000)
+            lines.append(f":Bot{i % 7}!x@bots PRIVMSG prinn :\x01DCC SEND {quoted} {ip} {4000 + i} {size}\x01".encode())
+        elif roll < 0.2:
+            lines.append(b"PING :irc.irchighway.net")
+        else:
+            chatter = "".join(rng.choice("abcdefghij klmnopqrstuvwxyz éü") for _ in range(rng.randint(5, 400)))
+            lines.append(f":user{i}!u@host PRIVMSG #ebooks :{chatter}".encode())
+    return lines
+
+
+def offers_from_lines(lines):
+    offers = []
+    for line in lines:
+        msg = daemon.parse_irc_line(line)
+        if msg and msg.command == "PRIVMSG" and len(msg.params) > 1 \
+                and msg.params[-1].startswith(("\x01DCC SEND ", "\x01DCC TSEND ")):
+            info = daemon.parse_dcc_send(msg.params[-1])
+            if info:
+                offers.append((msg.nick,) + info)
+    return offers
+
+
+def random_chunks(stream, rng, max_chunk):
+    pos = 0
+    while pos < len(stream):
+        step = rng.randint(1, max_chunk)
+        yield stream[pos:pos + step]
+        pos += step
+
+
+def legacy_lines(chunks):
+    """The pre-IRCLineBuffer framing: decode each recv() and split it on its own."""
+    lines = []
+    for chunk in chunks:
+        for line in chunk.decode(errors="ignore").split("\r\n"):
+            if line.strip():
+                lines.append(line)
+    return lines
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("capture", nargs="?", help="raw IRC capture or dcc_log file")
+    ap.add_argument("--synthetic", type=int, metavar="N", help="generate N lines of traffic instead")
+    ap.add_argument("--rounds", type=int, default=200, help="random splittings to try (default: 200)")
+    ap.add_argument("--max-chunk", type=int, default=4096, help="largest chunk in bytes (default: 4096)")
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.synthetic:
+        raw_lines = synthetic_capture(args.synthetic, rng)
+    elif args.capture:
+        raw_lines = load_capture(args.capture)
+    else:
+        ap.error("give a capture file or --synthetic N")
+
+    stream = b"".join(line + b"\r\n" for line in raw_lines)
+    # Ground truth: the same decoder fed the whole stream at once, so only framing varies
+    expected = offers_from_lines(daemon.IRCLineBuffer().feed(stream))
+    if not expected:
+        sys.exit("No DCC SEND offers found in the capture.")
+    print(f"{len(raw_lines)} lines, {len(stream)} bytes, {len(expected)} offers; {args.rounds} rounds")
+
+    failures = 0
+    legacy_recovered = 0
+    for round_no in range(args.rounds):
+        chunks = list(random_chunks(stream, rng, args.max_chunk))
+        framer = daemon.IRCLineBuffer()
+        lines = [line for chunk in chunks for line in framer.feed(chunk)]
+        got = offers_from_lines(lines)
+        if got != expected:
+            failures += 1
+            missing = len(set(expected) - set(got))
+            print(f"round {round_no}: {len(got)}/{len(expected)} offers, {missing} missing or mangled")
+        legacy_recovered += len(set(offers_from_lines(legacy_lines(chunks))) & set(expected))
+
+    legacy_rate = legacy_recovered / (len(expected) * args.rounds)
+    print(f"IRCLineBuffer: {args.rounds - failures}/{args.rounds} rounds recovered every offer")
+    print(f"old framing:   {legacy_rate:.1%} of offers recovered on average")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
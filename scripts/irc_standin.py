@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+"""
+Scripted local IRC + DCC stand-in for exercising irc_dcc_daemon.py.
+
+Speaks just enough IRC for the daemon to log in and join (001, JOIN echo,
+periodic PING) and plays the part of one or more XDCC bots: every channel
+message of the form "!Bot some file.epub" is answered with a DCC SEND offer
+from "Bot", served from a loopback listener with a random payload.  Bots honour DCC RESUME
+(replying DCC ACCEPT and sending from the requested offset) and can be told
+to cut each file's first connection mid-stream.  The IRC link itself can be
+dropped or frozen (no traffic, PINGs unanswered) to exercise reconnects.
+"@search <terms>" in the channel is answered by "SearchOok" with a zipped
+results list, as real search bots do.
+
+Usage:
+    python3 irc_standin.py --serve                  # stand-in only, on 127.0.0.1:6667
+    python3 irc_standin.py --transfers 60           # run the daemon against it in-process
+    python3 irc_standin.py --transfers 200 --size 4 --max-transfers 50
+    python3 irc_standin.py --resume-test --transfers 10 --size 8 --kill-after 3
+    python3 irc_standin.py --reconnect-test --transfers 10 --size 32
+    python3 irc_standin.py --search-test --results 20000
+    python3 irc_standin.py --scheduler-test --transfers 24 --size 8 --max-transfers 4 --per-bot 2 --bots 3 --rate 40
+
+With --transfers N the daemon's IRC/DCC core is started in this process
+(pointed at the stand-in and a temp download dir), N offers are fired at
+once after it joins, and the run reports completion time, peak concurrent
+DCC connections and any missing or short files.  --resume-test fires the
+offers twice: the first round is killed after --kill-after MB, the second
+must be resumed from the .incomplete files and finish with intact content.
+--reconnect-test drops the IRC link while transfers run, then freezes it
+until the daemon's PING timeout fires; requests issued while it is down
+must be sent after it rejoins, and every transfer must still finish.
+--search-test runs /search with fetch=1 against a cold cache, waits for the
+results archive to be indexed, then times repeat lookups from the cache.
+--scheduler-test requests N bulk files spread over --bots bots, then
+--interactive ones while the bulk queue is full; it checks the overall and
+per-bot connection limits held, that interactive requests waited less, and
+(with --rate) that aggregate throughput stayed under the limit.
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import random
+import re
+import shutil
+import socket
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import zipfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+SEND_CHUNK = 64 * 1024
+
+
+class StandIn:
+    """A single-channel IRC server with scripted XDCC bots."""
+
+    def __init__(self, host, port, channel, size, turbo=False, ping_every=30, results=2000):
+        self.host = host
+        self.port = port
+        self.channel = channel
+        self.size = size
+        self.turbo = turbo
+        self.ping_every = ping_every
+        self.clients = {}          # nick -> StreamWriter
+        self.joined = asyncio.Event()
+        self.active = 0
+        self.peak = 0
+        self.active_by_bot = {}
+        self.peak_by_bot = {}
+        self.served = 0
+        self.bytes_sent = 0
+        self.resumes = 0
+        self.kill_after = None     # cut each file's first connection after this many bytes
+        self.killed = set()
+        self.offers = {}           # DCC port -> offer state, for DCC RESUME
+        self.frozen = set()        # IRC connections we have stopped talking to
+        self.requests_seen = []    # "!Bot file" lines received, in order
+        self.results = results     # lines per @search results list
+        self.searches_seen = []
+        self._payload = os.urandom(SEND_CHUNK)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def send(self, writer, line):
+        writer.write(f"{line}\r\n".encode())
+
+    async def _client(self, reader, writer):
+        nick = None
+        pinger = asyncio.create_task(self._pinger(writer))
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                if writer in self.frozen:
+                    continue
+                line = raw.decode(errors="ignore").rstrip("\r\n")
+                cmd, _, rest = line.partition(" ")
+                if cmd == "NICK":
+                    nick = rest.strip()
+                    self.clients[nick] = writer
+                elif cmd == "USER":
+                    self.send(writer, f":standin 001 {nick} :Welcome to the stand-in {nick}")
+                elif cmd == "JOIN":
+                    self.send(writer, f":{nick}!{nick}@localhost JOIN :{rest.strip()}")
+                    self.joined.set()
+                elif cmd == "PRIVMSG":
+                    target, _, text = rest.partition(" :")
+                    if text.startswith("\x01DCC RESUME "):
+                        self.resume(nick, target, text)
+                    elif text.startswith("@search "):
+                        self.searches_seen.append(text[8:].strip())
+                        await self.search_reply(nick, text[8:].strip())
+                    elif text.startswith("!") and " " in text:
+                        self.requests_seen.append(text)
+                        bot, _, filename = text[1:].partition(" ")
+                        await self.offer(nick, bot, filename.strip())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            pinger.cancel()
+            if self.clients.get(nick) is writer:
+                del self.clients[nick]
+            self.frozen.discard(writer)
+            writer.close()
+
+    async def _pinger(self, writer):
+        while True:
+            await asyncio.sleep(self.ping_every)
+            if writer not in self.frozen:
+                self.send(writer, "PING :standin")
+
+    def drop(self, nick):
+        """Cut `nick`'s IRC connection as a server crash would."""
+        self.joined.clear()
+        self.clients[nick].transport.abort()
+
+    def freeze(self, nick):
+        """Stop reading from or writing to `nick`'s IRC connection, leaving the socket open."""
+        self.joined.clear()
+        self.frozen.add(self.clients[nick])
+
+    async def search_reply(self, nick, terms):
+        """Offer a zipped results list for `terms` the way search bots do."""
+        rng = random.Random(terms)
+        words = ["dune", "messiah", "children", "foundation", "empire", "robots", "dispossessed", "lathe",
+                 "heaven", "left", "hand", "darkness", "hyperion", "excession", "player", "games"]
+        authors = ["Frank Herbert", "Isaac Asimov", "Ursula K. Le Guin", "Dan Simmons", "Iain M. Banks"]
+        lines = [f"Search results for \"{terms}\" from SearchOok", ""]
+        for i in range(self.results):
+            title = " ".join(rng.choice(words).title() for _ in range(rng.randint(1, 4)))
+            if i % 5 == 0:
+                title = f"{terms.title()} {title}"
+            ext = rng.choice(["epub", "epub", "mobi", "pdf", "rar"])
+            lines.append(f"!Bot{i % 9} {rng.choice(authors)} - {title}.{ext}  ::INFO:: {rng.uniform(0.1, 40):.1f}MB")
+        name = f"SearchOok_results_for_ {terms}.txt"
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(name, "\r\n".join(lines))
+        await self.offer(nick, "SearchOok", name + ".zip", buf.getvalue())
+
+    async def offer(self, nick, bot, filename, data=None):
+        """Open a DCC listener for `filename` and send the offer to `nick` as `bot`."""
+        state = {"filename": filename, "position": 0, "data": data, "bot": bot}
+        srv = await asyncio.start_server(lambda r, w: self._dcc_send(r, w, state), "127.0.0.1", 0)
+        port = srv.sockets[0].getsockname()[1]
+        self.offers[port] = state
+        ip_int = struct.unpack("!I", socket.inet_aton("127.0.0.1"))[0]
+        name = f'"{filename}"' if " " in filename else filename
+        verb = "TSEND" if self.turbo else "SEND"
+        size = len(data) if data is not None else self.size
+        self.send(self.clients[nick],
+                  f":{bot}!{bot}@bots.standin PRIVMSG {nick} :\x01DCC {verb} {name} {ip_int} {port} {size}\x01")
+        asyncio.get_running_loop().call_later(120, srv.close)
+        asyncio.get_running_loop().call_later(120, self.offers.pop, port, None)
+
+    def resume(self, nick, bot, text):
+        """Answer DCC RESUME for one of our offers with DCC ACCEPT at the same position."""
+        match = re.search(r'DCC RESUME\s+(?:"(.+?)"|(\S+))\s+(\d+)\s+(\d+)', text)
+        state = match and self.offers.get(int(match.group(3)))
+        if not state:
+            return
+        state["position"] = min(int(match.group(4)), self.size)
+        self.resumes += 1
+        name = f'"{state["filename"]}"' if " " in state["filename"] else state["filename"]
+        self.send(self.clients[nick], f":{bot}!{bot}@bots.standin PRIVMSG {nick} "
+                                      f":\x01DCC ACCEPT {name} {match.group(3)} {state['position']}\x01")
+
+    def expected_bytes(self, start, length):
+        """The payload bytes a bot sends for [start, start + length) of any file."""
+        out = bytearray()
+        while len(out) < length:
+            o = (start + len(out)) % SEND_CHUNK
+            out += self._payload[o:o + length - len(out)]
+        return bytes(out)
+
+    def _count(self, bot, step):
+        self.active += step
+        self.peak = max(self.peak, self.active)
+        self.active_by_bot[bot] = self.active_by_bot.get(bot, 0) + step
+        self.peak_by_bot[bot] = max(self.peak_by_bot.get(bot, 0), self.active_by_bot[bot])
+
+    async def _dcc_send(self, reader, writer, state):
+        self._count(state["bot"], 1)
+        drain_acks = asyncio.create_task(self._drain(reader))
+        if state["data"] is not None:
+            try:
+                writer.write(state["data"][state["position"]:])
+                await writer.drain()
+                await asyncio.wait_for(drain_acks, 30)
+            except (ConnectionError, asyncio.TimeoutError):
+                pass
+            finally:
+                self._count(state["bot"], -1)
+                writer.close()
+            return
+        view = memoryview(self._payload)
+        sent = state["position"]
+        limit = self.size
+        kill = self.kill_after is not None and state["filename"] not in self.killed
+        if kill:
+            limit = min(self.size, sent + self.kill_after)
+        try:
+            while sent < limit:
+                o = sent % SEND_CHUNK
+                n = min(SEND_CHUNK - o, limit - sent)
+                writer.write(view[o:o + n])
+                await writer.drain()
+                sent += n
+                self.bytes_sent += n
+            if kill:
+                self.killed.add(state["filename"])
+                drain_acks.cancel()
+                writer.transport.abort()
+                return
+            self.served += 1
+            await asyncio.wait_for(drain_acks, 30)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            self._count(state["bot"], -1)
+            writer.close()
+
+    async def _drain(self, reader):
+        while await reader.read(65536):
+            pass
+
+    async def burst(self, nick, count, bot="StandInBot"):
+        await asyncio.gather(*(self.offer(nick, bot, f"standin book {i:04d}.epub") for i in range(count)))
+
+
+async def start_daemon(args):
+    """Start a stand-in and the daemon's IRC core against it; return (daemon, standin, irc task, out dir)."""
+    import irc_dcc_daemon as daemon
+
+    standin = await StandIn(args.host, 0, daemon.CONFIG["CHANNEL"], args.size * 1024 * 1024, args.turbo,
+                            results=args.results).start()
+    out_dir = tempfile.mkdtemp(prefix="standin_")
+    daemon.CONFIG.update({
+        "IRC_SERVER": args.host,
+        "IRC_PORT": standin.port,
+        "DOWNLOAD_DIR": out_dir,
+        "SIMILAR_DOWNLOAD_DIR": out_dir,
+        "LOG_FILE": os.path.join(out_dir, "dcc_log"),
+        "MAX_TRANSFERS": args.max_transfers,
+        "MAX_TRANSFERS_PER_BOT": args.per_bot or args.max_transfers,
+        "DCC_RATE_LIMIT": args.rate * 1024 * 1024 if args.rate else None,
+        "IRC_RECONNECT_MIN": 0.5,
+        "SEARCH_DB": os.path.join(out_dir, "search_cache.db"),
+    })
+    daemon.LOOP = asyncio.get_running_loop()
+    irc = asyncio.create_task(daemon.irc_main())
+
+    await asyncio.wait_for(standin.joined.wait(), 10)
+    while not daemon.irc_connected:
+        await asyncio.sleep(0.05)
+    return daemon, standin, irc, out_dir
+
+
+async def stop_daemon(args, standin, irc, out_dir):
+    irc.cancel()
+    await asyncio.gather(irc, return_exceptions=True)
+    standin.server.close()
+    await asyncio.sleep(0.1)   # let the stand-in see the daemon hang up
+    if not args.keep:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    else:
+        print(f"files kept in {out_dir}")
+
+
+async def run_against_daemon(args):
+    daemon, standin, irc, out_dir = await start_daemon(args)
+
+    t0 = time.perf_counter()
+    await standin.burst(daemon.CONFIG["NICKNAME"], args.transfers)
+    expected = {f"standin book {i:04d}.epub" for i in range(args.transfers)}
+    deadline = t0 + args.timeout
+    while time.perf_counter() < deadline:
+        done = expected & set(os.listdir(out_dir))
+        if len(done) == len(expected) and not daemon._tasks:
+            break
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - t0
+
+    done = expected & set(os.listdir(out_dir))
+    short = [n for n in done if os.path.getsize(os.path.join(out_dir, n)) != standin.size]
+    total_mb = len(done) * args.size
+    print(f"transfers   {len(done)}/{args.transfers} complete, {len(short)} short")
+    print(f"elapsed     {elapsed:.2f} s ({total_mb / elapsed:.1f} MB/s aggregate)")
+    print(f"peak conns  {standin.peak} (limit {args.max_transfers})")
+
+    await stop_daemon(args, standin, irc, out_dir)
+    return len(done) == args.transfers and not short
+
+
+def intact(standin, path):
+    """True if the file at `path` is exactly the payload a bot would have sent."""
+    with open(path, "rb") as f:
+        pos = 0
+        while True:
+            chunk = f.read(SEND_CHUNK)
+            if not chunk:
+                return pos == standin.size
+            if chunk != standin.expected_bytes(pos, len(chunk)):
+                return False
+            pos += len(chunk)
+
+
+async def run_resume_test(args):
+    """Kill every transfer part-way, re-offer the same files and check they resume and arrive intact."""
+    daemon, standin, irc, out_dir = await start_daemon(args)
+    nick = daemon.CONFIG["NICKNAME"]
+    names = {f"standin book {i:04d}.epub" for i in range(args.transfers)}
+    deadline = time.perf_counter() + args.timeout
+
+    standin.kill_after = args.kill_after * 1024 * 1024
+    await standin.burst(nick, args.transfers)
+    await asyncio.sleep(0.5)
+    while daemon._tasks and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    partial = {n for n in names if os.path.exists(os.path.join(out_dir, n + ".incomplete"))}
+    print(f"round 1     {len(partial)}/{args.transfers} cut off after {args.kill_after} MB")
+
+    sent_before = standin.bytes_sent
+    await standin.burst(nick, args.transfers)
+    await asyncio.sleep(0.5)
+    while daemon._tasks and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    resent = standin.bytes_sent - sent_before
+
+    done = names & set(os.listdir(out_dir))
+    good = [n for n in done if intact(standin, os.path.join(out_dir, n))]
+    full = args.transfers * standin.size
+    print(f"round 2     {standin.resumes} resumed, {len(done)}/{args.transfers} complete, {len(good)} intact")
+    print(f"bytes sent  {resent / 1048576:.1f} MB of {full / 1048576:.1f} MB ({1 - resent / full:.0%} saved)")
+
+    await stop_daemon(args, standin, irc, out_dir)
+    return len(good) == args.transfers and standin.resumes == len(partial) == args.transfers
+
+
+async def run_reconnect_test(args):
+    """Drop, then freeze, the IRC link mid-transfer and check held requests and transfers all finish."""
+    import irc_dcc_daemon as daemon
+
+    daemon.CONFIG.update({"IRC_PING_INTERVAL": 1, "IRC_PING_TIMEOUT": 1})
+    daemon, standin, irc, out_dir = await start_daemon(args)
+    nick = daemon.CONFIG["NICKNAME"]
+    names = {f"standin book {i:04d}.epub" for i in range(args.transfers)}
+    deadline = time.perf_counter() + args.timeout
+    ok = True
+
+    await standin.burst(nick, args.transfers)
+    await asyncio.sleep(0.2)
+    for label, cut in (("drop", standin.drop), ("freeze", standin.freeze)):
+        cut(nick)
+        while daemon.irc_connected:
+            await asyncio.sleep(0.05)
+        held = [daemon.add_request(f"!StandInBot held {label} {i}.epub") for i in range(3)]
+        for req in held:
+            daemon.queue_request_cmd(req)
+        names |= {f"held {label} {i}.epub" for i in range(3)}
+        t0 = time.perf_counter()
+        while not daemon.irc_connected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        print(f"{label:<8}    rejoined after {time.perf_counter() - t0:.2f} s "
+              f"(daemon reports {daemon._metrics['irc_ready_seconds']} s since the link went down)")
+        await asyncio.sleep(0.5)
+        sent = sum(1 for text in standin.requests_seen if f"held {label} " in text)
+        print(f"{label:<8}    {sent}/3 held requests sent after rejoining")
+        ok &= sent == 3
+
+    while time.perf_counter() < deadline:
+        if names <= set(os.listdir(out_dir)) and not daemon._tasks:
+            break
+        await asyncio.sleep(0.1)
+    done = names & set(os.listdir(out_dir))
+    short = [n for n in done if os.path.getsize(os.path.join(out_dir, n)) != standin.size]
+    print(f"transfers   {len(done)}/{len(names)} complete, {len(short)} short, "
+          f"{daemon._metrics['irc_resent']} resent, {daemon._metrics['irc_connects']} connects")
+
+    await stop_daemon(args, standin, irc, out_dir)
+    return ok and len(done) == len(names) and not short
+
+
+async def run_search_test(args):
+    """Cold /search?fetch=1, wait for the results archive to be indexed, then time cached lookups."""
+    daemon, standin, irc, out_dir = await start_daemon(args)
+    client = daemon.app.test_client()
+    terms = "dune"
+    deadline = time.perf_counter() + args.timeout
+
+    t0 = time.perf_counter()
+    first = client.get(f"/search?q={terms}&fetch=1")
+    print(f"cold        HTTP {first.status_code}, searching={first.json['searching']}, "
+          f"{first.json['count']} cached results")
+    body = first.json
+    while not body["cached"] and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+        body = client.get(f"/search?q={terms}").json
+    round_trip = time.perf_counter() - t0
+    print(f"indexed     {body['batch'] and body['batch']['results']} results for \"{terms}\" "
+          f"{round_trip * 1000:.0f} ms after the first call (the channel adds its own delay in real use)")
+
+    timings = []
+    for _ in range(args.rounds):
+        t = time.perf_counter()
+        resp = client.get(f"/search?q={terms} messiah&limit=50")
+        timings.append((time.perf_counter() - t) * 1000)
+    print(f"cached      {resp.json['count']} hits for \"{terms} messiah\", "
+          f"median {statistics.median(timings):.2f} ms, max {max(timings):.2f} ms over {args.rounds} lookups")
+    again = client.get(f"/search?q={terms}&fetch=1")
+    print(f"repeat      HTTP {again.status_code}, @search sent {len(standin.searches_seen)} time(s)")
+
+    await stop_daemon(args, standin, irc, out_dir)
+    return body["cached"] and again.status_code == 200 and len(standin.searches_seen) == 1
+
+
+async def run_scheduler_test(args):
+    """Bulk requests over several bots, then interactive ones behind them; check limits, priority and rate."""
+    daemon, standin, irc, out_dir = await start_daemon(args)
+    client = daemon.app.test_client()
+    bots = [f"Bot{i}" for i in range(args.bots)]
+
+    def request(i, priority):
+        cmd = f"!{bots[i % len(bots)]} standin {priority} {i:04d}.epub"
+        return client.get("/request-file", query_string={"cmd": cmd, "priority": priority}).json["request_id"]
+
+    t0 = time.perf_counter()
+    ids = {"bulk": [request(i, "bulk") for i in range(args.transfers)]}
+    await asyncio.sleep(0.5)   # let the bulk offers fill every slot and queue up
+    queued = client.get("/status").json["metrics"]["scheduler"]["queues"]
+    ids["interactive"] = [request(i, "interactive") for i in range(args.interactive)]
+    all_ids = ids["bulk"] + ids["interactive"]
+    deadline = t0 + args.timeout
+    while time.perf_counter() < deadline:
+        states = [daemon._requests[rid]["state"] for rid in all_ids]
+        if all(state in ("done", "failed") for state in states) and not daemon._tasks:
+            break
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - t0
+
+    reqs = {p: [daemon.request_snapshot(daemon._requests[rid]) for rid in rids] for p, rids in ids.items()}
+    done = sum(r["state"] == "done" for rs in reqs.values() for r in rs)
+    total_mb = done * args.size
+    # The limiter lets one DCC_RATE_BURST of data through before pacing starts
+    paced_mb = total_mb - (args.rate or 0) * daemon.CONFIG["DCC_RATE_BURST"]
+    per_bot = args.per_bot or args.max_transfers
+    print(f"transfers   {done}/{len(all_ids)} complete in {elapsed:.2f} s ({total_mb / elapsed:.1f} MB/s aggregate"
+          + (f", {paced_mb / elapsed:.1f} MB/s after the burst, limit {args.rate} MB/s)" if args.rate else ")"))
+    backlog = queued["bulk"]["queued"]
+    print(f"queued      {backlog} bulk waiting when the interactive requests arrived"
+          + ("" if backlog else " (nothing to overtake; try --rate or bigger --size)"))
+    print(f"peak conns  {standin.peak} (limit {args.max_transfers}); per bot "
+          f"{max(standin.peak_by_bot.values(), default=0)} (limit {per_bot})")
+    mean_wait = {}
+    for priority, rs in reqs.items():
+        waits = [r["waited"] for r in rs if r["waited"] is not None]
+        mean_wait[priority] = statistics.mean(waits) if waits else 0.0
+        print(f"{priority:<11} waited mean {mean_wait[priority]:.2f} s, max {max(waits, default=0):.2f} s "
+              f"for a slot ({len(rs)} requests)")
+    sched = client.get("/status").json["metrics"]["scheduler"]
+    print(f"scheduler   granted {sched['queues']['interactive']['granted']} interactive, "
+          f"{sched['queues']['bulk']['granted']} bulk; throttled {sched['throttled_seconds']:.1f} s")
+
+    await stop_daemon(args, standin, irc, out_dir)
+    return (done == len(all_ids)
+            and standin.peak <= args.max_transfers
+            and max(standin.peak_by_bot.values(), default=0) <= per_bot
+            and (not args.interactive or not backlog or mean_wait["interactive"] < mean_wait["bulk"])
+            and (not args.rate or paced_mb / elapsed <= args.rate * 1.05))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=6667, help="IRC port for --serve (default: 6667)")
+    ap.add_argument("--serve", action="store_true", help="only run the stand-in server")
+    ap.add_argument("--transfers", type=int, default=60, help="offers to fire at the daemon (default: 60)")
+    ap.add_argument("--size", type=int, default=2, help="payload size per file in MB (default: 2)")
+    ap.add_argument("--max-transfers", type=int, default=50, help="daemon MAX_TRANSFERS for the run (default: 50)")
+    ap.add_argument("--turbo", action="store_true", help="offer DCC TSEND instead of DCC SEND")
+    ap.add_argument("--timeout", type=int, default=300, help="seconds to wait for all transfers (default: 300)")
+    ap.add_argument("--keep", action="store_true", help="keep the downloaded files")
+    ap.add_argument("--resume-test", action="store_true",
+                    help="cut every first transfer short and check the re-offers resume")
+    ap.add_argument("--kill-after", type=int, default=1, help="MB sent before a cut (default: 1)")
+    ap.add_argument("--reconnect-test", action="store_true",
+                    help="drop and freeze the IRC link mid-run and check the daemon recovers")
+    ap.add_argument("--search-test", action="store_true", help="check /search fills from @search and then hits the cache")
+    ap.add_argument("--results", type=int, default=2000, help="lines per @search results list (default: 2000)")
+    ap.add_argument("--rounds", type=int, default=200, help="cached lookups to time in --search-test (default: 200)")
+    ap.add_argument("--scheduler-test", action="store_true",
+                    help="check transfer limits and that interactive requests overtake queued bulk ones")
+    ap.add_argument("--per-bot", type=int, help="daemon MAX_TRANSFERS_PER_BOT (default: --max-transfers)")
+    ap.add_argument("--bots", type=int, default=3, help="bots to spread --scheduler-test requests over (default: 3)")
+    ap.add_argument("--interactive", type=int, default=4, help="interactive requests in --scheduler-test (default: 4)")
+    ap.add_argument("--rate", type=float, help="daemon DCC_RATE_LIMIT in MB/s")
+    args = ap.parse_args()
+
+    if args.serve:
+        async def serve():
+            standin = await StandIn(args.host, args.port, "#ebooks", args.size * 1024 * 1024, args.turbo).start()
+            print(f"Stand-in IRC server on {args.host}:{standin.port}")
+            await standin.server.serve_forever()
+        asyncio.run(serve())
+        return
+
+    if args.resume_test:
+        run = run_resume_test
+    elif args.reconnect_test:
+        run = run_reconnect_test
+    elif args.search_test:
+        run = run_search_test
+    elif args.scheduler_test:
+        run = run_scheduler_test
+    else:
+        run = run_against_daemon
+    ok = asyncio.run(run(args))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
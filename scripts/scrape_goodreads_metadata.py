@@ -16,6 +16,7 @@ Usage:
     python3 scrape_goodreads_metadata.py              # all users in users.json
     python3 scrape_goodreads_metadata.py david        # one user
     python3 scrape_goodreads_metadata.py /path/to/metadata.db
+    python3 scrape_goodreads_metadata.py --offline [user]  # replay cached pages only
 """
 
 import json
@@ -31,6 +32,9 @@ from datetime import datetime, timezone
 import requests
 from bs4 import BeautifulSoup
 
+from db_writer import DBWriter
+from http_cache import HTTPCache
+
 # ── Config ────────────────────────────────────────────────────────────────────
 
 # Errors that mean the GR ID is wrong or the page will never exist — don't retry these.
@@ -57,6 +61,11 @@ HEADERS = {
     "Accept-Language": "en-US,en;q=0.5",
 }
 
+# Pages already fetched are replayed from data/http_cache.db (see http_cache.py)
+HTTP = HTTPCache()
+# One keep-alive session for the run, so a page doesn't cost a new TLS handshake
+SESSION = requests.Session()
+
 # ── SQLite helpers ────────────────────────────────────────────────────────────
 
 def _title_sort_fn(title):
@@ -75,6 +84,110 @@ def open_db(db_path):
 
 # ── Goodreads fetch + parse ───────────────────────────────────────────────────
 
+NEXT_DATA_OPEN  = b'<script id="__NEXT_DATA__" type="application/json">'
+NEXT_DATA_CLOSE = b"</script>"
+
+
+class ApolloState:
+    """
+    Read-only mapping over the apolloState in a page's __NEXT_DATA__ JSON,
+    decoding one node at a time.
+
+    A book page's state holds every review, user and contributor shown on
+    the page, often several MB, and we use a handful of nodes.  A node is
+    found by searching for its key and decoded on its own with raw_decode,
+    so the rest never becomes Python objects.  A key that can't be found
+    that way (absent, or serialised differently) falls back to parsing the
+    whole block once.
+
+    The search takes the first `"key":` after "apolloState" that follows
+    a { or , and trusts it to be a top-level node.  Node keys are ids
+    ("ROOT_QUERY", "Book:kca://...", "User:...") that the nodes' own
+    fields don't use, but nothing checks the nesting: tracking it costs
+    about as much as the full parse.  mismatches() compares the nodes
+    looked up against json.loads; gr_corpus.py check and
+    bench_gr_book_parse.py run it over real pages.
+    """
+
+    KEY = '"apolloState":'
+    _decoder = json.JSONDecoder()
+    _space = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, text):
+        self.text = text
+        self.start = text.find(self.KEY)
+        self.nodes = {}         # key → (found, value)
+        self.full = None
+
+    def _parse_all(self):
+        if self.full is None:
+            nd = json.loads(self.text)
+            self.full = nd.get("props", {}).get("pageProps", {}).get("apolloState", {}) or {}
+        return self.full
+
+    def _find(self, key):
+        if self.full is None and self.start >= 0:
+            needle = json.dumps(key, ensure_ascii=False) + ":"
+            i = self.text.find(needle, self.start)
+            j = i - 1
+            while j > 0 and self.text[j] in " \t\n\r":
+                j -= 1
+            if i > 0 and self.text[j] in "{,":
+                try:
+                    at = self._space.match(self.text, i + len(needle)).end()
+                    return True, self._decoder.raw_decode(self.text, at)[0]
+                except ValueError:
+                    pass
+        state = self._parse_all()
+        return key in state, state.get(key)
+
+    def mismatches(self):
+        """The keys looked up so far whose answer differs from a full parse of the block."""
+        full = self._parse_all()
+        return [key for key, (found, value) in self.nodes.items()
+                if found != (key in full) or (found and value != full[key])]
+
+    def _lookup(self, key):
+        if key not in self.nodes:
+            self.nodes[key] = self._find(key)
+        return self.nodes[key]
+
+    def get(self, key, default=None):
+        found, value = self._lookup(key)
+        return value if found else default
+
+    def __contains__(self, key):
+        return self._lookup(key)[0]
+
+    def __getitem__(self, key):
+        found, value = self._lookup(key)
+        if not found:
+            raise KeyError(key)
+        return value
+
+    def __bool__(self):
+        if self.full is None and self.start >= 0:
+            at = self._space.match(self.text, self.start + len(self.KEY)).end()
+            if self.text.startswith("{", at):
+                return not self.text.startswith("}", self._space.match(self.text, at + 1).end())
+        return bool(self._parse_all())
+
+
+def next_data(content):
+    """
+    The __NEXT_DATA__ JSON of a page (the raw response body), located by
+    byte offset so the rest of the page is never decoded; None if absent.
+    """
+    start = content.find(NEXT_DATA_OPEN)
+    if start < 0:
+        return None
+    start += len(NEXT_DATA_OPEN)
+    end = content.find(NEXT_DATA_CLOSE, start)
+    if end < 0:
+        return None
+    return content[start:end].decode("utf-8", "replace")
+
+
 def fetch_book_page(gr_id, _redirected=False):
     """
     Fetch a Goodreads book page and return the parsed data dict, or None on failure.
@@ -85,7 +198,7 @@ def fetch_book_page(gr_id, _redirected=False):
     """
     url = f"https://www.goodreads.com/book/show/{gr_id}"
     try:
-        r = requests.get(url, headers=HEADERS, timeout=20)
+        r = HTTP.get(url, headers=HEADERS, timeout=20, session=SESSION)
     except Exception as e:
         return None, str(e)
 
@@ -94,16 +207,59 @@ def fetch_book_page(gr_id, _redirected=False):
     if r.status_code != 200:
         return None, f"HTTP {r.status_code}"
 
-    m = re.search(r'<script id="__NEXT_DATA__" type="application/json">(.*?)</script>',
-                  r.text, re.DOTALL)
-    if not m:
-        return None, "__NEXT_DATA__ not found"
+    data, err = parse_book_page(r.content, gr_id)
+    if err:
+        return None, err
 
-    nd = json.loads(m.group(1))
-    apollo = nd.get("props", {}).get("pageProps", {}).get("apolloState", {})
+    # ── Re-fetch English edition if this page is non-English ─────────────────
+    if not data["is_english"] and not _redirected:
+        en_link = re.search(r'<link[^>]+hrefLang="en"[^>]+href="([^"]+)"', r.text)
+        if not en_link:
+            en_link = re.search(r'<link[^>]+href="([^"]+)"[^>]+hrefLang="en"', r.text)
+        if en_link:
+            en_url = en_link.group(1)
+            try:
+                r2 = HTTP.get(en_url, headers=HEADERS, timeout=20, session=SESSION)
+                if r2.status_code == 200:
+                    fetched_gr_id = str(gr_id)
+                    id_m = re.search(r'/book/show/(\d+)', r2.url)
+                    if id_m:
+                        fetched_gr_id = id_m.group(1)
+                    print(f"[redirected to EN, id={fetched_gr_id}] ", end="", flush=True)
+                    return fetch_book_page(fetched_gr_id, _redirected=True)
+            except Exception:
+                pass  # fall through and use original page
+
+    return data, None
+
+
+def parse_book_page(content, gr_id):
+    """Parse a book page's raw body (bytes) into fetch_book_page's data dict. Returns (data_dict, error_string)."""
+    text = next_data(content)
+    if text is None:
+        return None, "__NEXT_DATA__ not found"
+    apollo = ApolloState(text)
     if not apollo:
         return None, "apolloState missing"
+    return parse_apollo(apollo, gr_id)
+
+
+def apollo_mismatches(content, gr_id):
+    """Parse a book page as parse_book_page does; the Apollo keys ApolloState got wrong (see mismatches())."""
+    text = next_data(content)
+    if text is None:
+        return []
+    apollo = ApolloState(text)
+    if apollo:
+        parse_apollo(apollo, gr_id)
+    return apollo.mismatches()
+
 
+def parse_apollo(apollo, gr_id):
+    """
+    Pull the fields we save out of an apolloState: an ApolloState, or the
+    plain dict json.loads gives.  Returns (data_dict, error_string).
+    """
     # Find the Book node for this exact legacy ID via ROOT_QUERY
     book_ref = None
     for key, val in apollo.get("ROOT_QUERY", {}).items():
@@ -172,24 +328,7 @@ def fetch_book_page(gr_id, _redirected=False):
     language  = (lang_obj.get("name") or "").strip() if isinstance(lang_obj, dict) else str(lang_obj).strip()
     is_english = not language or language.lower().startswith("eng") or language.lower() == "english"
 
-    # ── Re-fetch English edition if this page is non-English ─────────────────
     fetched_gr_id = str(gr_id)
-    if not is_english and not _redirected:
-        en_link = re.search(r'<link[^>]+hrefLang="en"[^>]+href="([^"]+)"', r.text)
-        if not en_link:
-            en_link = re.search(r'<link[^>]+href="([^"]+)"[^>]+hrefLang="en"', r.text)
-        if en_link:
-            en_url = en_link.group(1)
-            try:
-                r2 = requests.get(en_url, headers=HEADERS, timeout=20)
-                if r2.status_code == 200:
-                    id_m = re.search(r'/book/show/(\d+)', r2.url)
-                    if id_m:
-                        fetched_gr_id = id_m.group(1)
-                    print(f"[redirected to EN, id={fetched_gr_id}] ", end="", flush=True)
-                    return fetch_book_page(fetched_gr_id, _redirected=True)
-            except Exception:
-                pass  # fall through and use original page
 
     # ── Links: Kindle ASIN + Amazon physical ASIN ────────────────────────────
     def _extract_asin(url):
@@ -333,7 +472,7 @@ def ms_to_calibre_date(ms):
     except (ValueError, OSError, OverflowError):
         return None
 
-def _wipe_and_reset(db_path, book_id, rejected_gr_id=None):
+def _wipe_and_reset(con, book_id, rejected_gr_id=None):
     """
     Wipe all identifiers for a book and remove it from both progress caches so
     find_goodreads_ids.py and scrape_goodreads_metadata.py re-process it fresh.
@@ -343,18 +482,13 @@ def _wipe_and_reset(db_path, book_id, rejected_gr_id=None):
     so find_goodreads_ids.py will never select that GR ID for this book again.
     Existing gr_rejected entries are preserved across wipes (they accumulate).
     """
-    con = open_db(db_path)
-    try:
-        # Preserve any previously-rejected IDs, wipe everything else
-        con.execute("DELETE FROM identifiers WHERE book = ? AND type != 'gr_rejected'", (book_id,))
-        if rejected_gr_id:
-            con.execute(
-                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_rejected', ?)",
-                (book_id, str(rejected_gr_id)),
-            )
-        con.commit()
-    finally:
-        con.close()
+    # Preserve any previously-rejected IDs, wipe everything else
+    con.execute("DELETE FROM identifiers WHERE book = ? AND type != 'gr_rejected'", (book_id,))
+    if rejected_gr_id:
+        con.execute(
+            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_rejected', ?)",
+            (book_id, str(rejected_gr_id)),
+        )
 
     for progress_path in (PROGRESS_FILE,
                            os.path.join(DATA_DIR, "goodreads_progress.json")):
@@ -372,206 +506,171 @@ def _wipe_and_reset(db_path, book_id, rejected_gr_id=None):
                 pass
 
 
-def save_metadata(db_path, book_id, data, original_gr_id=None):
-    """Write all scraped fields to the DB. Returns list of what was saved."""
+def save_metadata(con, names, book_id, data, original_gr_id=None):
+    """
+    Write all scraped fields through `con` and `names` (a DBWriter's
+    connection and name lookups). Returns list of what was saved.
+    """
     saved = []
     if data.get("is_audiobook"):
         fmt = data.get("book_format", "unknown")
         print(f"[audiobook={fmt}] ", end="")
-        _wipe_and_reset(db_path, book_id, rejected_gr_id=original_gr_id)
+        _wipe_and_reset(con, book_id, rejected_gr_id=original_gr_id)
         return [f"SKIPPED(audiobook={fmt}) — all identifiers wiped, will re-scrape", "RESET"]
     if not data.get("is_english", True):
         lang = data.get("language", "unknown")
         # Clear text fields — don't overwrite English content with foreign-language data
         data = {**data, "description": "", "genres": [], "reviews": []}
         saved.append(f"SKIPPED_TEXT(lang={lang})")
-    con = open_db(db_path)
-    try:
-        # ── Update GR ID if re-fetch resolved a different one ─────────────────
-        fetched_id = data.get("fetched_gr_id")
-        if fetched_id and original_gr_id and fetched_id != str(original_gr_id):
-            con.execute(
-                "UPDATE identifiers SET val = ? WHERE book = ? AND type = 'goodreads'",
-                (fetched_id, book_id),
-            )
-            saved.append(f"gr_id_updated({original_gr_id}→{fetched_id})")
-
-        # ── Description ──────────────────────────────────────────────────────
-        if data["description"]:
-            con.execute(
-                "INSERT OR REPLACE INTO comments (book, text) VALUES (?, ?)",
-                (book_id, data["description"]),
-            )
-            saved.append("description")
-
-        # ── Series (only if book has none) ───────────────────────────────────
-        if data["series_name"]:
-            existing = con.execute(
-                "SELECT id FROM books_series_link WHERE book = ?", (book_id,)
-            ).fetchone()
-            if not existing:
-                con.execute(
-                    "INSERT OR IGNORE INTO series (name, sort, link) VALUES (?, ?, '')",
-                    (data["series_name"], _title_sort_fn(data["series_name"])),
-                )
-                sid = con.execute(
-                    "SELECT id FROM series WHERE name = ? COLLATE NOCASE",
-                    (data["series_name"],),
-                ).fetchone()[0]
-                con.execute(
-                    "INSERT OR IGNORE INTO books_series_link (book, series) VALUES (?, ?)",
-                    (book_id, sid),
-                )
-                con.execute(
-                    "UPDATE books SET series_index = ? WHERE id = ?",
-                    (data["series_index"], book_id),
-                )
-                saved.append(f"series({data['series_name']} #{data['series_index']:g})")
-
-        if data.get("series_gr_id"):
+    # ── Update GR ID if re-fetch resolved a different one ─────────────────
+    fetched_id = data.get("fetched_gr_id")
+    if fetched_id and original_gr_id and fetched_id != str(original_gr_id):
+        con.execute(
+            "UPDATE identifiers SET val = ? WHERE book = ? AND type = 'goodreads'",
+            (fetched_id, book_id),
+        )
+        saved.append(f"gr_id_updated({original_gr_id}→{fetched_id})")
+
+    # ── Description ──────────────────────────────────────────────────────
+    if data["description"]:
+        con.execute(
+            "INSERT OR REPLACE INTO comments (book, text) VALUES (?, ?)",
+            (book_id, data["description"]),
+        )
+        saved.append("description")
+
+    # ── Series (only if book has none) ───────────────────────────────────
+    if data["series_name"]:
+        if not names.series.linked(book_id):
+            names.series.link(book_id, [names.series.id(data["series_name"])])
             con.execute(
-                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_series_id', ?)",
-                (book_id, data["series_gr_id"]),
+                "UPDATE books SET series_index = ? WHERE id = ?",
+                (data["series_index"], book_id),
             )
-            saved.append(f"gr_series_id({data['series_gr_id']})")
-
-        # ── Genres → tags (additive) ──────────────────────────────────────────
-        added_genres = []
-        for genre in data["genres"]:
-            con.execute("INSERT OR IGNORE INTO tags (name, link) VALUES (?, '')", (genre,))
-            tag_id = con.execute(
-                "SELECT id FROM tags WHERE name = ? COLLATE NOCASE", (genre,)
-            ).fetchone()[0]
-            result = con.execute(
-                "INSERT OR IGNORE INTO books_tags_link (book, tag) VALUES (?, ?)",
-                (book_id, tag_id),
-            )
-            if result.rowcount:
-                added_genres.append(genre)
-        if added_genres:
-            saved.append(f"genres({', '.join(added_genres[:3])}{'…' if len(added_genres) > 3 else ''})")
-
-        # ── Identifiers: ISBN, ISBN13 (don't overwrite existing user data) ─────
-        for id_type, val in [("isbn", data["isbn"]), ("isbn13", data["isbn13"])]:
-            if not val:
-                continue
-            existing = con.execute(
-                "SELECT val FROM identifiers WHERE book = ? AND type = ?", (book_id, id_type)
-            ).fetchone()
-            if not existing:
-                con.execute(
-                    "INSERT INTO identifiers (book, type, val) VALUES (?, ?, ?)",
-                    (book_id, id_type, val),
-                )
-                saved.append(id_type)
-
-        # ── Identifiers: ASIN + Kindle ASIN (always overwrite — GR is authoritative) ──
-        for id_type, val in [("asin", data["asin"]), ("kindle_asin", data.get("kindle_asin", ""))]:
-            if not val:
-                continue
+            saved.append(f"series({data['series_name']} #{data['series_index']:g})")
+
+    if data.get("series_gr_id"):
+        con.execute(
+            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_series_id', ?)",
+            (book_id, data["series_gr_id"]),
+        )
+        saved.append(f"gr_series_id({data['series_gr_id']})")
+
+    # ── Genres → tags (additive) ──────────────────────────────────────────
+    tag_ids = names.tags.ids(data["genres"])
+    added = set(names.tags.link(book_id, tag_ids.values()))
+    added_genres = [genre for genre, tag_id in tag_ids.items() if tag_id in added]
+    if added_genres:
+        saved.append(f"genres({', '.join(added_genres[:3])}{'…' if len(added_genres) > 3 else ''})")
+
+    # ── Identifiers: ISBN, ISBN13 (don't overwrite existing user data) ─────
+    for id_type, val in [("isbn", data["isbn"]), ("isbn13", data["isbn13"])]:
+        if not val:
+            continue
+        existing = con.execute(
+            "SELECT val FROM identifiers WHERE book = ? AND type = ?", (book_id, id_type)
+        ).fetchone()
+        if not existing:
             con.execute(
-                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, ?, ?)",
+                "INSERT INTO identifiers (book, type, val) VALUES (?, ?, ?)",
                 (book_id, id_type, val),
             )
             saved.append(id_type)
 
-        # ── Publisher (replace) ───────────────────────────────────────────────
-        if data["publisher"]:
-            con.execute("INSERT OR IGNORE INTO publishers (name, sort, link) VALUES (?, ?, '')",
-                        (data["publisher"], _title_sort_fn(data["publisher"])))
-            pub_id = con.execute(
-                "SELECT id FROM publishers WHERE name = ? COLLATE NOCASE", (data["publisher"],)
-            ).fetchone()[0]
-            con.execute("DELETE FROM books_publishers_link WHERE book = ?", (book_id,))
-            con.execute(
-                "INSERT INTO books_publishers_link (book, publisher) VALUES (?, ?)",
-                (book_id, pub_id),
-            )
-            saved.append(f"publisher({data['publisher']})")
-
-        # ── Publication date (replace) ────────────────────────────────────────
-        if data["pub_ms"]:
-            calibre_date = ms_to_calibre_date(data["pub_ms"])
-            if calibre_date:
-                con.execute("UPDATE books SET pubdate = ? WHERE id = ?", (calibre_date, book_id))
-                saved.append(f"pubdate({calibre_date[:10]})")
-
-        # ── Page count ───────────────────────────────────────────────────────
-        if data["num_pages"]:
-            con.execute(
-                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_pages', ?)",
-                (book_id, str(data["num_pages"])),
-            )
-            saved.append(f"pages({data['num_pages']})")
-
-        # ── Work ID ───────────────────────────────────────────────────────────
-        if data.get("gr_work_id"):
-            con.execute(
-                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_work_id', ?)",
-                (book_id, data["gr_work_id"]),
-            )
-            saved.append(f"gr_work_id({data['gr_work_id']})")
-
-        # ── Rating + count (replace) ──────────────────────────────────────────
-        if data["avg_rating"]:
-            con.execute(
-                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_rating', ?)",
-                (book_id, data["avg_rating"]),
-            )
-            saved.append(f"rating({data['avg_rating']})")
-        if data["rating_count"]:
-            con.execute(
-                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_rating_count', ?)",
-                (book_id, data["rating_count"]),
-            )
-        if data.get("ratings_dist"):
-            con.execute(
-                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_ratings_dist', ?)",
-                (book_id, data["ratings_dist"]),
-            )
-            saved.append(f"ratings_dist")
-
-        # ── Cover image URL ───────────────────────────────────────────────────
-        if data.get("image_url"):
-            con.execute(
-                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_image_url', ?)",
-                (book_id, data["image_url"]),
-            )
-            saved.append("gr_image_url")
-
-        # ── Original publication year ─────────────────────────────────────────
-        if data.get("original_pub_year"):
-            con.execute(
-                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_orig_pub_year', ?)",
-                (book_id, data["original_pub_year"]),
-            )
-            saved.append(f"orig_pub_year({data['original_pub_year']})")
-
-        # ── Reviews ───────────────────────────────────────────────────────────
-        new_reviews = 0
-        for rev in data.get("reviews", []):
-            if not rev.get("gr_review_id") or not rev.get("text"):
-                continue
-            result = con.execute("""
-                INSERT OR IGNORE INTO book_reviews
-                    (book, source, reviewer, reviewer_url, rating, review_date,
-                     text, like_count, spoiler, gr_review_id)
-                VALUES (?, 'goodreads', ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                book_id,
-                rev["reviewer"], rev["reviewer_url"],
-                rev["rating"],   rev["review_date"],
-                rev["text"],     rev["like_count"],
-                rev["spoiler"],  rev["gr_review_id"],
-            ))
-            if result.rowcount:
-                new_reviews += 1
-        if new_reviews:
-            saved.append(f"reviews({new_reviews})")
-
-        con.commit()
-    finally:
-        con.close()
+    # ── Identifiers: ASIN + Kindle ASIN (always overwrite — GR is authoritative) ──
+    for id_type, val in [("asin", data["asin"]), ("kindle_asin", data.get("kindle_asin", ""))]:
+        if not val:
+            continue
+        con.execute(
+            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, ?, ?)",
+            (book_id, id_type, val),
+        )
+        saved.append(id_type)
+
+    # ── Publisher (replace) ───────────────────────────────────────────────
+    if data["publisher"]:
+        names.publishers.link(book_id, [names.publishers.id(data["publisher"])], replace=True)
+        saved.append(f"publisher({data['publisher']})")
+
+    # ── Publication date (replace) ────────────────────────────────────────
+    if data["pub_ms"]:
+        calibre_date = ms_to_calibre_date(data["pub_ms"])
+        if calibre_date:
+            con.execute("UPDATE books SET pubdate = ? WHERE id = ?", (calibre_date, book_id))
+            saved.append(f"pubdate({calibre_date[:10]})")
+
+    # ── Page count ───────────────────────────────────────────────────────
+    if data["num_pages"]:
+        con.execute(
+            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_pages', ?)",
+            (book_id, str(data["num_pages"])),
+        )
+        saved.append(f"pages({data['num_pages']})")
+
+    # ── Work ID ───────────────────────────────────────────────────────────
+    if data.get("gr_work_id"):
+        con.execute(
+            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_work_id', ?)",
+            (book_id, data["gr_work_id"]),
+        )
+        saved.append(f"gr_work_id({data['gr_work_id']})")
+
+    # ── Rating + count (replace) ──────────────────────────────────────────
+    if data["avg_rating"]:
+        con.execute(
+            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_rating', ?)",
+            (book_id, data["avg_rating"]),
+        )
+        saved.append(f"rating({data['avg_rating']})")
+    if data["rating_count"]:
+        con.execute(
+            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_rating_count', ?)",
+            (book_id, data["rating_count"]),
+        )
+    if data.get("ratings_dist"):
+        con.execute(
+            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_ratings_dist', ?)",
+            (book_id, data["ratings_dist"]),
+        )
+        saved.append(f"ratings_dist")
+
+    # ── Cover image URL ───────────────────────────────────────────────────
+    if data.get("image_url"):
+        con.execute(
+            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_image_url', ?)",
+            (book_id, data["image_url"]),
+        )
+        saved.append("gr_image_url")
+
+    # ── Original publication year ─────────────────────────────────────────
+    if data.get("original_pub_year"):
+        con.execute(
+            "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_orig_pub_year', ?)",
+            (book_id, data["original_pub_year"]),
+        )
+        saved.append(f"orig_pub_year({data['original_pub_year']})")
+
+    # ── Reviews ───────────────────────────────────────────────────────────
+    new_reviews = 0
+    for rev in data.get("reviews", []):
+        if not rev.get("gr_review_id") or not rev.get("text"):
+            continue
+        result = con.execute("""
+            INSERT OR IGNORE INTO book_reviews
+                (book, source, reviewer, reviewer_url, rating, review_date,
+                 text, like_count, spoiler, gr_review_id)
+            VALUES (?, 'goodreads', ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            book_id,
+            rev["reviewer"], rev["reviewer_url"],
+            rev["rating"],   rev["review_date"],
+            rev["text"],     rev["like_count"],
+            rev["spoiler"],  rev["gr_review_id"],
+        ))
+        if result.rowcount:
+            new_reviews += 1
+    if new_reviews:
+        saved.append(f"reviews({new_reviews})")
 
     return saved
 
@@ -648,49 +747,61 @@ def process_db(label, db_path, progress):
 
     ok_count = err_count = 0
 
-    for i, book in enumerate(todo, 1):
-        bid   = book["id"]
-        title = book["title"] or ""
-        gr_id = book["gr_id"]
-
-        print(f"  [{i}/{total}] {title[:55]!r}  GR:{gr_id} ... ", end="", flush=True)
-
-        data, err = fetch_book_page(gr_id)
-
-        if err:
-            print(f"ERROR: {err}")
-            write_log(bid, title, gr_id, [], err)
-            err_count += 1
-            if err == "book node not found in Apollo state":
-                _wipe_and_reset(db_path, bid, rejected_gr_id=gr_id)
-                print(f"  → all identifiers wiped, will re-scrape")
-                # do NOT add to done — let find_goodreads_ids re-match it
-            elif err in PERMANENT_ERRORS:
-                done.add(bid)  # bad GR ID — no point retrying
-        else:
-            if not data.get("is_english", True) and not data.get("is_audiobook"):
-                print(f"[lang={data.get('language','?')}] ", end="")
-            saved = save_metadata(db_path, bid, data, original_gr_id=gr_id)
-            display = [s for s in saved if s != "RESET"]
-            print(", ".join(display) if display else "nothing new")
-            write_log(bid, title, gr_id, display)
-            ok_count += 1
-            if "RESET" not in saved:
-                done.add(bid)
-
+    def checkpoint():
+        # Runs after each commit, so the file never lists an uncommitted book
         progress["done_ids"] = list(done)
-
-        if i % 10 == 0:
-            save_progress(progress)
-
-        if i % BATCH_SIZE == 0:
-            print(f"\n  ── Batch {i // BATCH_SIZE} done: {ok_count} ok, {err_count} errors ──")
-            print(f"  Pausing {BATCH_PAUSE}s ...\n")
-            time.sleep(BATCH_PAUSE)
-        else:
-            time.sleep(random.uniform(DELAY_MIN, DELAY_MAX))
-
-    save_progress(progress)
+        save_progress(progress)
+
+    with DBWriter(db_path, open_db, on_commit=checkpoint) as writer:
+        HTTP.before_network = writer.flush   # don't hold the write lock while Goodreads answers
+        try:
+            for i, book in enumerate(todo, 1):
+                bid   = book["id"]
+                title = book["title"] or ""
+                gr_id = book["gr_id"]
+
+                print(f"  [{i}/{total}] {title[:55]!r}  GR:{gr_id} ... ", end="", flush=True)
+
+                data, err = fetch_book_page(gr_id)
+
+                if err:
+                    print(f"ERROR: {err}")
+                    write_log(bid, title, gr_id, [], err)
+                    err_count += 1
+                    if err == "book node not found in Apollo state":
+                        with writer.book() as con:
+                            _wipe_and_reset(con, bid, rejected_gr_id=gr_id)
+                        print(f"  → all identifiers wiped, will re-scrape")
+                        # do NOT add to done — let find_goodreads_ids re-match it
+                    else:
+                        with writer.book(writes=False):
+                            if err in PERMANENT_ERRORS:
+                                done.add(bid)  # bad GR ID — no point retrying
+                else:
+                    if not data.get("is_english", True) and not data.get("is_audiobook"):
+                        print(f"[lang={data.get('language','?')}] ", end="")
+                    with writer.book() as con:
+                        saved = save_metadata(con, writer.names, bid, data, original_gr_id=gr_id)
+                        if "RESET" not in saved:
+                            done.add(bid)
+                    display = [s for s in saved if s != "RESET"]
+                    print(", ".join(display) if display else "nothing new")
+                    write_log(bid, title, gr_id, display)
+                    ok_count += 1
+
+                if i % BATCH_SIZE == 0:
+                    print(f"\n  ── Batch {i // BATCH_SIZE} done: {ok_count} ok, {err_count} errors ──")
+                    if HTTP.used_network():
+                        writer.flush()
+                        print(f"  Pausing {BATCH_PAUSE}s ...\n")
+                        time.sleep(BATCH_PAUSE)
+                elif HTTP.used_network():
+                    writer.flush()
+                    time.sleep(random.uniform(DELAY_MIN, DELAY_MAX))
+        finally:
+            HTTP.before_network = None
+
+    checkpoint()
     print(f"\n[{label}] Done: {ok_count} updated, {err_count} errors")
 
 
@@ -724,6 +835,10 @@ def test_gr_id(gr_id):
 
 
 def main():
+    if "--offline" in sys.argv:
+        # Replay from the HTTP cache only (e.g. to re-run parsing after a fix)
+        sys.argv.remove("--offline")
+        HTTP.offline = True
     # --test GR_ID: fetch and print a single GR page without writing to DB
     args = sys.argv[1:]
     if "--test" in args:
@@ -12,6 +12,7 @@ Usage:
     python3 scrape_goodreads_shelves.py david        # one user
     python3 scrape_goodreads_shelves.py /path/to/metadata.db
     python3 scrape_goodreads_shelves.py --dry-run [user]   # print without saving
+    python3 scrape_goodreads_shelves.py --offline [user]   # replay cached pages only
 """
 
 import json
@@ -23,9 +24,11 @@ import sys
 import time
 from datetime import datetime
 
-import requests
 from bs4 import BeautifulSoup
 
+from db_writer import DBWriter
+from http_cache import HTTPCache
+
 # ── Config ────────────────────────────────────────────────────────────────────
 
 PERMANENT_ERRORS = {"404 not found"}
@@ -48,6 +51,9 @@ HEADERS = {
     "Accept-Language": "en-US,en;q=0.5",
 }
 
+# Pages already fetched are replayed from data/http_cache.db (see http_cache.py)
+HTTP = HTTPCache()
+
 # Shelves that indicate reading status or ownership — not genres
 SKIP_SHELVES = {
     "to-read", "currently-reading", "read", "re-read", "did-not-finish", "dnf",
@@ -75,7 +81,7 @@ def fetch_shelves(gr_id):
     """
     url = f"https://www.goodreads.com/work/shelves/{gr_id}"
     try:
-        r = requests.get(url, headers=HEADERS, timeout=20)
+        r = HTTP.get(url, headers=HEADERS, timeout=20)
     except Exception as e:
         return None, str(e)
 
@@ -84,7 +90,12 @@ def fetch_shelves(gr_id):
     if r.status_code != 200:
         return None, f"HTTP {r.status_code}"
 
-    soup = BeautifulSoup(r.text, "html.parser")
+    return parse_shelves(r.text), None
+
+
+def parse_shelves(html):
+    """The (shelf_name, count) list of a work/shelves page, as fetch_shelves returns it."""
+    soup = BeautifulSoup(html, "html.parser")
     shelves = []
     for el in soup.select(".shelfStat"):
         name_tag = el.select_one("a.mediumText")
@@ -100,7 +111,7 @@ def fetch_shelves(gr_id):
         shelves.append((name, count))
 
     shelves.sort(key=lambda x: x[1], reverse=True)
-    return shelves, None
+    return shelves
 
 # ── Database ──────────────────────────────────────────────────────────────────
 
@@ -130,28 +141,11 @@ def get_books_with_work_id(db_path):
     con.close()
     return [dict(r) for r in rows]
 
-def save_tags(db_path, book_id, tags):
-    """Replace all existing tags on the book with the supplied list."""
-    con = open_db(db_path)
-    try:
-        # Remove all existing tags for this book
-        con.execute("DELETE FROM books_tags_link WHERE book = ?", (book_id,))
-        for tag_name in tags:
-            con.execute("INSERT OR IGNORE INTO tags (name, link) VALUES (?, '')", (tag_name,))
-            row = con.execute(
-                "SELECT id, name FROM tags WHERE name = ? COLLATE NOCASE", (tag_name,)
-            ).fetchone()
-            tag_id = row[0]
-            # Normalise casing in the tags table to match what we store
-            if row[1] != tag_name:
-                con.execute("UPDATE tags SET name = ? WHERE id = ?", (tag_name, tag_id))
-            con.execute(
-                "INSERT OR IGNORE INTO books_tags_link (book, tag) VALUES (?, ?)",
-                (book_id, tag_id),
-            )
-        con.commit()
-    finally:
-        con.close()
+def save_tags(names, book_id, tags):
+    """Replace all existing tags on the book with the supplied list (through a DBWriter's `names`)."""
+    # recase: normalise casing in the tags table to match what we store
+    tag_ids = names.tags.ids(tags, recase=True)
+    names.tags.link(book_id, tag_ids.values(), replace=True)
 
 # ── Logging ───────────────────────────────────────────────────────────────────
 
@@ -216,60 +210,71 @@ def process_db(label, db_path, progress, dry_run=False):
 
     ok_count = err_count = 0
 
-    for i, book in enumerate(todo, 1):
-        bid      = book["id"]
-        title    = book["title"] or ""
-        work_id  = book["gr_work_id"]
-
-        print(f"  [{i}/{total}] {title[:55]!r}  work:{work_id} ... ", end="", flush=True)
-
-        shelves, err = fetch_shelves(work_id)
-
-        if err:
-            print(f"ERROR: {err}")
-            write_log(bid, title, work_id, [], err)
-            err_count += 1
-            if err in PERMANENT_ERRORS:
-                done.add(bid)  # bad work ID — no point retrying
-        else:
-            top = [name for name, _ in shelves[:TOP_N]]
-            if not top:
-                print("no genre shelves found")
-                write_log(bid, title, work_id, [], "no_genre_shelves")
-            else:
-                if not dry_run:
-                    save_tags(db_path, bid, top)
-                    counts_val = ";".join(f"{name}:{cnt}" for name, cnt in shelves[:TOP_N])
-                    con = open_db(db_path)
-                    con.execute(
-                        "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_shelf_counts', ?)",
-                        (bid, counts_val),
-                    )
-                    con.commit()
-                    con.close()
-                write_log(bid, title, work_id, top)
-                counts = [f"{name}({cnt})" for name, cnt in shelves[:TOP_N]]
-                print(", ".join(counts))
-                ok_count += 1
-            done.add(bid)
-
+    def checkpoint():
+        # Runs after each commit, so the file never lists an uncommitted book
         progress["done_ids"] = list(done)
-
-        if i % 10 == 0:
-            save_progress(progress)
-
-        if i % BATCH_SIZE == 0:
-            print(f"\n  ── Batch {i // BATCH_SIZE} done: {ok_count} ok, {err_count} errors ──")
-            print(f"  Pausing {BATCH_PAUSE}s ...\n")
-            time.sleep(BATCH_PAUSE)
-        else:
-            time.sleep(random.uniform(DELAY_MIN, DELAY_MAX))
-
-    save_progress(progress)
+        save_progress(progress)
+
+    with DBWriter(db_path, open_db, on_commit=checkpoint) as writer:
+        HTTP.before_network = writer.flush   # don't hold the write lock while Goodreads answers
+        try:
+            for i, book in enumerate(todo, 1):
+                bid      = book["id"]
+                title    = book["title"] or ""
+                work_id  = book["gr_work_id"]
+
+                print(f"  [{i}/{total}] {title[:55]!r}  work:{work_id} ... ", end="", flush=True)
+
+                shelves, err = fetch_shelves(work_id)
+
+                if err:
+                    print(f"ERROR: {err}")
+                    write_log(bid, title, work_id, [], err)
+                    err_count += 1
+                    with writer.book(writes=False):
+                        if err in PERMANENT_ERRORS:
+                            done.add(bid)  # bad work ID — no point retrying
+                else:
+                    top = [name for name, _ in shelves[:TOP_N]]
+                    with writer.book(writes=bool(top) and not dry_run) as con:
+                        if con is not None:
+                            save_tags(writer.names, bid, top)
+                            counts_val = ";".join(f"{name}:{cnt}" for name, cnt in shelves[:TOP_N])
+                            con.execute(
+                                "INSERT OR REPLACE INTO identifiers (book, type, val) VALUES (?, 'gr_shelf_counts', ?)",
+                                (bid, counts_val),
+                            )
+                        done.add(bid)
+                    if not top:
+                        print("no genre shelves found")
+                        write_log(bid, title, work_id, [], "no_genre_shelves")
+                    else:
+                        write_log(bid, title, work_id, top)
+                        counts = [f"{name}({cnt})" for name, cnt in shelves[:TOP_N]]
+                        print(", ".join(counts))
+                        ok_count += 1
+
+                if i % BATCH_SIZE == 0:
+                    print(f"\n  ── Batch {i // BATCH_SIZE} done: {ok_count} ok, {err_count} errors ──")
+                    if HTTP.used_network():
+                        writer.flush()
+                        print(f"  Pausing {BATCH_PAUSE}s ...\n")
+                        time.sleep(BATCH_PAUSE)
+                elif HTTP.used_network():
+                    writer.flush()
+                    time.sleep(random.uniform(DELAY_MIN, DELAY_MAX))
+        finally:
+            HTTP.before_network = None
+
+    checkpoint()
     print(f"\n[{label}] Done: {ok_count} updated, {err_count} errors")
 
 
 def main():
+    if "--offline" in sys.argv:
+        # Replay from the HTTP cache only (e.g. to re-run parsing after a fix)
+        sys.argv.remove("--offline")
+        HTTP.offline = True
     dry_run = "--dry-run" in sys.argv
 
     db_paths = resolve_db_paths(sys.argv)
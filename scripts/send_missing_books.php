@@ -1,8 +1,9 @@
 <?php
 /**
  * Sends each line from missing-books-results.txt to the IRC request-file API,
- * then waits for a new file to appear in /downloaded-files before sending the
- * next request. A 5–15 second delay is added after a confirmed transfer.
+ * then waits on the daemon's transfer events for that request until its file
+ * arrives before sending the next request. A 5–15 second delay is added after a
+ * confirmed transfer.
  *
  * CLI:  php scripts/send_missing_books.php [options]
  *
@@ -41,7 +42,7 @@ for ($i = 1; $i < count($args); $i++) {
 }
 
 const API_BASE         = 'https://node2.nilla.local';
-const POLL_INTERVAL    = 5;   // seconds between /downloaded-files polls
+const POLL_INTERVAL    = 5;   // seconds per /events/poll long-poll
 const MIN_POST_DELAY   = 5;   // seconds to wait after a confirmed transfer
 const MAX_POST_DELAY   = 15;
 
@@ -102,12 +103,12 @@ $toSend = array_slice($queue, 0, $limit);
 
 // ── cURL helpers ──────────────────────────────────────────────────────────────
 
-function curlGet(string $url): ?string
+function curlGet(string $url, int $timeout = 15): ?string
 {
     $ch = curl_init($url);
     curl_setopt_array($ch, [
         CURLOPT_RETURNTRANSFER => true,
-        CURLOPT_TIMEOUT        => 15,
+        CURLOPT_TIMEOUT        => $timeout,
         CURLOPT_SSL_VERIFYPEER => false,
         CURLOPT_SSL_VERIFYHOST => false,
     ]);
@@ -117,73 +118,66 @@ function curlGet(string $url): ?string
     return $err ? null : $body;
 }
 
-function sendRequest(string $cmd): bool
+/**
+ * Send one request command. Returns the daemon's response (with request_id
+ * and event cursor), or null on failure.
+ */
+function sendRequest(string $cmd): ?array
 {
-    $body = curlGet(API_BASE . '/request-file?cmd=' . rawurlencode($cmd));
+    $body = curlGet(API_BASE . '/request-file?cmd=' . rawurlencode($cmd) . '&priority=bulk');
     if ($body === null) {
         echo " [ERROR: curl failed]";
-        return false;
+        return null;
     }
     $data = json_decode($body, true);
     $msg  = $data['status'] ?? $data['error'] ?? 'ok';
     echo " [$msg]";
-    return empty($data['error']);
+    return empty($data['error']) ? $data : null;
 }
 
 /**
- * Fetch the most recent file modification time from /downloaded-files.
- * Returns a Unix timestamp, or 0 on failure.
- */
-function getNewestFileMtime(): int
-{
-    $body = curlGet(API_BASE . '/downloaded-files');
-    if ($body === null) return 0;
-    $files = json_decode($body, true);
-    if (!is_array($files) || empty($files)) return 0;
-
-    $newest = 0;
-    foreach ($files as $f) {
-        $mt = strtotime($f['modified'] ?? '') ?: 0;
-        if ($mt > $newest) $newest = $mt;
-    }
-    return $newest;
-}
-
-/**
- * Poll /downloaded-files until a file with mtime > $baseline appears,
- * or until $maxWait seconds have elapsed.
+ * Long-poll /events/poll for this request until its transfer completes or
+ * fails, or until $maxWait seconds have elapsed.
  *
- * Returns ['name' => string, 'elapsed' => int] on success, or null on timeout.
+ * Returns ['name' => string, 'elapsed' => int] on success,
+ * ['failed' => true, 'name' => string, 'error' => string] on failure,
+ * or null on timeout.
  */
-function waitForTransfer(int $baseline, int $maxWait): ?array
+function waitForTransfer(string $requestId, int $cursor, int $maxWait): ?array
 {
-    $deadline = time() + $maxWait;
+    $start    = time();
+    $deadline = $start + $maxWait;
     $dots     = 0;
+    $progress = [];
 
     while (time() < $deadline) {
-        sleep(POLL_INTERVAL);
-
-        $body = curlGet(API_BASE . '/downloaded-files');
-        if ($body === null) {
+        $wait = max(1, min(POLL_INTERVAL, $deadline - time()));
+        $body = curlGet(API_BASE . '/events/poll?request_id=' . rawurlencode($requestId)
+            . "&cursor={$cursor}&timeout={$wait}", $wait + 10);
+        $resp = $body === null ? null : json_decode($body, true);
+        if (!is_array($resp)) {
             echo "\r  [poll error, retrying...]" . str_repeat(' ', 10);
+            sleep(POLL_INTERVAL);
             continue;
         }
+        $cursor = (int)($resp['cursor'] ?? $cursor);
 
-        $files = json_decode($body, true);
-        if (!is_array($files)) continue;
-
-        foreach ($files as $f) {
-            $mt = strtotime($f['modified'] ?? '') ?: 0;
-            if ($mt > $baseline) {
-                $elapsed = time() - ($deadline - $maxWait);
-                return ['name' => $f['name'] ?? '?', 'elapsed' => $elapsed];
+        foreach ($resp['events'] ?? [] as $ev) {
+            if ($ev['event'] === 'completed') {
+                return ['name' => $ev['filename'] ?? '?', 'elapsed' => time() - $start];
+            }
+            if ($ev['event'] === 'failed') {
+                return ['failed' => true, 'name' => $ev['filename'] ?? '?', 'error' => $ev['error'] ?? 'failed'];
             }
+            $progress = $ev;
         }
 
         $remaining = $deadline - time();
         $dots = ($dots + 1) % 4;
-        echo "\r  Waiting for transfer" . str_repeat('.', $dots) . str_repeat(' ', 4 - $dots)
-           . " ({$remaining}s remaining)" . str_repeat(' ', 5);
+        $what = $progress
+            ? sprintf("Receiving %s / %s bytes", $progress['bytes'] ?? 0, $progress['size'] ?? '?')
+            : "Waiting for transfer" . str_repeat('.', $dots) . str_repeat(' ', 4 - $dots);
+        echo "\r  {$what} ({$remaining}s remaining)" . str_repeat(' ', 5);
     }
 
     return null; // timed out
@@ -204,20 +198,17 @@ foreach ($toSend as $idx => $cmd) {
         continue;
     }
 
-    // Snapshot current newest file before sending
-    $baselineMtime = getNewestFileMtime();
-
-    $ok = sendRequest($cmd);
+    $sent = sendRequest($cmd);
     echo "\n";
 
-    if (!$ok) {
+    if ($sent === null) {
         echo "  Request failed — skipping.\n\n";
         continue;
     }
 
-    // Wait for a new file to appear in /downloaded-files
+    // Follow this request until its file arrives
     echo "  Watching for incoming transfer (timeout {$maxWait}s)...\n";
-    $result = waitForTransfer($baselineMtime, $maxWait);
+    $result = waitForTransfer($sent['request_id'] ?? '', (int)($sent['cursor'] ?? 0), $maxWait);
     echo "\r" . str_repeat(' ', 60) . "\r";
 
     if ($result === null) {
@@ -229,6 +220,14 @@ foreach ($toSend as $idx => $cmd) {
         continue;
     }
 
+    if (!empty($result['failed'])) {
+        echo "  [FAILED] {$result['name']}: {$result['error']} — moving on.\n\n";
+        fwrite($sentFh, $cmd . "\n");
+        fflush($sentFh);
+        $sentCount++;
+        continue;
+    }
+
     echo "  [OK] Received: {$result['name']} (after {$result['elapsed']}s)\n";
 
     // Record as sent